@@ -0,0 +1,194 @@
+"""benchmarks of the acquisition with the simulators and the preprocessors of ipysetup
+
+The results of ``asv run`` are written in json to ``.asv/results``, see
+``asv compare`` and ``asv publish`` to compare them across the releases.
+"""
+import os
+import time
+
+import bluesky.preprocessors as bpp
+import pyFAI
+from pkg_resources import resource_filename
+
+from xpdacq.beamtime import Beamtime, Tlist, Tramp, ct, tseries
+from xpdacq.devices import CalibrationData
+from xpdacq.glbl import glbl
+from xpdacq.ipysetup import (
+    _add_many_calib_preprocessors,
+    _add_many_dark_preprocessors,
+    _add_many_shutter_preprocessors,
+    _set_calib_preprocessor,
+)
+from xpdacq.plans import MultiDistPlans
+from xpdacq.preprocessors import ShutterConfig
+from xpdacq.simulators import FilterBank, PerkinElmerDetector, RingCurrent, Stage, WorkSpace
+from xpdacq.twodetectors import TwoDetectors
+from xpdacq.xpdacq import CustomizedRunEngine
+from xpdacq.xpdacq_conf import configure_device
+from xpdacq.yamldict import suspend_flush
+
+PONI_FILE = resource_filename("xpdacq", "tests/Ni_poni_file.poni")
+# the simulated exposures are short so that the scans are limited by the software
+FRAME_ACQ_TIME = 0.001
+SCANS = ["ct", "Tramp", "Tlist", "tseries", "TwoDetectors.grid_scan", "MultiDistPlans"]
+
+
+class AcqWorkSpace(WorkSpace):
+    """The simulators with two detectors and an xrun with the preprocessors added by ipysetup."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        # the glbl file is written when the beamtime is linked to xrun
+        os.makedirs(os.path.dirname(glbl.filepath), exist_ok=True)
+        self.det2 = PerkinElmerDetector(name="pe2")
+        self.stage = Stage(name="det_stage")
+        configure_device(
+            area_det=self.det,
+            shutter=self.shutter,
+            temp_controller=self.eurotherm,
+            db=self.db,
+            filter_bank=FilterBank(name="fb"),
+            ring_current=RingCurrent(name="ring_current", value=400.),
+            other_dets=[self.det2]
+        )
+        with suspend_flush():
+            bt = Beamtime("Billinge", 300000, ["van der Banerjee", "Terban"], wavelength=0.1828)
+        xrun = CustomizedRunEngine(None)
+        xrun.beamtime = bt
+        xrun.subscribe(self.db.v1.insert)
+        dets = [self.det, self.det2]
+        sc = ShutterConfig.from_xpdacq()
+        _add_many_dark_preprocessors(xrun, dets, sc)
+        _add_many_calib_preprocessors(xrun, dets, [self.stage.z, None])
+        _add_many_shutter_preprocessors(xrun, dets, sc)
+        _set_calib_preprocessor(
+            xrun.calib_preprocessors[0],
+            {"config_base": os.path.dirname(PONI_FILE), "calib_config_name": os.path.basename(PONI_FILE)},
+            self.stage.z
+        )
+        self.xrun = xrun
+
+    def make_plan(self, scan: str):
+        """Return a plan of about ten exposures."""
+        exposure = FRAME_ACQ_TIME
+        if scan == "ct":
+            return bpp.pchain(*(ct([self.det], exposure) for _ in range(10)))
+        if scan == "Tramp":
+            return Tramp([self.det], exposure, 300., 309., 1.)
+        if scan == "Tlist":
+            return Tlist([self.det], exposure, [300. + i for i in range(10)])
+        if scan == "tseries":
+            return tseries([self.det], exposure, 0., 10)
+        if scan == "TwoDetectors.grid_scan":
+            two_dets = TwoDetectors(self.det, self.det2, self.stage.x, 0., 1.)
+            return two_dets.grid_scan([], self.stage.y, 0., 1., 5)
+        if scan == "MultiDistPlans":
+            mdp = MultiDistPlans(
+                self.shutter, "open", "closed", self.db, self.det, CalibrationData(name="calib"), self.stage.x
+            )
+            mdp.add_dist(0., "dist0", pyFAI.AzimuthalIntegrator(dist=0.2))
+            mdp.add_dist(1., "dist1", pyFAI.AzimuthalIntegrator(dist=0.4))
+            return mdp.count([self.det], 5)
+        raise ValueError("Unknown scan: {}.".format(scan))
+
+
+class _Counter:
+    """count the messages and documents and time the events of each run"""
+
+    def __init__(self):
+        self.n_msgs = 0
+        self.n_docs = 0
+        self.n_runs = 0
+        self.run_starts = {}
+        self.event_times = {}
+
+    def msg_hook(self, msg):
+        self.n_msgs += 1
+
+    def __call__(self, name, doc):
+        self.n_docs += 1
+        if name == "start":
+            self.n_runs += 1
+        elif name == "descriptor":
+            self.run_starts[doc["uid"]] = doc["run_start"]
+        elif name == "event":
+            # the first and the last event of the run in any stream
+            t = time.perf_counter()
+            run_start = self.run_starts[doc["descriptor"]]
+            first, _ = self.event_times.get(run_start, (t, t))
+            self.event_times[run_start] = (first, t)
+
+    def event_loop_time(self):
+        return sum(last - first for first, last in self.event_times.values())
+
+
+class Acquisition:
+    """messages/s, documents/s and per-run overhead of the scans run by xrun"""
+
+    params = SCANS
+    param_names = ["scan"]
+    timeout = 600
+
+    def setup(self, scan):
+        self.ws = AcqWorkSpace()
+        # set on the area detector in xpd_configuration
+        self.frame_acq_time = glbl["frame_acq_time"]
+        glbl["frame_acq_time"] = FRAME_ACQ_TIME
+
+    def teardown(self, scan):
+        glbl["frame_acq_time"] = self.frame_acq_time
+
+    def _run(self, scan):
+        counter = _Counter()
+        xrun = self.ws.xrun
+        xrun.msg_hook = counter.msg_hook
+        token = xrun.subscribe(counter)
+        plan = self.ws.make_plan(scan)
+        t0 = time.perf_counter()
+        try:
+            xrun({}, plan)
+        finally:
+            wall = time.perf_counter() - t0
+            xrun.unsubscribe(token)
+            xrun.msg_hook = None
+        return wall, counter
+
+    def time_xrun(self, scan):
+        self._run(scan)
+
+    def track_msgs_per_second(self, scan):
+        wall, counter = self._run(scan)
+        return counter.n_msgs / wall
+
+    track_msgs_per_second.unit = "messages/s"
+
+    def track_docs_per_second(self, scan):
+        wall, counter = self._run(scan)
+        return counter.n_docs / wall
+
+    track_docs_per_second.unit = "documents/s"
+
+    def track_run_overhead(self, scan):
+        """the time per run outside of the event streams: preparing the plan, opening and closing the run"""
+        wall, counter = self._run(scan)
+        return (wall - counter.event_loop_time()) / counter.n_runs
+
+    track_run_overhead.unit = "seconds"
+
+    def peakmem_xrun(self, scan):
+        self._run(scan)
+
+
+class Startup:
+    """time to import xpdacq and to set up the simulated beamline"""
+
+    timeout = 300
+
+    def timeraw_import(self):
+        return "import xpdacq.ipysetup, xpdacq.simulators"
+
+    def time_workspace(self):
+        AcqWorkSpace()
+
+    def peakmem_workspace(self):
+        AcqWorkSpace()
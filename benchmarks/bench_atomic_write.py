@@ -0,0 +1,33 @@
+"""benchmarks of the durability levels of the yaml writes"""
+import os
+import shutil
+import tempfile
+
+import yaml
+
+from xpdacq.tools import atomic_write
+
+
+class AtomicWrite:
+    """time to write a yaml file in place and at each durability level"""
+
+    params = (["in-place", "none", "fsync-file", "fsync-dir"], [10, 1000])
+    param_names = ["durability", "n_keys"]
+
+    def setup(self, durability, n_keys):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, "sample.yml")
+        self.text = yaml.dump(
+            {"key_{}".format(i): "value_{}".format(i) for i in range(n_keys)}
+        )
+        atomic_write(self.filepath, self.text, durability="none")
+
+    def teardown(self, durability, n_keys):
+        shutil.rmtree(self.tmp_dir)
+
+    def time_write(self, durability, n_keys):
+        if durability == "in-place":
+            with open(self.filepath, "w") as f:
+                f.write(self.text)
+        else:
+            atomic_write(self.filepath, self.text, durability=durability)
@@ -0,0 +1,94 @@
+"""benchmarks of the message mutators of xpdacq_composer"""
+import time
+
+import bluesky.preprocessors as bpp
+import ophyd
+from bluesky.utils import Msg
+
+from xpdacq.beamtime import tseries
+from xpdacq.simulation import cs700, fb, pe1c, shctl1
+from xpdacq.xpdacq import (
+    _inject_analysis_stage,
+    _inject_filter_positions,
+    _inject_xpdacq_md_version,
+    inject_metadata,
+    xpdacq_composer,
+)
+from xpdacq.xpdacq_conf import configure_device
+
+SAMPLE = {"sample_name": "Ni", "sample_composition": {"Ni": 1}}
+
+
+def _reply(msg):
+    # only the signals are read by the mutators and the plan set up
+    if msg.command == "read" and isinstance(msg.obj, ophyd.Signal):
+        return msg.obj.read()
+    return None
+
+
+def _drive(plan):
+    """run the plan without a RunEngine and return the number of messages"""
+    n_msgs = 0
+    ret = None
+    try:
+        while True:
+            msg = plan.send(ret)
+            n_msgs += 1
+            ret = _reply(msg)
+    except StopIteration:
+        return n_msgs
+
+
+def _replay(msgs):
+    for msg in msgs:
+        if msg.command == "open_run":
+            # the mutators edit the kwargs
+            msg = Msg(msg.command, msg.obj, *msg.args, **msg.kwargs)
+        yield msg
+
+
+def _chain(plan):
+    """the layers of xpdacq_composer before the MsgDispatcher"""
+    plan = inject_metadata(plan, SAMPLE)
+    plan = bpp.msg_mutator(plan, _inject_xpdacq_md_version)
+    plan = bpp.msg_mutator(plan, _inject_analysis_stage)
+    return bpp.plan_mutator(plan, _inject_filter_positions)
+
+
+class Composer:
+    """messages per second through the mutators of a tseries of 10,000 frames"""
+
+    params = ["chain", "fused"]
+    param_names = ["mutators"]
+    timeout = 300
+
+    def setup(self, mutators):
+        configure_device(
+            area_det=pe1c, shutter=shctl1, temp_controller=cs700, db=None, filter_bank=fb
+        )
+        plan = tseries([pe1c], 0.1, 0, 10000)
+        self.msgs = []
+        ret = None
+        try:
+            while True:
+                msg = plan.send(ret)
+                self.msgs.append(msg)
+                ret = _reply(msg)
+        except StopIteration:
+            pass
+
+    def _compose(self, mutators):
+        plan = _replay(self.msgs)
+        if mutators == "chain":
+            return _chain(plan)
+        return xpdacq_composer(None, SAMPLE, plan)
+
+    def time_compose(self, mutators):
+        _drive(self._compose(mutators))
+
+    def track_msgs_per_second(self, mutators):
+        t0 = time.perf_counter()
+        n_msgs = _drive(self._compose(mutators))
+        return n_msgs / (time.perf_counter() - t0)
+
+    track_msgs_per_second.unit = "messages/s"
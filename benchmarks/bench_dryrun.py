@@ -0,0 +1,41 @@
+"""benchmarks of the estimation of the duration of a queue by CustomizedRunEngine.simulate"""
+from xpdacq.beamtime import Beamtime, ScanPlan, Tramp, ct, tseries
+from xpdacq.dryrun import CostModel, estimate_queue
+from xpdacq.preprocessors import DarkPreprocessor, ShutterConfig, ShutterPreprocessor
+from xpdacq.simulation import cs700, fb, pe1c, shctl1
+from xpdacq.xpdacq_conf import configure_device
+from xpdacq.yamldict import suspend_flush
+
+
+class Simulate:
+    """time to estimate a queue of samples running the same three ScanPlans in turn"""
+
+    params = [100, 1000]
+    param_names = ["n_samples"]
+    timeout = 300
+
+    def setup(self, n_samples):
+        configure_device(
+            area_det=pe1c, shutter=shctl1, temp_controller=cs700, db=None, filter_bank=fb
+        )
+        with suspend_flush():
+            bt = Beamtime("Billinge", 300000, ["van der Banerjee", "Terban"], wavelength=0.1828)
+            scanplans = [ScanPlan(bt, ct, 5), ScanPlan(bt, Tramp, 5, 300, 310, 5), ScanPlan(bt, tseries, 5, 10, 3)]
+        sc = ShutterConfig.from_xpdacq()
+        self.dark_preprocessors = [DarkPreprocessor(detector=pe1c, max_age=60., shutter_config=sc)]
+        self.shutter_preprocessors = [ShutterPreprocessor(detector=pe1c, shutter_config=sc)]
+        self.model = CostModel.from_xpdacq(
+            self.dark_preprocessors, self.shutter_preprocessors, ramp_rates={cs700.name: 0.2}
+        )
+        self.samples = [{"sample_name": "sample{}".format(i)} for i in range(n_samples)]
+        self.plans = [scanplans[i % 3] for i in range(n_samples)]
+        # the ScanPlans are walked in the first estimation
+        self._estimate()
+
+    def _estimate(self):
+        return estimate_queue(
+            self.samples, self.plans, self.model, self.dark_preprocessors, self.shutter_preprocessors
+        )
+
+    def time_estimate_queue(self, n_samples):
+        self._estimate()
@@ -0,0 +1,33 @@
+"""benchmarks of the glbl updates done in the RunEngine callbacks"""
+import os
+import shutil
+import tempfile
+
+from xpdconf.conf import glbl_dict
+
+from xpdacq.tools import wait_flushed
+from xpdacq.xpdacq_conf import GlblYamlDict
+
+
+class DarkDictUpdate:
+    """time for `glbl['_dark_dict_list'] = ...` to return"""
+
+    params = ([False, True], [10, 1000])
+    param_names = ["async_flush", "n_darks"]
+
+    def setup(self, async_flush, n_darks):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.glbl = GlblYamlDict("glbl", **glbl_dict)
+        self.glbl.filepath = os.path.join(self.tmp_dir, "glbl.yml")
+        self.glbl["async_flush"] = async_flush
+        self.dark_dict_list = [
+            {"acq_time": 0.1, "exposure": 5.0, "timestamp": float(i), "uid": str(i)}
+            for i in range(n_darks)
+        ]
+
+    def teardown(self, async_flush, n_darks):
+        wait_flushed()
+        shutil.rmtree(self.tmp_dir)
+
+    def time_update(self, async_flush, n_darks):
+        self.glbl["_dark_dict_list"] = list(self.dark_dict_list)
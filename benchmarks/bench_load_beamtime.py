@@ -0,0 +1,60 @@
+"""benchmarks of loading a beamtime from the yaml directory"""
+import os
+
+import yaml
+
+from xpdacq.beamtime import _link_map
+from xpdacq.beamtimeSetup import load_beamtime
+
+
+def make_yaml_dir(directory, n_samples):
+    """write the yaml files of a beamtime with n_samples samples"""
+    bt_uid = "bench000"
+    os.makedirs(os.path.join(directory, "samples"))
+    os.makedirs(os.path.join(directory, "scanplans"))
+    bt = {
+        "bt_piLast": "Billinge",
+        "bt_safN": "300000",
+        "bt_experimenters": ["van der Banerjee", "Terban"],
+        "bt_wavelength": 0.1828,
+        "bt_uid": bt_uid,
+    }
+    with open(os.path.join(directory, "bt_bt.yml"), "w") as f:
+        yaml.dump(bt, f, default_flow_style=False)
+    order = {}
+    for i in range(n_samples):
+        name = "sample_{}".format(i)
+        sample = {
+            "sample_name": name,
+            "sample_composition": {"Ni": 1},
+            "sample_phase": {"Ni": 1},
+            "tags": ["powder", "room_temperature"],
+            "sa_uid": "{:08d}".format(i),
+        }
+        with open(os.path.join(directory, "samples", name + ".yml"), "w") as f:
+            yaml.dump([sample, _link_map(bt_uid)], f, default_flow_style=False)
+        order[i] = name + ".yml"
+    with open(os.path.join(directory, ".sample_order.yml"), "w") as f:
+        yaml.dump(order, f)
+    with open(os.path.join(directory, ".scanplan_order.yml"), "w") as f:
+        yaml.dump({}, f)
+
+
+class LoadBeamtime:
+    """time to rebuild a beamtime with its samples from the yaml files"""
+
+    params = [100, 1000, 10000]
+    param_names = ["n_samples"]
+    timeout = 600
+
+    def setup_cache(self):
+        directories = {}
+        for n_samples in self.params:
+            directory = os.path.abspath("yml_{}".format(n_samples))
+            make_yaml_dir(directory, n_samples)
+            directories[n_samples] = directory
+        return directories
+
+    def time_load_beamtime(self, directories, n_samples):
+        directory = directories[n_samples]
+        load_beamtime(directory, config_base=directory)
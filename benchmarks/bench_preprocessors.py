@@ -0,0 +1,249 @@
+"""benchmarks of the preprocessors applied by CustomizedRunEngine.gen_plan"""
+import json
+import os
+import tempfile
+import time
+
+import bluesky.plans as bp
+import numpy as np
+from bluesky import RunEngine
+from bluesky.utils import Msg
+from bluesky_darkframes.sim import DiffractionDetector, Shutter
+from frozendict import frozendict
+from ophyd.sim import det, motor
+
+from xpdacq.preprocessors import (
+    CalibPreprocessor,
+    DarkPreprocessor,
+    MaskPreprocessor,
+    PreprocessorPipeline,
+    ShutterConfig,
+    ShutterPreprocessor,
+    StateCache,
+)
+
+CALIB_RESULT = (1.0, 200.0, 1000.0, 1500.0, 0.1, 0.2, 0.3, "Perkin detector")
+# the mask files of the benchmarks
+MASK_DIR = tempfile.mkdtemp()
+
+
+def _drive(plan):
+    """run the plan without a RunEngine and return the number of messages"""
+    n_msgs = 0
+    ret = None
+    try:
+        while True:
+            msg = plan.send(ret)
+            n_msgs += 1
+            ret = None
+    except StopIteration:
+        return n_msgs
+
+
+def _replay(msgs):
+    for msg in msgs:
+        # the preprocessors keep the messages that they have seen
+        yield Msg(msg.command, msg.obj, *msg.args, **msg.kwargs)
+
+
+def _make_pps(detectors, shutter):
+    config = ShutterConfig(shutter, "open", "closed")
+    pps = []
+    for det in detectors:
+        cpp = CalibPreprocessor(det)
+        cpp.add_calib_result({}, CALIB_RESULT)
+        pps.append(cpp)
+    # the dark frame is taken once
+    pps.extend(DarkPreprocessor(detector=det, max_age=1e9, shutter_config=config) for det in detectors)
+    pps.extend(ShutterPreprocessor(detector=det, shutter_config=config) for det in detectors)
+    for det in detectors:
+        mpp = MaskPreprocessor(det, mask_dir=MASK_DIR)
+        mpp.set_mask(np.ones((4, 4)))
+        pps.append(mpp)
+    return pps
+
+
+class Preprocessors:
+    """a scan of 1,000 points with three detectors through the calib, dark, shutter and mask preprocessors"""
+
+    params = ["none", "stacked", "pipeline"]
+    param_names = ["preprocessors"]
+    timeout = 300
+
+    def setup(self, preprocessors):
+        self.detectors = [DiffractionDetector(name="det{}".format(i)) for i in range(3)]
+        self.shutter = Shutter(name="shutter", value="open")
+        self.msgs = list(bp.scan(self.detectors, motor, 0, 1, 1000))
+
+    def _preprocess(self, preprocessors):
+        plan = _replay(self.msgs)
+        if preprocessors == "none":
+            return plan
+        pps = _make_pps(self.detectors, self.shutter)
+        if preprocessors == "pipeline":
+            return PreprocessorPipeline(pps)(plan)
+        for pp in pps:
+            plan = pp(plan)
+        return plan
+
+    def time_preprocess(self, preprocessors):
+        _drive(self._preprocess(preprocessors))
+
+    def track_us_per_msg(self, preprocessors):
+        t0 = time.perf_counter()
+        n_msgs = _drive(self._preprocess(preprocessors))
+        return (time.perf_counter() - t0) / n_msgs * 1e6
+
+    track_us_per_msg.unit = "us/message"
+
+
+class CalibStream:
+    """messages per frame of a count of 1,000 frames with a calib event before each frame or on a change"""
+
+    params = ["always", "on_change"]
+    param_names = ["calib_events"]
+    timeout = 300
+
+    def setup(self, calib_events):
+        self.detector = DiffractionDetector(name="det")
+        self.msgs = list(bp.count([self.detector], 1000))
+        self.on_change = calib_events == "on_change"
+
+    def _preprocess(self):
+        plan = _replay(self.msgs)
+        cpp = CalibPreprocessor(self.detector, locked_signals=[motor], on_change=self.on_change)
+        cpp.add_calib_result({motor.name: 0.}, CALIB_RESULT)
+        return PreprocessorPipeline([cpp])(plan)
+
+    def time_preprocess(self, calib_events):
+        _drive(self._preprocess())
+
+    def track_msgs_per_frame(self, calib_events):
+        return _drive(self._preprocess()) / 1000
+
+    track_msgs_per_frame.unit = "messages/frame"
+
+
+class _PolledCache(StateCache):
+    """the cache without subscriptions, the locked signals are read on every frame"""
+
+    def watch(self, signals):
+        for signal in signals:
+            self._subscriptions.setdefault(id(signal), (signal, None))
+
+
+class LockedSignals:
+    """messages per frame of a count of 1,000 frames with the locked signals of the calib and dark preprocessors"""
+
+    params = ["polled", "subscribed"]
+    param_names = ["locked_signals"]
+    timeout = 300
+
+    def setup(self, locked_signals):
+        self.detector = DiffractionDetector(name="det")
+        # the reads of the messages without a RunEngine give 0
+        self.detector.exposure_time.put(0.)
+        self.shutter = Shutter(name="shutter", value="open")
+        self.msgs = list(bp.count([self.detector], 1000))
+        self.cache_type = _PolledCache if locked_signals == "polled" else StateCache
+
+    def _preprocess(self):
+        plan = _replay(self.msgs)
+        cache = self.cache_type()
+        signals = [motor, self.detector.exposure_time]
+        cpp = CalibPreprocessor(self.detector, locked_signals=signals, state_cache=cache)
+        cpp.add_calib_result({motor.name: 0., self.detector.exposure_time.name: 0.}, CALIB_RESULT)
+        dpp = DarkPreprocessor(
+            detector=self.detector,
+            locked_signals=signals,
+            max_age=1e9,
+            shutter_config=ShutterConfig(self.shutter, "open", "closed"),
+            state_cache=cache,
+        )
+        return PreprocessorPipeline([cpp, dpp])(plan)
+
+    def time_preprocess(self, locked_signals):
+        _drive(self._preprocess())
+
+    def track_msgs_per_frame(self, locked_signals):
+        return _drive(self._preprocess()) / 1000
+
+    track_msgs_per_frame.unit = "messages/frame"
+
+
+class GeometryLookup:
+    """time to find the calibration of 1,000 detector distances among 10 calibrated ones"""
+
+    params = ["exact", "nearest", "interpolate"]
+    param_names = ["lookup"]
+    timeout = 300
+
+    def setup(self, lookup):
+        tolerances = None if lookup == "exact" else {motor.name: 0.01}
+        self.cpp = CalibPreprocessor(
+            DiffractionDetector(name="det"),
+            locked_signals=[motor],
+            tolerances=tolerances,
+            interpolate=lookup == "interpolate",
+        )
+        for i in range(10):
+            self.cpp.add_calib_result({motor.name: 100. * i}, CALIB_RESULT)
+        if lookup == "interpolate":
+            positions = np.linspace(0., 900., 1000)
+        else:
+            positions = np.repeat(np.arange(10) * 100., 100) + (lookup == "nearest") * 0.001
+        self.states = [frozendict({motor.name: float(position)}) for position in positions]
+        # the index is built
+        self.cpp._get_calib(self.states[0])
+
+    def time_get_calib(self, lookup):
+        for state in self.states:
+            self.cpp._get_calib(state)
+
+
+class CalibCache:
+    """time to warm start a calibration preprocessor from the file of a full cache of 32 detector distances"""
+
+    timeout = 300
+
+    def setup(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.tmpdir.name, "calib_cache.yml")
+        self.detector = DiffractionDetector(name="det")
+        cpp = CalibPreprocessor(self.detector, locked_signals=[motor], cache_file=self.cache_file, max_size=32)
+        for i in range(32):
+            cpp.add_calib_result({motor.name: 10. * i}, CALIB_RESULT)
+
+    def teardown(self):
+        self.tmpdir.cleanup()
+
+    def time_load(self):
+        cpp = CalibPreprocessor(self.detector, locked_signals=[motor], cache_file=self.cache_file, max_size=32)
+        cpp._get_calib(frozendict({motor.name: 0.}))
+
+
+class MaskDocuments:
+    """bytes of the documents of the mask stream in a run with a 2048 x 2048 mask"""
+
+    timeout = 300
+
+    def setup(self):
+        self.mpp = MaskPreprocessor(det, mask_dir=MASK_DIR)
+        self.mpp.set_mask(np.ones((2048, 2048), dtype="uint8"))
+        self.RE = RunEngine()
+
+    def track_mask_bytes_per_run(self):
+        docs = []
+        token = self.RE.subscribe(lambda name, doc: docs.append((name, doc)))
+        try:
+            self.RE(self.mpp(bp.count([det])))
+        finally:
+            self.RE.unsubscribe(token)
+        descriptors = {doc["uid"] for name, doc in docs if name == "descriptor" and doc["name"] == "mask"}
+        mask_docs = [
+            doc for name, doc in docs
+            if name in ("resource", "datum") or doc.get("descriptor") in descriptors or doc.get("uid") in descriptors
+        ]
+        return sum(len(json.dumps(doc, default=str)) for doc in mask_docs)
+
+    track_mask_bytes_per_run.unit = "bytes"
@@ -0,0 +1,29 @@
+"""benchmarks of the summaries of the ScanPlans printed by print_plans"""
+from xpdacq.beamtime import Beamtime, ScanPlan, Tramp
+from xpdacq.simulation import cs700, fb, pe1c, shctl1
+from xpdacq.xpdacq_conf import configure_device
+from xpdacq.yamldict import suspend_flush
+
+
+class ScanPlanSummary:
+    """time to summarize the Tramp ScanPlans of a beamtime a second time"""
+
+    params = [10, 100]
+    param_names = ["n_scanplans"]
+    timeout = 300
+
+    def setup(self, n_scanplans):
+        configure_device(
+            area_det=pe1c, shutter=shctl1, temp_controller=cs700, db=None, filter_bank=fb
+        )
+        with suspend_flush():
+            bt = Beamtime("Billinge", 300000, ["van der Banerjee", "Terban"], wavelength=0.1828)
+            self.scanplans = [ScanPlan(bt, Tramp, 5, 300, 300 + i, 1) for i in range(1, n_scanplans + 1)]
+        for sp in self.scanplans:
+            str(sp)
+            sp.md
+
+    def time_summarize(self, n_scanplans):
+        for sp in self.scanplans:
+            str(sp)
+            sp.md
@@ -0,0 +1,45 @@
+"""benchmarks of the per-object save and load cost of each codec"""
+import yaml
+
+from xpdacq import serializer
+
+SAMPLE = [
+    {
+        "sample_name": "Ni",
+        "sample_composition": {"Ni": 1},
+        "sample_phase": {"Ni": 1},
+        "tags": ["powder", "calibrant"],
+        "sa_uid": "a1b2c3d4",
+    },
+    {"bt_uid": "e5f6a7b8", "storage_version": 2},
+]
+ORDER = ["sample_{}.yml".format(i) for i in range(1000)]
+OBJECTS = {"sample": SAMPLE, "order": ORDER}
+
+
+class Codec:
+    """time to encode and decode a sample file and an order file"""
+
+    params = (["yaml-python", "yaml", "json", "msgpack"], ["sample", "order"])
+    param_names = ["codec", "data"]
+
+    def setup(self, codec, data):
+        if codec == "msgpack" and serializer.msgpack is None:
+            raise NotImplementedError("msgpack is not installed")
+        self.data = OBJECTS[data]
+        if codec == "yaml-python":
+            self.encoded = yaml.dump(self.data, default_flow_style=False)
+        else:
+            self.encoded = serializer.encode(self.data, codec, default_flow_style=False)
+
+    def time_save(self, codec, data):
+        if codec == "yaml-python":
+            yaml.dump(self.data, default_flow_style=False)
+        else:
+            serializer.encode(self.data, codec, default_flow_style=False)
+
+    def time_load(self, codec, data):
+        if codec == "yaml-python":
+            yaml.unsafe_load(self.encoded)
+        else:
+            serializer.load(self.encoded)
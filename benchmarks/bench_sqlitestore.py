@@ -0,0 +1,45 @@
+"""benchmarks of loading a beamtime from the SQLite store"""
+import os
+
+from xpdacq.beamtime import Beamtime, Sample
+from xpdacq.sqlitestore import SqliteStore
+from xpdacq.yamldict import suspend_flush
+
+
+def make_store(filepath, n_samples):
+    """write a beamtime with n_samples samples to a new store"""
+    store = SqliteStore(filepath)
+    with suspend_flush():
+        bt = Beamtime("Billinge", 300000, ["van der Banerjee", "Terban"], wavelength=0.1828)
+        bt.store = store
+        for i in range(n_samples):
+            Sample(
+                bt,
+                {
+                    "sample_name": "sample_{}".format(i),
+                    "sample_composition": {"Ni": 1},
+                    "sample_phase": {"Ni": 1},
+                    "tags": ["powder", "room_temperature"],
+                },
+            )
+    store.attach(bt)
+    store.close()
+
+
+class LoadBeamtime:
+    """time to rebuild a beamtime with its samples from the store"""
+
+    params = [100, 1000, 5000]
+    param_names = ["n_samples"]
+    timeout = 300
+
+    def setup_cache(self):
+        filepaths = {}
+        for n_samples in self.params:
+            filepath = os.path.abspath("bt_{}.sqlite".format(n_samples))
+            make_store(filepath, n_samples)
+            filepaths[n_samples] = filepath
+        return filepaths
+
+    def time_load_beamtime(self, filepaths, n_samples):
+        SqliteStore(filepaths[n_samples]).load_beamtime()
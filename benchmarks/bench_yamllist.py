@@ -0,0 +1,28 @@
+"""benchmarks of the appends to the yaml-backed lists"""
+import os
+import shutil
+import tempfile
+
+from xpdacq.yamllist import JournaledYamlList, YamlList
+
+
+class Append:
+    """time to append the names of a sample spreadsheet one by one"""
+
+    params = (["YamlList", "JournaledYamlList"], [100, 1000])
+    param_names = ["kind", "n_items"]
+
+    def setup(self, kind, n_items):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmp_dir, ".sample_order.yml")
+        with open(self.fname, "w") as f:
+            f.write("[]")
+
+    def teardown(self, kind, n_items):
+        shutil.rmtree(self.tmp_dir)
+
+    def time_append(self, kind, n_items):
+        lst = YamlList(self.fname) if kind == "YamlList" else JournaledYamlList(self.fname)
+        for i in range(n_items):
+            lst.append("sample_{}.yml".format(i))
+        lst.flush()
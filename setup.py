@@ -28,7 +28,7 @@ with open(path.join(here, 'README.md'), encoding='utf-8') as readme_file:
 setup(
     name="xpdacq",
     version='1.1.4',
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks"]),
     long_description=readme,
     long_description_content_type='text/markdown',
     description="acquisition module",
@@ -51,6 +51,8 @@ setup(
         "pyyaml",
         "boltons",
         "bluesky>=v0.5.1",
+        # the dark frame insertion follows the mutator of this release, see DarkPreprocessor
+        "bluesky-darkframes>=0.6,<0.7",
         "event_model",
     ]
 )
@@ -14,25 +14,29 @@
 #
 ##############################################################################
 import inspect
+import itertools
 import os
 import typing
 import uuid
 from abc import ABC
 from collections import ChainMap, OrderedDict
+from collections.abc import MutableMapping
+from types import MappingProxyType
 
 import bluesky.plan_stubs as bps
 import bluesky.plans as bp
 import bluesky.preprocessors as bpp
 import numpy as np
 import pyFAI
-import yaml
 from xpdconf.conf import XPD_SHUTTER_CONF
 
+from . import serializer
 from .glbl import glbl
 from .tools import regularize_dict_key
 from .validated_dict import ValidatedDictLike
 from .xpdacq_conf import xpd_configuration
-from .yamldict import YamlChainMap, YamlDict
+from .yamldict import YamlChainMap, YamlDict, flush_suspended, suspend_flush
+from .yamllist import JournaledYamlList
 
 # This is used to map plan names (strings in the YAML file) to actual
 # plan functions in Python.
@@ -43,6 +47,11 @@ class PlanError(Exception):
     pass
 
 
+class BeamtimeLinkError(ValueError):
+    """the Beamtime linked by a Sample or ScanPlan file is not loaded"""
+    pass
+
+
 def register_plan(plan_name, plan_func, overwrite=False):
     """
     Map between a plan_name (string) and a plan_func (generator function).
@@ -85,6 +94,41 @@ def _summarize(plan):
     return "\n".join(output)
 
 
+def _dry_run(plan):
+    """Iterate the plan without a RunEngine.
+
+    A read of a signal set earlier in the plan returns the value it was set
+    to, so that a plan reading back its configuration, like
+    `configure_area_det`, sees the same values as in a run. The other
+    messages get None.
+    """
+    values = {}
+    ret = None
+    while True:
+        try:
+            msg = plan.send(ret)
+        except StopIteration:
+            return
+        yield msg
+        ret = None
+        if msg.command == "set" and msg.args:
+            values[id(msg.obj)] = (msg.obj, msg.args[0])
+        elif msg.command == "read" and id(msg.obj) in values:
+            obj, value = values[id(msg.obj)]
+            ret = {obj.name: {"value": value, "timestamp": 0.}}
+
+
+def _normalize(value):
+    """the value made comparable by value, the devices by identity"""
+    if isinstance(value, np.ndarray):
+        return ("ndarray", value.shape, tuple(value.ravel().tolist()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(v) for v in value)
+    if isinstance(value, MutableMapping):
+        return ("mapping", tuple((k, _normalize(v)) for k, v in value.items()))
+    return value
+
+
 def configure_area_det(det, exposure, acq_time):
     """Configure exposure time of a detector in continuous acquisition mode"""
     _check_mini_expo(exposure, acq_time)
@@ -512,27 +556,213 @@ def new_short_uid():
     return str(uuid.uuid4())[:8]
 
 
+# version of the on-disk layout of the Sample and ScanPlan files
+#   1: [own metadata, metadata of the Beamtime]
+#   2: [own metadata, {'bt_uid': ..., 'storage_version': 2}]
+STORAGE_VERSION = 2
+
+
+def _link_map(bt_uid):
+    """the second map stored in the Sample and ScanPlan files"""
+    return {"bt_uid": bt_uid, "storage_version": STORAGE_VERSION}
+
+
+def _is_link_map(d):
+    return d.get("storage_version", 1) >= 2
+
+
+class _OrderFile:
+    """the order file of the Samples or ScanPlans of a Beamtime
+
+    The file names are kept in a JournaledYamlList in glbl['config_base'].
+    They are only written in full when the list is opened, when the machine
+    codec changes or when the list does not match the registered objects
+    anymore. New objects are appended to the journal and a rename replaces
+    one item of the list.
+
+    Parameters
+    ----------
+    filename : str
+        name of the order file, e.g. '.sample_order.yml'.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.order = None
+
+    def _open(self, registered):
+        """Return the list, if it is still the one of the registered objects."""
+        filepath = os.path.join(glbl["config_base"], self.filename)
+        codec = serializer.get_machine_codec()
+        if self.order is None or self.order.fname != filepath:
+            self.order = JournaledYamlList(
+                filepath, [name + ".yml" for name in registered], codec=codec
+            )
+            return None
+        if self.order.codec != codec:
+            self.order.codec = codec
+            self.order.compact()
+        return self.order
+
+    def sync(self, registered):
+        """Append the objects registered since the last call."""
+        order = self._open(registered)
+        if order is None:
+            return
+        n_new = len(registered) - len(order)
+        if n_new > 0:
+            new = list(itertools.islice(reversed(registered), n_new))
+            order.extend(name + ".yml" for name in reversed(new))
+        elif n_new < 0:
+            order[:] = [name + ".yml" for name in registered]
+
+    def rename(self, registered, new_name):
+        """Replace the name of an object renamed to `new_name`."""
+        order = self._open(registered)
+        if order is None:
+            return
+        if len(order) != len(registered):
+            order[:] = [name + ".yml" for name in registered]
+            return
+        order[registered.position(new_name)] = new_name + ".yml"
+
+
+def _missing_fields(mapping, required, keys=None):
+    """the required fields missing in the mapping
+
+    Only the changed keys are checked if they are given, a field can only
+    go missing by being changed.
+    """
+    if keys is None:
+        keys = required
+    return {key for key in keys if key in required and key not in mapping}
+
+
+def _beamtime_from_map(d):
+    if _is_link_map(d):
+        raise BeamtimeLinkError(
+            "The file only links to the Beamtime with bt_uid={}. "
+            "Please pass the Beamtime or use load_beamtime.".format(
+                d["bt_uid"]
+            )
+        )
+    return Beamtime.from_dict(d)
+
+
 def _clean_info(obj):
     """ stringtify and replace space"""
     return str(obj).strip().replace(" ", "_")
 
 
 class MDOrderedDict(OrderedDict):
-    """The augmented ordered dictionary."""
+    """The augmented ordered dictionary.
+
+    The keys are also kept in a list to select the values by position in
+    O(1). Adding a key or updating the value of a key keeps the list, a
+    deletion of the last key too. Other deletions and moves drop it and it
+    is rebuilt on the next selection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._keys = []
+        self._positions = {}
+        self._indexed = True
+        super().__init__(*args, **kwargs)
+
+    def __reduce__(self):
+        # the index is rebuilt by __init__
+        return self.__class__, (list(self.items()),)
+
+    def _drop_index(self):
+        self._keys = []
+        self._positions = {}
+        self._indexed = False
+
+    def _index(self):
+        """Return the list of the keys and their positions."""
+        if not self._indexed:
+            self._keys = list(self.keys())
+            self._positions = {key: i for i, key in enumerate(self._keys)}
+            self._indexed = True
+        return self._keys, self._positions
+
+    def __setitem__(self, key, value):
+        new = key not in self
+        super().__setitem__(key, value)
+        if new and self._indexed:
+            self._positions[key] = len(self._keys)
+            self._keys.append(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        if self._indexed and self._keys[-1] == key:
+            self._keys.pop()
+            del self._positions[key]
+        else:
+            self._drop_index()
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self, last=True):
+        if not self:
+            raise KeyError("dictionary is empty")
+        key = next(reversed(self)) if last else next(iter(self))
+        return key, self.pop(key)
+
+    def clear(self):
+        super().clear()
+        self._keys = []
+        self._positions = {}
+        self._indexed = True
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        MutableMapping.update(self, *args, **kwargs)
+
+    def move_to_end(self, key, last=True):
+        super().move_to_end(key, last)
+        self._drop_index()
 
     def sel(self, ind: int):
         """Select the value by the index."""
+        keys, _ = self._index()
         try:
-            return list(self.values())[ind]
+            return self[keys[ind]]
         except IndexError:
             raise IndexError("Index out of range.")
 
+    def rename(self, old, new):
+        """Give a new key to a value, keeping its position."""
+        if new in self:
+            raise KeyError("{} is already a key.".format(new))
+        keys, positions = self._index()
+        pos = positions.pop(old)
+        value = OrderedDict.pop(self, old)
+        OrderedDict.__setitem__(self, new, value)
+        for key in keys[pos + 1:]:
+            OrderedDict.move_to_end(self, key)
+        keys[pos] = new
+        positions[new] = pos
+
+    def position(self, key) -> int:
+        """Return the index of the key."""
+        _, positions = self._index()
+        return positions[key]
+
     def get_md(self, ind: int):
         """special method to get metadata of sample object based on
         bt.list index
         """
-        obj_list = list(self.values())
-        md_dict = dict(obj_list[ind])
+        md_dict = dict(self.sel(ind))
         return md_dict
 
 
@@ -575,6 +805,9 @@ class Beamtime(ValidatedDictLike, YamlDict, ABC):
 
     _REQUIRED_FIELDS = ["bt_piLast", "bt_safN"]
 
+    # xpdacq.sqlitestore.SqliteStore replacing the yaml files, if any
+    store = None
+
     def __init__(
         self, pi_last, saf_num, experimenters=None, *, wavelength=None, **kwargs
     ):
@@ -587,25 +820,25 @@ class Beamtime(ValidatedDictLike, YamlDict, ABC):
             bt_wavelength=wavelength,
             **kwargs
         )
-        self._wavelength = wavelength
         self.scanplans = MDOrderedDict()
         self.samples = MDOrderedDict()
         self._referenced_by = []
         # used by YamlDict when reload
         self.setdefault("bt_uid", new_short_uid())
         self.robot_info = {}
-        self._scanplan_order = {}
-        self._sample_order = {}
+        self._scanplan_order = _OrderFile(".scanplan_order.yml")
+        self._sample_order = _OrderFile(".sample_order.yml")
+        # True while register_samples creates the Samples
+        self._defer_sample_order = False
 
     @property
     def wavelength(self):
         """ wavelength value of current beamtime. updated value will be
         passed down to all related objects"""
-        return self._wavelength
+        return self.get("bt_wavelength")
 
     @wavelength.setter
     def wavelength(self, val):
-        self._wavelength = val
         self.update(bt_wavelength=val)
 
     @property
@@ -622,9 +855,9 @@ class Beamtime(ValidatedDictLike, YamlDict, ABC):
             if v["sa_uid"] in self.robot_info
         ]
 
-    def validate(self):
+    def validate(self, keys=None):
         # This is automatically called whenever the contents are changed.
-        missing = set(self._REQUIRED_FIELDS) - set(self)
+        missing = _missing_fields(self, self._REQUIRED_FIELDS, keys)
         if missing:
             raise ValueError("Missing required fields: {}".format(missing))
 
@@ -636,40 +869,108 @@ class Beamtime(ValidatedDictLike, YamlDict, ABC):
         # whenever the contents of the Beamtime are edited.
         scanplan_name = scanplan.short_summary()
         self.scanplans.update({scanplan_name: scanplan})
-        # yaml sync list
-        self._referenced_by.append(scanplan)
+        if self.store is not None or flush_suspended():
+            # the order is kept by the store or is already on the disk
+            return
         # save order
-        with open(
-            os.path.join(glbl["config_base"], ".scanplan_order.yml"), "w+"
-        ) as f:
-            scanplan_order = {}
-            for i, name in enumerate(self.scanplans.keys()):
-                scanplan_order.update({i: name + ".yml"})
-            # debug line
-            self._scanplan_order = scanplan_order
-            yaml.dump(scanplan_order, f)
+        self._scanplan_order.sync(self.scanplans)
 
     def register_sample(self, sample):
         # Notify this Beamtime about an Sample that should be re-synced
         # whenever the contents of the Beamtime are edited.
         sample_name = sample.get("sample_name", None)
         self.samples.update({sample_name: sample})
-        # yaml sync list
-        self._referenced_by.append(sample)
+        if (
+            self.store is not None
+            or flush_suspended()
+            or self._defer_sample_order
+        ):
+            # the order is kept by the store, is already on the disk or is
+            # saved by register_samples
+            return
         # save order
-        with open(
-            os.path.join(glbl["config_base"], ".sample_order.yml"), "w+"
-        ) as f:
-            sample_order = {}
-            for i, name in enumerate(self.samples.keys()):
-                sample_order.update({i: name + ".yml"})
-            # debug line
-            self._sample_order = sample_order
-            yaml.dump(sample_order, f)
+        self._sample_order.sync(self.samples)
+
+    def register_samples(self, sample_mds):
+        """create the Samples of a list of metadata
+
+        The order file is updated once for all the Samples.
+
+        Parameters
+        ----------
+        sample_mds : iterable of dict
+            the metadata of the Samples, see `Sample`.
+
+        Returns
+        -------
+        samples : list
+            the Samples in the same order.
+        """
+        self._defer_sample_order = True
+        try:
+            samples = [Sample(self, sample_md) for sample_md in sample_mds]
+        finally:
+            self._defer_sample_order = False
+        if self.store is None and not flush_suspended():
+            self._sample_order.sync(self.samples)
+        return samples
+
+    def rename_sample(self, old_name, new_name):
+        """give a new sample_name to a Sample at the same place in the list
+
+        The file of the Sample is moved to the one of the new name.
+
+        Parameters
+        ----------
+        old_name : str
+            the current sample_name.
+        new_name : str
+            the new sample_name. It must not be used by another Sample.
+        """
+        if new_name in self.samples:
+            raise ValueError(
+                "There is already a Sample named {}.".format(new_name)
+            )
+        sample = self.samples[old_name]
+        if self.store is not None:
+            sample["sample_name"] = new_name
+            self.samples.rename(old_name, new_name)
+            return
+        old_filepath = sample.filepath
+        # written once, to the new file
+        with suspend_flush():
+            sample["sample_name"] = new_name
+        sample.filepath = sample.default_yaml_path()
+        if sample.filepath != old_filepath and os.path.isfile(old_filepath):
+            os.remove(old_filepath)
+        self.samples.rename(old_name, new_name)
+        self._sample_order.rename(self.samples, new_name)
+
+    def _write(self, text):
+        if self.store is None:
+            super()._write(text)
+        else:
+            self.store.save_beamtime(self)
+
+    def _stored(self):
+        if self.store is None:
+            return super()._stored()
+        return True
+
+    def _batch_members(self):
+        # the Samples and ScanPlans only store the uid of the Beamtime, but
+        # they are rolled back along with it
+        members = super()._batch_members()
+        known = set(map(id, members))
+        for obj in list(self.samples.values()) + list(self.scanplans.values()):
+            if id(obj) not in known:
+                known.add(id(obj))
+                members.append(obj)
+        return members
 
     @classmethod
     def from_yaml(cls, f):
-        d = yaml.unsafe_load(f)
+        d = serializer.load(f)
         instance = cls.from_dict(d)
         if not isinstance(f, str):
             instance.filepath = os.path.abspath(f.name)
@@ -797,6 +1098,10 @@ class Sample(ValidatedDictLike, YamlChainMap, ABC):
 
     _REQUIRED_FIELDS = ["sample_name"]
 
+    # cache of flat_md and the versions of the maps it was built from
+    _flat_md = None
+    _flat_md_versions = None
+
     def __init__(self, beamtime: Beamtime, sample_md: dict):
         if ('sample_name' not in sample_md) and ('sample_composition' not in sample_md):
             raise ValueError(
@@ -811,19 +1116,52 @@ class Sample(ValidatedDictLike, YamlChainMap, ABC):
         self.setdefault("sa_uid", new_short_uid())
         beamtime.register_sample(self)
 
-    def validate(self):
-        missing = set(self._REQUIRED_FIELDS) - set(self)
+    def validate(self, keys=None):
+        missing = _missing_fields(self, self._REQUIRED_FIELDS, keys)
         if missing:
             raise ValueError("Missing required fields: {}".format(missing))
 
+    @property
+    def flat_md(self) -> typing.Mapping:
+        """read-only view of the metadata of the Sample and its Beamtime
+
+        The flattened dict is built again only after the Sample or its
+        Beamtime is changed. Use `flush()` after editing a nested value in
+        place.
+        """
+        versions = (self._version, self.maps[1]._version)
+        if self._flat_md_versions != versions:
+            self._flat_md = MappingProxyType(dict(self))
+            self._flat_md_versions = versions
+        return self._flat_md
+
     def default_yaml_path(self):
         return os.path.join(
             glbl["yaml_dir"], "samples", "{sample_name}.yml"
         ).format(**self)
 
+    def _storage_yaml(self):
+        # the Beamtime has its own file
+        return serializer.dump(
+            [dict(self.maps[0]), _link_map(self.maps[1]["bt_uid"])],
+            default_flow_style=False,
+        )
+
+    def _write(self, text):
+        store = getattr(self.maps[1], "store", None)
+        if store is None:
+            super()._write(text)
+        else:
+            store.save_sample(self)
+
+    def _stored(self):
+        if getattr(self.maps[1], "store", None) is None:
+            return super()._stored()
+        return True
+
     @classmethod
     def from_yaml(cls, f, beamtime=None):
-        map1, map2 = yaml.unsafe_load(f)
+        map1, map2 = serializer.load(f)
         instance = cls.from_dicts(map1, map2, beamtime=beamtime)
         if not isinstance(f, str):
             instance.filepath = os.path.abspath(f.name)
@@ -832,7 +1170,7 @@ class Sample(ValidatedDictLike, YamlChainMap, ABC):
     @classmethod
     def from_dicts(cls, map1, map2, beamtime=None):
         if beamtime is None:
-            beamtime = Beamtime.from_dict(map2)
+            beamtime = _beamtime_from_map(map2)
         return cls(beamtime, map1)
 
 
@@ -865,6 +1203,9 @@ class ScanPlan(ValidatedDictLike, YamlChainMap, ABC):
     Please refer to http://xpdacq.github.io for more examples.
     """
 
+    # cache of the bound arguments, md and summary, see `_cached`
+    _cache = None
+
     def __init__(self, beamtime, plan_func, *args, **kwargs):
         self.plan_func = plan_func
         plan_name = plan_func.__name__
@@ -887,17 +1228,47 @@ class ScanPlan(ValidatedDictLike, YamlChainMap, ABC):
         self._bt = beamtime
         beamtime.register_scanplan(self)
 
+    def _cached(self, name, config, compute):
+        """Return the value computed by `compute`, computed again only after a change.
+
+        The value is kept until the ScanPlan, its Beamtime or its plan
+        function changes, or until the normalized `config` is not equal.
+        Use `flush()` after editing a nested argument in place.
+        """
+        if self._cache is None:
+            self._cache = {}
+        key = (self._version, self.maps[1]._version, self.plan_func, config)
+        entry = self._cache.get(name)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        value = compute()
+        self._cache[name] = (key, value)
+        return value
+
+    def _plan_config(self):
+        """the devices and the glbl values that the plan functions read"""
+        config = tuple(itertools.chain.from_iterable(xpd_configuration.items()))
+        config += (glbl["frame_acq_time"], glbl["shutter_sleep"])
+        return _normalize(config)
+
     @property
     def md(self):
         """ metadata for current object """
-        open_run, = [
-            msg for msg in self.factory() if msg.command == "open_run"
-        ]
-        return open_run.kwargs
+        def _md():
+            # the rest of the plan is not needed
+            plan = _dry_run(self.factory())
+            open_run = next(msg for msg in plan if msg.command == "open_run")
+            plan.close()
+            return open_run.kwargs
+
+        return dict(self._cached("md", self._plan_config(), _md))
 
     @property
     def bound_arguments(self):
         """ bound arguments of this ScanPlan object """
+        return dict(self._cached("bound_arguments", (), self._bound_arguments))
+
+    def _bound_arguments(self):
         signature = inspect.signature(self.plan_func)
         # empty list is for [pe1c]
         bound_arguments = signature.bind(
@@ -918,27 +1289,33 @@ class ScanPlan(ValidatedDictLike, YamlChainMap, ABC):
         pe1c = xpd_configuration["area_det"]
         extra_kw = {}
         # pass parameter to plan_func -> needed for statTramp-like plan
-        if "bt" in inspect.signature(self.plan_func).parameters:
+        if self._cached("takes_bt", (), self._takes_bt):
             extra_kw["bt"] = self._bt
         plan = self.plan_func(
             [pe1c], *self["sp_args"], **self["sp_kwargs"], **extra_kw
         )
         return plan
 
+    def _takes_bt(self):
+        return "bt" in inspect.signature(self.plan_func).parameters
+
     def short_summary(self):
         arg_value_str = list(map(str, self.bound_arguments.values()))
         fn = "_".join([self["sp_plan_name"]] + arg_value_str)
         return fn
 
     def __str__(self):
-        return _summarize(self.factory())
+        return self._cached("summary", self._plan_config(), self._summary)
+
+    def _summary(self):
+        return _summarize(_dry_run(self.factory()))
 
     def __eq__(self, other):
         return self.to_yaml() == other.to_yaml()
 
     @classmethod
     def from_yaml(cls, f, beamtime=None):
-        map1, map2 = yaml.unsafe_load(f)
+        map1, map2 = serializer.load(f)
         instance = cls.from_dicts(map1, map2, beamtime=beamtime)
         if not isinstance(f, str):
             instance.filepath = os.path.abspath(f.name)
@@ -947,7 +1324,7 @@ class ScanPlan(ValidatedDictLike, YamlChainMap, ABC):
     @classmethod
     def from_dicts(cls, map1, map2, beamtime=None):
         if beamtime is None:
-            beamtime = Beamtime.from_dict(map2)
+            beamtime = _beamtime_from_map(map2)
         plan_name = map1.pop("sp_plan_name")
         plan_func = _PLAN_REGISTRY[plan_name]
         plan_uid = map1.pop("sp_uid")
@@ -961,6 +1338,25 @@ class ScanPlan(ValidatedDictLike, YamlChainMap, ABC):
         fn = "_".join([self["sp_plan_name"]] + list(arg_value_str))
         return os.path.join(glbl["yaml_dir"], "scanplans", "%s.yml" % fn)
 
+    def _storage_yaml(self):
+        # the Beamtime has its own file
+        return serializer.dump(
+            [dict(self.maps[0]), _link_map(self.maps[1]["bt_uid"])],
+            default_flow_style=False,
+        )
+
+    def _write(self, text):
+        store = getattr(self.maps[1], "store", None)
+        if store is None:
+            super()._write(text)
+        else:
+            store.save_scanplan(self)
+
+    def _stored(self):
+        if getattr(self.maps[1], "store", None) is None:
+            return super()._stored()
+        return True
+
 
 def load_calibration_md(poni_file: str) -> dict:
     """Load the calibration metadata in a dictionary from a .poni file.
@@ -18,17 +18,28 @@ import shutil
 import subprocess
 import sys
 import typing as tp
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from time import strftime
 
-import yaml
 from IPython import get_ipython
 from pkg_resources import resource_filename as rs_fn
 
-from .beamtime import Beamtime, ScanPlan, Sample, ct
+from . import serializer
+from .beamtime import (
+    Beamtime,
+    BeamtimeLinkError,
+    ScanPlan,
+    Sample,
+    ct,
+    _is_link_map,
+    _link_map,
+)
 from .glbl import glbl
-from .tools import _graceful_exit, xpdAcqError
+from .tools import _graceful_exit, atomic_write, xpdAcqError
 from .xpdacq_conf import glbl_dict, _load_beamline_config
+from .yamllist import read_journaled_list
+from .yamldict import suspend_flush
 
 # list of exposure times for pre-poluated ScanPlan inside
 # _start_beamtime
@@ -136,7 +147,7 @@ def _no_beamtime():
     )
 
 
-def load_beamtime(directory=None):
+def load_beamtime(directory=None, config_base=None, max_workers=None):
     """
     Load a Beamtime and associated objects.
 
@@ -147,76 +158,171 @@ def load_beamtime(directory=None):
       glbl.yml
       samples/
       scanplans/
+
+    The files are read and parsed by a pool of threads and each of them is
+    parsed once. The Samples and ScanPlans are registered in the order of
+    the order files. The ones missing in the order files go last.
+
+    Parameters
+    ----------
+    directory : str, optional
+        directory of the yaml files. Default to glbl['yaml_dir'].
+    config_base : str, optional
+        directory of the order files. Default to glbl['config_base'].
+    max_workers : int, optional
+        number of threads reading the files. Default to the default of
+        `concurrent.futures.ThreadPoolExecutor`.
     """
     if directory is None:
         directory = glbl_dict["yaml_dir"]  # leave room for multi-beamtime
+    if config_base is None:
+        config_base = glbl_dict["config_base"]
     known_uids = {}
     beamtime_fn = os.path.join(directory, "bt_bt.yml")
-    sample_fns = [fn for fn in os.listdir(os.path.join(directory, "samples"))]
-    scanplan_fns = [
-        fn for fn in os.listdir(os.path.join(directory, "scanplans"))
-    ]
-
-    with open(beamtime_fn, "r") as f:
-        bt = load_yaml(f, known_uids)
-
-    # most recent scanplan order
-    scanplan_order_fn = os.path.join(
-        glbl_dict["config_base"], ".scanplan_order.yml"
+    scanplan_fps = _ordered_yaml_files(
+        os.path.join(directory, "scanplans"),
+        os.path.join(config_base, ".scanplan_order.yml"),
     )
-    if os.path.isfile(scanplan_order_fn):
-        with open(scanplan_order_fn) as f:
-            scanplan_order = yaml.unsafe_load(f)
-        for fn in sorted(
-            scanplan_fns, key=list(scanplan_order.values()).index
-        ):
-            with open(os.path.join(directory, "scanplans", fn), "r") as f:
-                load_yaml(f, known_uids)
-    # most recent sample order
-    sample_order_fn = os.path.join(
-        glbl_dict["config_base"], ".sample_order.yml"
+    sample_fps = _ordered_yaml_files(
+        os.path.join(directory, "samples"),
+        os.path.join(config_base, ".sample_order.yml"),
     )
-    if os.path.isfile(sample_order_fn):
-        with open(sample_order_fn) as f:
-            sample_order = yaml.unsafe_load(f)
-        for fn in sorted(sample_fns, key=list(sample_order.values()).index):
-            with open(os.path.join(directory, "samples", fn), "r") as f:
-                load_yaml(f, known_uids)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        bt_data = executor.submit(_read_yaml, beamtime_fn)
+        scanplan_data = executor.map(_read_yaml, scanplan_fps)
+        sample_data = executor.map(_read_yaml, sample_fps)
+        # the objects are in sync with the files
+        with suspend_flush():
+            bt = _load_data(bt_data.result(), known_uids, beamtime_fn)
+            for fp, data in zip(scanplan_fps, scanplan_data):
+                _load_linked_data(data, known_uids, fp)
+            for fp, data in zip(sample_fps, sample_data):
+                _load_linked_data(data, known_uids, fp)
 
     return bt
 
 
+def _read_yaml(filepath):
+    return serializer.load_file(filepath)
+
+
+def _ordered_yaml_files(directory, order_fn):
+    """paths to the yaml files in the directory in the order of the order file
+
+    Nothing is loaded if there is no order file.
+    """
+    if not os.path.isfile(order_fn):
+        return []
+    try:
+        order = read_journaled_list(order_fn)
+    except TypeError:
+        # {position: file name} written by the older versions
+        order = _read_yaml(order_fn).values()
+    position = {fn: i for i, fn in enumerate(order)}
+    # the hidden files are the temporary files of atomic_write
+    fns = sorted(
+        fn
+        for fn in os.listdir(directory)
+        if fn.endswith(".yml") and not fn.startswith(".")
+    )
+    fns.sort(key=lambda fn: position.get(fn, len(position)))
+    return [os.path.join(directory, fn) for fn in fns]
+
+
+def _load_linked_data(data, known_uids, filepath):
+    """load a Sample or ScanPlan, skip it if its Beamtime is unknown"""
+    try:
+        return _load_data(data, known_uids, filepath)
+    except BeamtimeLinkError:
+        print(
+            "INFO: skip {}, it belongs to another beamtime".format(filepath)
+        )
+
+
 def load_yaml(f, known_uids=None):
     """
     Recreate a ScanPlan, Experiment, or Beamtime object from a YAML file.
 
     If its linked objects have already been created, re-link to them.
-    If they have not yet been created, create them now.
+    If they have not yet been created, create them now. The files in the
+    normalized layout only keep the uid of the Beamtime, so the Beamtime
+    must be loaded first.
     """
     if known_uids is None:
         known_uids = {}
-    data = yaml.unsafe_load(f)
-    # If f is a file handle, 'rewind' it so we can read it again.
-    if not isinstance(f, str):
-        f.seek(0)
+    data = serializer.load(f)
+    filepath = None if isinstance(f, str) else f.name
+    return _load_data(data, known_uids, filepath)
+
+
+def _load_data(data, known_uids, filepath=None):
+    """Recreate an object from the parsed contents of its YAML file."""
     if isinstance(data, dict) and "bt_uid" in data:
-        obj = Beamtime.from_yaml(f)
+        obj = Beamtime.from_dict(data)
         known_uids[obj["bt_uid"]] = obj
-        return obj
     elif isinstance(data, list) and "sa_uid" in data[0]:
         beamtime = known_uids.get(data[1]["bt_uid"])
-        obj = Sample.from_yaml(f, beamtime=beamtime)
+        obj = Sample.from_dicts(*data, beamtime=beamtime)
         known_uids[obj["sa_uid"]] = obj
     elif isinstance(data, list) and len(data) == 2:
         # elif isinstance(data, list) and 'sp_uid' in data[0]:
         beamtime = known_uids.get(data[1]["bt_uid"])
-        obj = ScanPlan.from_yaml(f, beamtime=beamtime)
+        obj = ScanPlan.from_dicts(*data, beamtime=beamtime)
         known_uids[obj["sp_uid"]] = obj
     else:
         raise ValueError("File does not match a recognized specification.")
+    if filepath is not None:
+        obj.filepath = os.path.abspath(filepath)
     return obj
 
 
+def migrate_yaml_dir(directory=None):
+    """
+    Rewrite the Sample and ScanPlan files in the normalized layout.
+
+    The files of the old layout repeat the metadata of the Beamtime. The
+    rewritten files only keep the uid of the Beamtime, which is used to
+    re-link them in `load_beamtime`. Files already in the normalized
+    layout are left untouched.
+
+    Parameters
+    ----------
+    directory : str, optional
+        directory of the yaml files. Default to glbl['yaml_dir'].
+
+    Returns
+    -------
+    migrated : list
+        paths to the rewritten files.
+    """
+    if directory is None:
+        directory = glbl_dict["yaml_dir"]
+    migrated = []
+    for sub_dir in ("samples", "scanplans"):
+        sub_dir = os.path.join(directory, sub_dir)
+        if not os.path.isdir(sub_dir):
+            continue
+        for fn in sorted(os.listdir(sub_dir)):
+            if not fn.endswith(".yml") or fn.startswith("."):
+                continue
+            fp = os.path.join(sub_dir, fn)
+            with open(fp, "r") as f:
+                data = serializer.load(f)
+            if not (isinstance(data, list) and len(data) == 2):
+                continue
+            if _is_link_map(data[1]):
+                continue
+            atomic_write(
+                fp,
+                serializer.dump(
+                    [data[0], _link_map(data[1]["bt_uid"])],
+                    default_flow_style=False,
+                ),
+            )
+            migrated.append(fp)
+    return migrated
+
+
 def _end_beamtime(base_dir=None, archive_dir=None, bto=None, usr_confirm="y"):
     """Helper funciton to end a beamtime.
 
@@ -334,7 +440,7 @@ def _load_bt(bt_yaml_path):
             )
         )
     with open(btoname, "r") as f:
-        bto = yaml.unsafe_load(f)
+        bto = serializer.load(f)
     return bto
 
 
@@ -0,0 +1,385 @@
+"""Estimate the duration of a queue of samples and plans without running it."""
+import typing as T
+from dataclasses import dataclass, field
+
+from bluesky import Msg
+from bluesky_darkframes import GROUP_PREFIX
+
+from .beamtime import ScanPlan, _dry_run
+from .glbl import glbl
+from .preprocessors import (DarkPreprocessor, PreprocessorPipeline,
+                            ShutterPreprocessor)
+
+Plan = T.Generator[Msg, T.Any, T.Any]
+
+# the command of the message marking the triggers before which a DarkPreprocessor takes a dark frame
+_DARK_COMMAND = "xpdacq_dark_frame"
+# the codes of the operations in a trace
+_SET, _TRIGGER, _WAIT, _SLEEP, _PERIOD, _CHECKPOINT, _OPEN_RUN, _DARK = range(8)
+
+
+@dataclass
+class CostModel:
+    """The time taken by the operations of the beamline.
+
+    Attributes
+    ----------
+    frame_acq_time : float
+        The time per frame of an area detector whose acquire time is not set in the plan.
+    shutter_time : float
+        The time for the shutter to open or close in seconds.
+    readout_time : float
+        The extra time of each trigger of an area detector in seconds, default 0.
+    run_overhead : float
+        The extra time of each run in seconds, default 0. See the `Acquisition` benchmark.
+    speeds : dict
+        The speeds of the motors in units per second by name.
+    ramp_rates : dict
+        The ramp rates of the temperature controllers in kelvin per second by name.
+    max_ages : dict
+        The max age of the dark frames in seconds by the name of the detector.
+    shutters : dict
+        The open and the close state of the shutters by name.
+    positions : dict
+        The positions of the motors and the temperature controllers at the start of the queue by name.
+        The first move of the others takes no time.
+    """
+
+    frame_acq_time: float
+    shutter_time: float
+    readout_time: float = 0.
+    run_overhead: float = 0.
+    speeds: T.Dict[str, float] = field(default_factory=dict)
+    ramp_rates: T.Dict[str, float] = field(default_factory=dict)
+    max_ages: T.Dict[str, float] = field(default_factory=dict)
+    shutters: T.Dict[str, T.Tuple[T.Any, T.Any]] = field(default_factory=dict)
+    positions: T.Dict[str, T.Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_xpdacq(
+        cls,
+        dark_preprocessors: T.Iterable[DarkPreprocessor] = (),
+        shutter_preprocessors: T.Iterable[ShutterPreprocessor] = (),
+        **kwargs
+    ):
+        """Use the setting from the global configuration of xpdAcq and the preprocessors.
+
+        The keyword arguments, like the `speeds` and the `ramp_rates`, are passed to the constructor.
+        """
+        dark_preprocessors = list(dark_preprocessors)
+        configs = [pp._shutter_config for pp in dark_preprocessors]
+        configs.extend(pp._shutter_config for pp in shutter_preprocessors)
+        kwargs.setdefault("frame_acq_time", glbl["frame_acq_time"])
+        kwargs.setdefault("shutter_time", glbl["shutter_sleep"])
+        kwargs.setdefault("max_ages", {pp.detector.name: pp.max_age for pp in dark_preprocessors})
+        kwargs.setdefault(
+            "shutters", {c.shutter.name: (c.open_state, c.close_state) for c in configs if c.shutter is not None}
+        )
+        return cls(**kwargs)
+
+
+@dataclass
+class Estimate:
+    """The estimation of a plan, or of all the plans of a sample.
+
+    Attributes
+    ----------
+    sample : str
+        The name of the sample.
+    plan : str
+        The summary of the plan.
+    duration : float
+        The estimated duration in seconds.
+    n_darks : int
+        The number of dark frames taken.
+    n_shutter_cycles : int
+        The number of times that the shutter is opened.
+    n_runs : int
+        The number of runs.
+    """
+
+    sample: str
+    plan: str
+    duration: float = 0.
+    n_darks: int = 0
+    n_shutter_cycles: int = 0
+    n_runs: int = 0
+
+
+@dataclass
+class QueueEstimate:
+    """The estimation of a queue of plans.
+
+    Attributes
+    ----------
+    plans : list
+        The `Estimate` of each plan in the order of the queue.
+    unmodeled : set
+        The names of the objects moved without a speed or a ramp rate in the cost model.
+    """
+
+    plans: T.List[Estimate]
+    unmodeled: T.Set[str] = field(default_factory=set)
+
+    @property
+    def duration(self) -> float:
+        return sum(e.duration for e in self.plans)
+
+    @property
+    def n_darks(self) -> int:
+        return sum(e.n_darks for e in self.plans)
+
+    @property
+    def n_shutter_cycles(self) -> int:
+        return sum(e.n_shutter_cycles for e in self.plans)
+
+    def by_sample(self) -> T.Dict[str, Estimate]:
+        """Return the estimation of each sample summed over its plans."""
+        samples = {}
+        for e in self.plans:
+            s = samples.get(e.sample)
+            if s is None:
+                samples[e.sample] = Estimate(
+                    e.sample, e.plan, e.duration, e.n_darks, e.n_shutter_cycles, e.n_runs
+                )
+                continue
+            s.plan += ", " + e.plan
+            s.duration += e.duration
+            s.n_darks += e.n_darks
+            s.n_shutter_cycles += e.n_shutter_cycles
+            s.n_runs += e.n_runs
+        return samples
+
+    def __str__(self) -> str:
+        lines = ["{:<24} {:>12} {:>6} {:>15}".format("sample", "duration (s)", "darks", "shutter cycles")]
+        for e in self.by_sample().values():
+            lines.append("{:<24} {:>12.1f} {:>6} {:>15}".format(e.sample, e.duration, e.n_darks, e.n_shutter_cycles))
+        lines.append("{:<24} {:>12.1f} {:>6} {:>15}".format("total", self.duration, self.n_darks, self.n_shutter_cycles))
+        if self.unmodeled:
+            lines.append("WARNING: no speed or ramp rate for {}".format(", ".join(sorted(self.unmodeled))))
+        return "\n".join(lines)
+
+
+class _DarkMarker:
+    """Mark the triggers before which the dark preprocessor takes a dark frame instead of taking it."""
+
+    def __init__(self, dark_preprocessor: DarkPreprocessor) -> None:
+        self._pp = dark_preprocessor
+
+    def add_hooks(self, pipeline: PreprocessorPipeline) -> None:
+        pipeline.add_hook("trigger", self._pp.detector, self._mark)
+        return
+
+    def _mark(self, msg: Msg):
+        if msg.kwargs.get("group", "").startswith(GROUP_PREFIX):
+            return None, None
+        return self._marked(msg), None
+
+    def _marked(self, msg: Msg) -> Plan:
+        yield Msg(_DARK_COMMAND, msg.obj, self._pp)
+        return (yield msg)
+
+
+def _exposure(det: T.Any, values: dict) -> T.Optional[T.Tuple[T.Optional[float], int]]:
+    """the acquire time and the number of frames set in the plan, None if not an area detector"""
+    cam = getattr(det, "cam", None)
+    acquire_time = getattr(cam, "acquire_time", None)
+    if acquire_time is None:
+        return None
+    images_per_set = getattr(det, "images_per_set", None)
+    return values.get(id(acquire_time)), values.get(id(images_per_set), 1)
+
+
+def _trace(plan: Plan) -> list:
+    """Return the operations of the plan that take time, walking it like `_dry_run`."""
+    ops = []
+    values = {}
+    last = None
+    for msg in _dry_run(plan):
+        command = msg.command
+        if command == "set" and msg.args:
+            values[id(msg.obj)] = msg.args[0]
+            ops.append((_SET, msg.obj, msg.args[0], msg.kwargs.get("group")))
+        elif command == "trigger":
+            ops.append((_TRIGGER, msg.kwargs.get("group"), _exposure(msg.obj, values)))
+        elif command == "wait":
+            ops.append((_WAIT, msg.kwargs.get("group")))
+        elif command == "sleep" and msg.args:
+            # the delay of bps.repeat after a reading is counted from its checkpoint
+            ops.append((_PERIOD if last == "save" else _SLEEP, msg.args[0]))
+        elif command == "checkpoint":
+            ops.append((_CHECKPOINT,))
+        elif command == "open_run":
+            ops.append((_OPEN_RUN,))
+        elif command == _DARK_COMMAND:
+            pp, = msg.args
+            state = tuple(values.get(id(s)) for s in pp.locked_signals)
+            config = pp._shutter_config
+            ops.append((_DARK, msg.obj.name, state, _exposure(msg.obj, values), config))
+        last = command
+    return ops
+
+
+class _Beamline:
+    """The state of the beamline replaying the traces with a cost model."""
+
+    def __init__(self, model: CostModel) -> None:
+        self.model = model
+        self.now = 0.
+        self.unmodeled = set()
+        self._positions = dict(model.positions)
+        # the time of the dark frames by the detector and the state of the locked signals
+        self._darks = {}
+        self._rates = dict(model.speeds, **model.ramp_rates)
+
+    def _exposure_time(self, exposure) -> float:
+        if exposure is None:
+            return 0.
+        acquire_time, n_frames = exposure
+        if acquire_time is None:
+            acquire_time = self.model.frame_acq_time
+        return acquire_time * n_frames + self.model.readout_time
+
+    def _move(self, obj: T.Any, target: T.Any, estimate: Estimate) -> float:
+        """Move the object and return the time it takes."""
+        name = obj.name
+        if name in self.model.shutters:
+            if self._positions.get(name) == target:
+                return 0.
+            self._positions[name] = target
+            if target == self.model.shutters[name][0]:
+                estimate.n_shutter_cycles += 1
+            return self.model.shutter_time
+        start = self._positions.get(name)
+        self._positions[name] = target
+        rate = self._rates.get(name)
+        try:
+            distance = abs(target - start)
+        except TypeError:
+            # the first move or not a number
+            return 0.
+        if rate is None:
+            if distance:
+                self.unmodeled.add(name)
+            return 0.
+        return distance / rate
+
+    def _dark(self, op: tuple, estimate: Estimate) -> None:
+        _, det_name, state, exposure, config = op
+        key = (det_name, state)
+        created = self._darks.get(key)
+        if (created is not None) and (self.now - created < self.model.max_ages.get(det_name, 0.)):
+            return
+        # close the shutter, take the dark frame and open the shutter, see DarkPreprocessor
+        estimate.n_darks += 1
+        if config.shutter is not None:
+            self.now += self._move(config.shutter, config.close_state, estimate)
+        self.now += config.delay + self._exposure_time(exposure)
+        self._darks[key] = self.now
+        if config.shutter is not None:
+            self.now += self._move(config.shutter, config.open_state, estimate)
+        return
+
+    def run(self, ops: list, estimate: Estimate) -> Estimate:
+        """Replay the operations of a plan and add their cost to the estimation."""
+        start = self.now
+        checkpoint = self.now
+        # the time at which the operations of each group are done
+        pending = {}
+        for op in ops:
+            code = op[0]
+            if code == _SET:
+                done = self.now + self._move(op[1], op[2], estimate)
+                pending[op[3]] = max(pending.get(op[3], done), done)
+            elif code == _TRIGGER:
+                done = self.now + self._exposure_time(op[2])
+                pending[op[1]] = max(pending.get(op[1], done), done)
+            elif code == _WAIT:
+                self.now = max(self.now, pending.pop(op[1], self.now))
+            elif code == _SLEEP:
+                self.now += op[1]
+            elif code == _PERIOD:
+                self.now = max(self.now, checkpoint + op[1])
+            elif code == _CHECKPOINT:
+                checkpoint = self.now
+            elif code == _OPEN_RUN:
+                estimate.n_runs += 1
+                self.now += self.model.run_overhead
+            elif code == _DARK:
+                self._dark(op, estimate)
+        # the plan ends when everything is done
+        self.now = max([self.now] + list(pending.values()))
+        estimate.duration += float(self.now - start)
+        return estimate
+
+
+def estimate_queue(
+    samples: T.Sequence[T.Mapping],
+    plans: T.Sequence[T.Union[ScanPlan, Plan]],
+    model: CostModel,
+    dark_preprocessors: T.Sequence[DarkPreprocessor] = (),
+    shutter_preprocessors: T.Sequence[ShutterPreprocessor] = (),
+) -> QueueEstimate:
+    """Estimate the duration of the plans of the samples run one after another.
+
+    Each ScanPlan is walked once through the dark and the shutter preprocessors without touching the hardware
+    and the operations that take time are kept until it changes. The walks are replayed in the order of the
+    queue with the cost model, so that the dark frames are taken when the ones of the same exposure are older
+    than the max age. The dark frames taken before the queue are not counted.
+
+    Parameters
+    ----------
+    samples : Sequence
+        The metadata of the samples.
+    plans : Sequence
+        The ScanPlans or the generators of the samples. The generators are consumed.
+    model : CostModel
+        The time taken by the operations of the beamline.
+    dark_preprocessors : Sequence
+        The DarkPreprocessors of the run engine.
+    shutter_preprocessors : Sequence
+        The ShutterPreprocessors of the run engine.
+
+    Returns
+    -------
+    estimate : QueueEstimate
+        The estimation of each plan and of the queue.
+    """
+    dark_preprocessors = [pp for pp in dark_preprocessors if not pp.disabled]
+    shutter_preprocessors = [pp for pp in shutter_preprocessors if not pp.disabled]
+    # the ScanPlans are walked again after a change of the preprocessors or their shutter configurations
+    config = tuple(dark_preprocessors) + tuple(shutter_preprocessors) + tuple(
+        pp._shutter_config for pp in shutter_preprocessors
+    )
+
+    def walk(plan):
+        pipeline = PreprocessorPipeline(_DarkMarker(pp) for pp in dark_preprocessors)
+        for pp in shutter_preprocessors:
+            # a copy keeps the state of the preprocessor of the run engine
+            pipeline.add(
+                ShutterPreprocessor(
+                    detector=pp._detector,
+                    dark_group_prefix=pp._dark_group_prefix,
+                    shutter_config=pp._shutter_config
+                )
+            )
+        return _trace(pipeline(plan))
+
+    beamline = _Beamline(model)
+    estimates = []
+    # the walks of the ScanPlans repeated in the queue
+    walked = {}
+    for sample, plan in zip(samples, plans):
+        if isinstance(plan, ScanPlan):
+            if id(plan) not in walked:
+                walked[id(plan)] = (
+                    plan._cached("dryrun", config + plan._plan_config(), lambda: walk(plan.factory())),
+                    plan.short_summary()
+                )
+            ops, summary = walked[id(plan)]
+        else:
+            ops = walk(plan)
+            summary = getattr(plan, "__name__", "custom plan")
+        estimate = Estimate(sample.get("sample_name", ""), summary)
+        estimates.append(beamline.run(ops, estimate))
+    return QueueEstimate(estimates, beamline.unmodeled)
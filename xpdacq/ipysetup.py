@@ -17,6 +17,8 @@ from xpdacq.xpdacq_conf import (GlblYamlDict, _load_beamline_config,
                                 xpd_configuration)
 
 Address = T.Union[T.Tuple[str, int], str]
+# the file of the calibration cache of a detector in glbl['config_base']
+CALIB_CACHE_FILE = ".calib_cache_{}.yml"
 
 
 def _rename_calib_file_suffix(glbl: dict) -> None:
@@ -36,7 +38,13 @@ def _get_locked_signals(det: Device) -> None:
 
 
 def _add_a_dark_preprocessor(xrun: CustomizedRunEngine, det: Device, sc: ShutterConfig) -> None:
-    dpp = DarkPreprocessor(detector=det, max_age=6., locked_signals=_get_locked_signals(det), shutter_config=sc)
+    dpp = DarkPreprocessor(
+        detector=det,
+        max_age=6.,
+        locked_signals=_get_locked_signals(det),
+        shutter_config=sc,
+        state_cache=xrun.state_cache
+    )
     xrun.dark_preprocessors.append(dpp)
     return
 
@@ -47,9 +55,28 @@ def _add_many_dark_preprocessors(xrun: CustomizedRunEngine, dets: T.List[Device]
     return
 
 
-def _add_a_calib_preprocessor(xrun: CustomizedRunEngine, det: Device, det_z: T.Optional[Device]) -> None:
+def _add_a_calib_preprocessor(
+    xrun: CustomizedRunEngine,
+    det: Device,
+    det_z: T.Optional[Device],
+    config_base: T.Optional[str] = None,
+    max_size: T.Optional[int] = None,
+    tolerance: float = 0.,
+    interpolate: bool = False
+) -> None:
     locked_signals = [det_z] if det_z is not None else []
-    cpp = CalibPreprocessor(detector=det, locked_signals=locked_signals)
+    cache_file = Path(config_base).joinpath(CALIB_CACHE_FILE.format(det.name)) if config_base else None
+    # the calibrations of the positions of the det_z within the tolerance are used, only the same if 0
+    tolerances = {det_z.name: tolerance} if det_z is not None and tolerance else None
+    cpp = CalibPreprocessor(
+        detector=det,
+        locked_signals=locked_signals,
+        cache_file=cache_file,
+        max_size=max_size,
+        state_cache=xrun.state_cache,
+        tolerances=tolerances,
+        interpolate=interpolate and tolerances is not None
+    )
     xrun.calib_preprocessors.append(cpp)
     return
 
@@ -57,10 +84,14 @@ def _add_a_calib_preprocessor(xrun: CustomizedRunEngine, det: Device, det_z: T.O
 def _add_many_calib_preprocessors(
     xrun: CustomizedRunEngine,
     dets: T.List[Device],
-    det_zs: T.List[T.Optional[Device]]
+    det_zs: T.List[T.Optional[Device]],
+    config_base: T.Optional[str] = None,
+    max_size: T.Optional[int] = None,
+    tolerance: float = 0.,
+    interpolate: bool = False
 ) -> None:
     for det, det_z in zip(dets, det_zs):
-        _add_a_calib_preprocessor(xrun, det, det_z)
+        _add_a_calib_preprocessor(xrun, det, det_z, config_base, max_size, tolerance, interpolate)
     return
 
 
@@ -76,14 +107,23 @@ def _add_many_shutter_preprocessors(xrun: CustomizedRunEngine, dets: T.List[Devi
     return
 
 
+def _clear_last_xrun() -> None:
+    last_xrun = xpd_configuration.get("xrun")
+    if isinstance(last_xrun, CustomizedRunEngine):
+        # the signals are not watched for the last xrun anymore
+        last_xrun.state_cache.clear()
+    return
+
+
 def _set_calib_preprocessor(cpp: CalibPreprocessor, glbl: GlblYamlDict, det_z: T.Optional[Device]) -> None:
     poni_file = Path(glbl["config_base"]).joinpath(glbl["calib_config_name"])
     if poni_file.is_file():
         calib_result = cpp.read(poni_file)
+        # the cache file is read when it is used for the first time and the poni is not written in it
         if det_z is not None and hasattr(det_z, "get"):
-            cpp.add_calib_result({det_z.name: det_z.get()}, calib_result)
+            cpp.seed_calib_result({det_z.name: det_z.get()}, calib_result)
         else:
-            cpp.add_calib_result({}, calib_result)
+            cpp.seed_calib_result({}, calib_result)
     else:
         print(
             "WARNING: '{}' doesn't exist. "
@@ -198,6 +238,7 @@ class UserInterface:
             self._print("No Beamtime object.")
         # instantiate xrun without beamtime, like bluesky setup
         self._print("Create xrun object.")
+        _clear_last_xrun()
         xrun = CustomizedRunEngine(None)
         # add xrun into the xpd_configuration so that glbl can tune dark window
         xpd_configuration["xrun"] = xrun
@@ -222,7 +263,16 @@ class UserInterface:
         self._print("Subscribe preprocessors.")
         sc = ShutterConfig.from_xpdacq() if shutter_config is None else shutter_config
         _add_many_dark_preprocessors(xrun, area_dets, sc)
-        _add_many_calib_preprocessors(xrun, area_dets, det_zs)
+        # the calibration results of the last sessions are loaded when they are used
+        _add_many_calib_preprocessors(
+            xrun,
+            area_dets,
+            det_zs,
+            glbl["config_base"],
+            glbl.get("calib_cache_size"),
+            glbl.get("calib_tolerance", 0.),
+            glbl.get("calib_interpolate", False)
+        )
         _add_many_shutter_preprocessors(xrun, area_dets, sc)
         # add run calibration
         self._print("Create run_calibration.")
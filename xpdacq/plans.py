@@ -427,7 +427,7 @@ class BeamtimeHelper:
         if isinstance(sample, str):
             sample_cls = self._bt.samples[sample]
         elif isinstance(sample, int):
-            sample_cls = list(self._bt.samples.values())[sample]
+            sample_cls = self._bt.samples.sel(sample)
         else:
             raise ValueError(f"{sample} is not int or str. It is {type(sample)}.")
         sample_meta = dict(sample_cls.items())
@@ -460,7 +460,7 @@ class BeamtimeHelper:
         if isinstance(plan, str):
             plan_cls: ScanPlan = self._bt.scanplans[plan]
         elif isinstance(plan, int):
-            plan_cls: ScanPlan = list(self._bt.scanplans.values())[plan]
+            plan_cls: ScanPlan = self._bt.scanplans.sel(plan)
         else:
             raise ValueError(f"{plan} is not int or str. It is {type(plan)}.")
         plan_gen = plan_cls.factory()
@@ -1,6 +1,9 @@
 """The subpackge of callback functions."""
 from .calibpreprocessor import CalibPreprocessor
 from .darkpreprocessor import DarkPreprocessor
-from .maskpreprocessor import MaskPreprocessor
+from .geometryindex import GeometryIndex
+from .maskpreprocessor import MaskAsset, MaskPreprocessor
+from .pipeline import PreprocessorPipeline
 from .shutterconfig import ShutterConfig
 from .shutterpreprocessor import ShutterPreprocessor
+from .statecache import StateCache
@@ -1,3 +1,4 @@
+import os
 import typing as T
 from collections import OrderedDict
 from pathlib import Path
@@ -5,12 +6,18 @@ from pathlib import Path
 import bluesky.plan_stubs as bps
 import bluesky.preprocessors as bpp
 from bluesky import Msg
+import numpy as np
 from frozendict import frozendict
 from ophyd import Component as Cpt
 from ophyd import Device, Signal
 from ophyd.status import Status
 from pyFAI.geometry import Geometry
 
+from .. import serializer
+from ..tools import atomic_write
+from .geometryindex import GeometryIndex
+from .statecache import StateCache
+
 Plan = T.Generator[Msg, T.Any, T.Any]
 SignalList = T.List[Signal]
 CalibResult = T.Tuple[float, float, float, float, float, float, float, str]
@@ -18,18 +25,14 @@ FilePath = T.Union[str, Path]
 State = T.Dict[str, T.Hashable]
 
 
-def _get_state(signals) -> Plan:
-    plist = (bps.rd(s) for s in signals)
-    values = (yield from bpp.pchain(*plist))
-    keys = (s.name for s in signals)
-    state = frozendict(zip(keys, values))
-    return state
-
-
 class CalibPreprocessorError(Exception):
     pass
 
 
+def _to_builtin(value: T.Any) -> T.Any:
+    return value.item() if isinstance(value, np.generic) else value
+
+
 class CalibInfo(Device):
     """The information of calibration from pyFAI.
     """
@@ -72,6 +75,25 @@ class CalibPreprocessor:
         The name of the stream to add calibratino data, default "calib".
     dark_group_prefix : str
         The prefix of the trigger message for a dark frame, default "bluesky-darkframes-trigger".
+    on_change : bool
+        If True, a calib event is emitted only when the calibration differs from the last one emitted in the
+        run. The locked signals are read again only after an `open_run`, a `set` of a locked signal or a new
+        calibration result, other triggers are not mutated. Default False, a calib event before every trigger.
+    state_cache : StateCache
+        The cache of the values of the locked signals, usually the one of the run engine. By default a new one.
+    tolerances : Dict[str, float]
+        The tolerance of the value of the locked signals by name. If given, a state that is not in the cache
+        uses the calibration of the nearest state within the tolerances. Default None, only the same state.
+    interpolate : bool
+        If True, the dist, poni1 and poni2 of a state between the calibrated states are interpolated linearly
+        along one of the signals in the `tolerances`. Default False.
+    cache_file : str or Path
+        The file to keep the calibration results and their states in across the sessions. It is loaded when
+        the cache is used for the first time and written when a calibration result is added. Default None.
+    max_size : int
+        The maximum number of the calibration results in the cache. If given, the cache is in the order of
+        use, the least recently used ones are removed and the latest one is the most recently used. Default
+        None, no limit and the latest one is the last added.
     """
 
     def __init__(
@@ -79,10 +101,18 @@ class CalibPreprocessor:
         detector: Device,
         locked_signals: SignalList = None,
         stream_name: str = "calib",
-        dark_group_prefix: str = "bluesky-darkframes-trigger"
+        dark_group_prefix: str = "bluesky-darkframes-trigger",
+        on_change: bool = False,
+        state_cache: StateCache = None,
+        tolerances: T.Optional[T.Dict[str, float]] = None,
+        interpolate: bool = False,
+        cache_file: T.Optional[FilePath] = None,
+        max_size: T.Optional[int] = None
     ) -> None:
         if locked_signals is None:
             locked_signals = []
+        if interpolate and not tolerances:
+            raise CalibPreprocessorError("The tolerances of the signals to interpolate along are not given.")
         self._detector: Device = detector
         self._calib_info: CalibInfo = CalibInfo(name=detector.name)
         self._disabled: bool = False
@@ -90,6 +120,21 @@ class CalibPreprocessor:
         self._stream_name = stream_name
         self._dark_group_prefix: str = dark_group_prefix
         self._cache = OrderedDict()
+        self._on_change = on_change
+        self._state_cache = state_cache if state_cache is not None else StateCache()
+        # the calibration emitted in the current run and if the locked signals may have changed since
+        self._emitted: T.Optional[CalibResult] = None
+        self._stale: bool = True
+        # indexed again when the cache changes
+        self._index = GeometryIndex(tolerances, interpolate) if tolerances else None
+        self._indexed: bool = False
+        self._cache_file = cache_file
+        self._max_size = max_size
+        self._loaded: bool = cache_file is None
+        # the calibration of the session given by `seed_calib_result`, not in the file
+        self._seed: T.Optional[T.Tuple[State, CalibResult]] = None
+        # whether a calibration result is added in the session, after which it is the latest one
+        self._added: bool = False
 
     @property
     def calib_info(self) -> CalibInfo:
@@ -116,8 +161,72 @@ class CalibPreprocessor:
                         geo.rot1, geo.rot2, geo.rot3, geo.detector.name)
         return calib_result
 
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.isfile(self._cache_file):
+            return
+        try:
+            records = serializer.load_file(self._cache_file)
+            items = [(frozendict(r["state"]), tuple(r["calib_result"])) for r in records or []]
+        except Exception as error:
+            print("WARNING: Cannot load the calibration cache '{}': {}".format(self._cache_file, error))
+            return
+        self._cache.update(items)
+        self._evict()
+        self._stale = True
+        self._indexed = False
+        return
+
+    def _save(self) -> None:
+        if self._cache_file is None:
+            return
+        records = [
+            {"state": {k: _to_builtin(v) for k, v in state.items()},
+             "calib_result": [_to_builtin(v) for v in calib_result]}
+            for state, calib_result in self._cache.items()
+        ]
+        dirname = os.path.dirname(os.path.abspath(self._cache_file))
+        os.makedirs(dirname, exist_ok=True)
+        atomic_write(self._cache_file, serializer.dump(records))
+        return
+
+    def _evict(self) -> None:
+        if self._max_size is None:
+            return
+        while len(self._cache) > self._max_size:
+            self._cache.popitem(last=False)
+        return
+
+    def _touch(self, state: State) -> None:
+        if self._max_size is not None:
+            self._cache.move_to_end(state)
+        return
+
     def add_calib_result(self, state: State, calib_result: CalibResult) -> None:
-        self._cache[frozendict(state)] = calib_result
+        self._load()
+        state = frozendict(state)
+        self._cache[state] = calib_result
+        self._touch(state)
+        self._evict()
+        if self._seed is not None and self._seed[0] == state:
+            self._seed = None
+        self._added = True
+        self._stale = True
+        self._indexed = False
+        self._save()
+        return
+
+    def seed_calib_result(self, state: State, calib_result: CalibResult) -> None:
+        """Use the calibration result in the session without reading or writing the cache file.
+
+        It is used for the state and as the latest calibration result until a calibration result is added.
+        It does not count in the `max_size` and it is not saved in the file.
+        """
+        self._seed = (frozendict(state), calib_result)
+        self._stale = True
+        self._indexed = False
         return
 
     def load_calib_result(self, state: State, poni_file: str) -> None:
@@ -137,50 +246,113 @@ class CalibPreprocessor:
 
     def __call__(self, plan: T.Generator[Msg, T.Any, T.Any]) -> T.Generator[Msg, T.Any, T.Any]:
         """Mutate the plan. Read the calibration information data every time after the detector is read."""
-        if self._disabled or not self._cache:
+        if self._seed is None:
+            self._load()
+        if self._disabled or not (self._cache or self._seed):
             return plan
+        return bpp.plan_mutator(plan, self._mutate)
+
+    def add_hooks(self, pipeline) -> None:
+        """Add the hooks of the preprocessing to a `PreprocessorPipeline`."""
+        if self._seed is None:
+            self._load()
+        if self._disabled or not (self._cache or self._seed):
+            return
+        pipeline.add_hook("trigger", self._detector, self._mutate)
+        if self._on_change:
+            pipeline.add_hook("open_run", None, self._mutate)
+            for signal in self._locked_signals:
+                pipeline.add_hook("set", signal, self._mutate)
+        return
 
-        def _get_calib(state: State) -> CalibResult:
-            if state in self._cache:
-                return self._cache[state]
-            print("WARNING: Cannot find '{}' in the cache. Use the latest one.".format(state))
-            return next(reversed(self._cache.values()))
-
-        def _set_calib(calib_result: CalibInfo) -> Plan:
-            return bps.abs_set(self._calib_info, calib_result, wait=True)
-
-        def _read_calib() -> Plan:
-            return bps.trigger_and_read([self._calib_info], name=self._stream_name)
-
-        def _get_set_read_calib(msg: Msg) -> Plan:
-            state = (yield from _get_state(self._locked_signals))
-            calib_result = _get_calib(state)
-            yield from _set_calib(calib_result)
-            yield from _read_calib()
-            return (yield msg)
-
-        def _mutate(msg: Msg):
-            group = msg.kwargs["group"] if ("group" in msg.kwargs) and msg.kwargs["group"] else ""
-            if (
-                msg.command == "trigger"
-            ) and (
-                msg.obj is self._detector
-            ) and (
-                not group.startswith(self._dark_group_prefix)
-            ):
-                return _get_set_read_calib(msg), None
+    def _get_calib(self, state: State) -> CalibResult:
+        self._load()
+        seed = self._seed
+        if seed is not None and seed[0] == state:
+            return seed[1]
+        if state in self._cache:
+            self._touch(state)
+            return self._cache[state]
+        if self._index is not None:
+            if not self._indexed:
+                self._index.update(self._seeded_cache())
+                self._indexed = True
+            matched = self._index.match(state)
+            if matched is not None:
+                if seed is not None and seed[0] == matched:
+                    return seed[1]
+                self._touch(matched)
+                return self._cache[matched]
+            if self._index.interpolate:
+                calib_result = self._index.lookup(state)
+                if calib_result is not None:
+                    return calib_result
+        print("WARNING: Cannot find '{}' in the cache. Use the latest one.".format(state))
+        if seed is not None and not (self._added and self._cache):
+            return seed[1]
+        return next(reversed(self._cache.values()))
+
+    def _seeded_cache(self) -> T.Mapping[State, CalibResult]:
+        if self._seed is None:
+            return self._cache
+        cache = OrderedDict(self._cache)
+        cache[self._seed[0]] = self._seed[1]
+        return cache
+
+    def _get_set_read_calib(self, msg: Msg) -> Plan:
+        state = (yield from self._state_cache.read_state(self._locked_signals))
+        calib_result = self._get_calib(state)
+        yield from bps.abs_set(self._calib_info, calib_result, wait=True)
+        yield from bps.trigger_and_read([self._calib_info], name=self._stream_name)
+        return (yield msg)
+
+    def _read_calib_on_change(self, msg: Msg) -> Plan:
+        state = (yield from self._state_cache.read_state(self._locked_signals))
+        calib_result = self._get_calib(state)
+        self._stale = False
+        if calib_result != self._emitted:
+            self._emitted = calib_result
+            yield from bps.abs_set(self._calib_info, calib_result, wait=True)
+            yield from bps.trigger_and_read([self._calib_info], name=self._stream_name)
+        return (yield msg)
+
+    def _mutate(self, msg: Msg):
+        if self._on_change and msg.command != "trigger":
+            if msg.command == "open_run":
+                self._emitted = None
+                self._stale = True
+            elif msg.command == "set" and any(msg.obj is signal for signal in self._locked_signals):
+                self._stale = True
             return None, None
-
-        return bpp.plan_mutator(plan, _mutate)
+        group = msg.kwargs["group"] if ("group" in msg.kwargs) and msg.kwargs["group"] else ""
+        if (
+            msg.command == "trigger"
+        ) and (
+            msg.obj is self._detector
+        ) and (
+            not group.startswith(self._dark_group_prefix)
+        ):
+            if not self._on_change:
+                return self._get_set_read_calib(msg), None
+            if self._stale or self._emitted is None:
+                return self._read_calib_on_change(msg), None
+        return None, None
 
     def clear(self) -> None:
+        # the file is cleared too
+        self._loaded = True
+        self._seed = None
         self._cache.clear()
+        self._stale = True
+        self._indexed = False
+        self._save()
         return
 
     def record(self, calib_result: CalibResult) -> Plan:
-        state = (yield from _get_state(self._locked_signals))
+        state = (yield from self._state_cache.read_state(self._locked_signals))
         self.add_calib_result(state, calib_result)
         return
 
     def __repr__(self):
+        self._load()
         return "<{} of {} with {} cache>".format(self.__class__.__name__, self.detector.name, len(self._cache))
@@ -1,16 +1,64 @@
+import functools
 import typing as T
 
 import bluesky.plan_stubs as bps
 from bluesky import Msg
-from bluesky_darkframes import DarkFramePreprocessor, SnapshotDevice
+from bluesky.utils import short_uid
+from bluesky_darkframes import (GROUP_PREFIX, DarkFramePreprocessor,
+                                NoMatchingSnapshot, SnapshotDevice,
+                                trigger_and_read)
 from ophyd import Device
 from ophyd.signal import Signal
+from xpdacq.preprocessors.pipeline import PreprocessorPipeline
 from xpdacq.preprocessors.shutterconfig import ShutterConfig
+from xpdacq.preprocessors.statecache import StateCache
 
 Plan = T.Generator[Msg, T.Any, T.Any]
 ShutterControl = T.Callable[[], Plan]
 
 
+class _SnapshotShell:
+    """The object read in the dark stream, holding the snapshot that is swapped in the middle of a run.
+
+    The run engine sees the same object in all the runs. It is the same as the private shell of
+    bluesky-darkframes 0.6.
+    """
+
+    def __init__(self) -> None:
+        self._snapshot = None
+
+    def set_snapshot(self, snapshot: SnapshotDevice) -> None:
+        self._snapshot = snapshot
+        return
+
+    def get_snapshot(self) -> T.Optional[SnapshotDevice]:
+        return self._snapshot
+
+    def describe(self):
+        return self._snapshot.describe()
+
+    def describe_configuration(self):
+        return self._snapshot.describe_configuration()
+
+    def read(self):
+        return self._snapshot.read()
+
+    def read_configuration(self):
+        return self._snapshot.read_configuration()
+
+    def trigger(self):
+        return self._snapshot.trigger()
+
+    @property
+    def name(self) -> str:
+        return self._snapshot.name
+
+    def __getattr__(self, key):
+        if key == "_snapshot":
+            raise AttributeError(key)
+        return getattr(self._snapshot, key)
+
+
 class DarkPreprocessor(DarkFramePreprocessor):
     """A plan preprocessor that ensures each Run records a dark frame.
 
@@ -53,6 +101,8 @@ class DarkPreprocessor(DarkFramePreprocessor):
         ```
 
         Default is the `xpdacq.beamtime.close_shutter_stub`
+    state_cache : StateCache
+        The cache of the values of the locked signals, usually the one of the run engine. By default a new one.
     """
 
     def __init__(
@@ -63,11 +113,13 @@ class DarkPreprocessor(DarkFramePreprocessor):
         locked_signals: T.Optional[T.Iterable[Signal]] = None,
         limit: T.Optional[int] = None,
         stream_name='dark',
-        shutter_config: ShutterConfig = None
+        shutter_config: ShutterConfig = None,
+        state_cache: StateCache = None
     ):
         if shutter_config is None:
             shutter_config = ShutterConfig.from_xpdacq()
         self._shutter_config = shutter_config
+        self._state_cache = state_cache if state_cache is not None else StateCache()
 
         def _dark_plan(_detector):
             shutter = self._shutter_config.shutter
@@ -95,3 +147,76 @@ class DarkPreprocessor(DarkFramePreprocessor):
             limit=limit,
             stream_name=stream_name
         )
+        # only the snapshot cache of the DarkFramePreprocessor is used, the mutation of the plan is done here
+        self._take_dark_frame = functools.partial(_dark_plan, detector)
+        self._shell = _SnapshotShell()
+        self._new_run = True
+        self._inserting = False
+        self._is_disabled = False
+
+    @property
+    def disabled(self) -> bool:
+        """Whether the preprocessing is disabled."""
+        return self._is_disabled
+
+    def disable(self) -> None:
+        """Make this preprocessor a no-op."""
+        self._is_disabled = True
+        return
+
+    def enable(self) -> None:
+        """Counterpart to `disable`."""
+        self._is_disabled = False
+        return
+
+    def __call__(self, plan: Plan) -> Plan:
+        """Mutate the plan by the hooks, so that the snapshots of both ways have the same states."""
+        return PreprocessorPipeline([self])(plan)
+
+    def add_hooks(self, pipeline) -> None:
+        """Add the hooks of the preprocessing to a `PreprocessorPipeline`.
+
+        The hooks insert the dark frames like the plan mutator of the `DarkFramePreprocessor` in
+        bluesky-darkframes 0.6, using only its public cache of the snapshots.
+        """
+        self._inserting = False
+        if self._is_disabled:
+            return
+        pipeline.add_hook("trigger", self.detector, self._maybe_insert_dark_frame)
+        pipeline.add_hook("open_run", None, self._maybe_insert_dark_frame)
+        return
+
+    def _insert_dark_frame(self, force_read: bool, msg: Msg = None) -> Plan:
+        # acquire a fresh snapshot if there is no cached one for the state of the locked signals
+        state = (yield from self._state_cache.read_state(self.locked_signals))
+        try:
+            snapshot = self.get_snapshot(state)
+        except NoMatchingSnapshot:
+            snapshot = yield from self._take_dark_frame()
+            self.add_snapshot(snapshot, state)
+        # a new event only if another snapshot is used or it is a new run
+        if (snapshot is not self._shell.get_snapshot()) or force_read:
+            self._shell.set_snapshot(snapshot)
+            yield from bps.stage(self._shell)
+            yield from trigger_and_read([self._shell], name=self.stream_name, group=short_uid(GROUP_PREFIX))
+            yield from bps.unstage(self._shell)
+        self._inserting = False
+        if msg is not None:
+            return (yield msg)
+
+    def _maybe_insert_dark_frame(self, msg: Msg):
+        if (
+            msg.command == "trigger"
+            and msg.obj is self.detector
+            and not msg.kwargs["group"].startswith(GROUP_PREFIX)
+            and not self._inserting
+        ):
+            force_read = self._new_run
+            self._new_run = False
+            # prevents the infinite recursion
+            self._inserting = True
+            return self._insert_dark_frame(force_read=force_read, msg=msg), None
+        elif msg.command == "open_run":
+            # a new event for the new run
+            self._new_run = True
+        return None, None
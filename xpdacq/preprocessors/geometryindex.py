@@ -0,0 +1,163 @@
+import numbers
+import typing as T
+
+import numpy as np
+from frozendict import frozendict
+
+CalibResult = T.Tuple[float, float, float, float, float, float, float, str]
+State = T.Mapping[str, T.Hashable]
+# the indexes of dist, poni1 and poni2 in a calibration result
+INTERPOLATED_FIELDS = (1, 2, 3)
+
+
+def _is_number(value: T.Any) -> bool:
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+class _Group:
+    """The calibration results of the states that differ only in the values of the signals with tolerances."""
+
+    def __init__(self) -> None:
+        self.points = []
+        self.states = []
+        self.calib_results = []
+
+    def add(self, point: np.ndarray, state: State, calib_result: CalibResult) -> None:
+        self.points.append(point)
+        self.states.append(state)
+        self.calib_results.append(calib_result)
+        return
+
+    def freeze(self) -> None:
+        # sorted by the value of the first signal, the points are in the units of the tolerances
+        points = np.array(self.points, dtype=float)
+        order = np.argsort(points[:, 0], kind="stable")
+        self.points = points[order]
+        self.states = [self.states[i] for i in order]
+        self.calib_results = [self.calib_results[i] for i in order]
+        return
+
+    def nearest(self, point: np.ndarray) -> T.Optional[int]:
+        first = self.points[:, 0]
+        start = np.searchsorted(first, point[0] - 1., side="left")
+        stop = np.searchsorted(first, point[0] + 1., side="right")
+        if start == stop:
+            return None
+        diff = np.abs(self.points[start:stop] - point)
+        within = np.all(diff <= 1., axis=1)
+        if not np.any(within):
+            return None
+        distance = np.where(within, np.sum(diff ** 2, axis=1), np.inf)
+        return start + int(np.argmin(distance))
+
+    def interpolate(self, point: np.ndarray) -> T.Optional[CalibResult]:
+        n_dims = point.shape[0]
+        for axis in range(n_dims):
+            # the neighbors along the axis are within the tolerances of the other signals
+            others = [i for i in range(n_dims) if i != axis]
+            near = np.all(np.abs(self.points[:, others] - point[others]) <= 1., axis=1)
+            values = self.points[:, axis]
+            below = np.flatnonzero(near & (values <= point[axis]))
+            above = np.flatnonzero(near & (values >= point[axis]))
+            if below.size == 0 or above.size == 0:
+                continue
+            i = below[np.argmax(values[below])]
+            j = above[np.argmin(values[above])]
+            span = values[j] - values[i]
+            t = float((point[axis] - values[i]) / span) if span else 0.
+            lower, upper = self.calib_results[i], self.calib_results[j]
+            # the fields that are not interpolated are the ones of the nearest neighbor
+            calib_result = list(lower if t <= 0.5 else upper)
+            for field in INTERPOLATED_FIELDS:
+                calib_result[field] = lower[field] + t * (upper[field] - lower[field])
+            return tuple(calib_result)
+        return None
+
+
+class GeometryIndex:
+    """The index of the calibration results by the numeric values of the locked signals.
+
+    The states are grouped by the values of the signals without a tolerance, which must be equal, and each
+    group is sorted by the values of the signals with a tolerance. A state is matched to the nearest
+    calibrated state whose values are all within the tolerances. If there is no such state and
+    `interpolate` is True, the dist, poni1 and poni2 are interpolated linearly between the calibrated states
+    on both sides of the state along one of the signals, the others within the tolerances.
+
+    Parameters
+    ----------
+    tolerances : Dict[str, float]
+        The tolerance of the value of each locked signal by name. They must be positive.
+    interpolate : bool
+        Whether to interpolate between the calibrated states. Default False.
+
+    Examples
+    --------
+    >>> index = GeometryIndex({"det_z": 0.01}, interpolate=True)
+    >>> index.update({frozendict(det_z=100.): calib_result1, frozendict(det_z=200.): calib_result2})
+    >>> index.lookup({"det_z": 150.})
+    """
+
+    def __init__(self, tolerances: T.Dict[str, float], interpolate: bool = False) -> None:
+        for name, tolerance in tolerances.items():
+            if not tolerance > 0.:
+                raise ValueError("The tolerance of '{}' must be positive, not {}.".format(name, tolerance))
+        self._tolerances = dict(tolerances)
+        self._interpolate = interpolate
+        self._groups = {}
+
+    @property
+    def tolerances(self) -> T.Dict[str, float]:
+        return dict(self._tolerances)
+
+    @property
+    def interpolate(self) -> bool:
+        return self._interpolate
+
+    def _split(self, state: State) -> T.Tuple[T.Hashable, np.ndarray]:
+        names = sorted(name for name, value in state.items() if name in self._tolerances and _is_number(value))
+        exact = frozendict((name, value) for name, value in state.items() if name not in names)
+        point = np.array([state[name] / self._tolerances[name] for name in names], dtype=float)
+        return (exact, tuple(names)), point
+
+    def update(self, cache: T.Mapping[State, CalibResult]) -> None:
+        """Index the calibration results of the states in the cache again."""
+        groups = {}
+        for state, calib_result in cache.items():
+            key, point = self._split(state)
+            if point.size == 0:
+                # matched only exactly
+                continue
+            if key not in groups:
+                groups[key] = _Group()
+            groups[key].add(point, state, calib_result)
+        for group in groups.values():
+            group.freeze()
+        self._groups = groups
+        return
+
+    def match(self, state: State) -> T.Optional[State]:
+        """Return the nearest calibrated state within the tolerances, None if there is no such state."""
+        key, point = self._split(state)
+        group = self._groups.get(key)
+        if group is None:
+            return None
+        i = group.nearest(point)
+        return None if i is None else group.states[i]
+
+    def lookup(self, state: State) -> T.Optional[CalibResult]:
+        """Return the calibration result matched to the state, None if there is no match."""
+        key, point = self._split(state)
+        group = self._groups.get(key)
+        if group is None:
+            return None
+        i = group.nearest(point)
+        if i is not None:
+            return group.calib_results[i]
+        if self._interpolate:
+            return group.interpolate(point)
+        return None
+
+    def __repr__(self) -> str:
+        return "<{} of {} with {} groups>".format(
+            self.__class__.__name__, ", ".join(self._tolerances), len(self._groups)
+        )
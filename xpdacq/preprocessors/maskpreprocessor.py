@@ -1,3 +1,8 @@
+import collections
+import hashlib
+import io
+import os
+import time
 import typing as T
 from pathlib import Path
 
@@ -6,9 +11,15 @@ import bluesky.preprocessors as bpp
 import fabio
 import numpy as np
 from bluesky import Msg
+from bluesky.utils import new_uid
 from ophyd import Device, Signal
+from ophyd.status import Status
+
+from ..tools import atomic_write
 
 Plan = T.Generator[Msg, T.Any, T.Any]
+# the directory of the mask files in glbl['config_base']
+MASK_DIR = "masks"
 
 
 class MaskPreprocessorError(Exception):
@@ -36,24 +47,109 @@ def _load_overlapping_masks(mask_files: T.List[str]) -> np.ndarray:
     return sum(masks)
 
 
+class MaskAsset(Signal):
+    """The mask saved in a file named by the hash of its content and read as a reference to the file.
+
+    The value of the signal is the hash of the mask. Each distinct mask is written once as
+    `<mask_dir>/<hash>_0.npy`. Each trigger makes a new resource document of the file and a datum document, which
+    are collected in the bundle of the reading, so that the event only contains the datum id.
+
+    A `MaskPreprocessorError` is raised if it is triggered, read or described before a mask is put.
+
+    Parameters
+    ----------
+    mask_dir : str
+        The directory of the mask files.
+    """
+
+    def __init__(self, *, mask_dir: str, **kwargs) -> None:
+        # the shape of the mask put and the reading of the last trigger
+        self._shape: T.Optional[T.List[int]] = None
+        self._reading: T.Optional[dict] = None
+        self._asset_docs = collections.deque()
+        super().__init__(value=None, **kwargs)
+        self.mask_dir = mask_dir
+
+    def _check_mask(self) -> None:
+        if self._shape is None:
+            raise MaskPreprocessorError("No mask was put to '{}'. Please put a mask first.".format(self.name))
+        return
+
+    def put(self, mask: np.ndarray, **kwargs) -> None:
+        """Write the mask to its file if it is not there and set the value to its hash."""
+        buffer = io.BytesIO()
+        np.save(buffer, np.asarray(mask), allow_pickle=False)
+        data = buffer.getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+        filepath = os.path.join(self.mask_dir, "{}_0.npy".format(digest))
+        if not os.path.isfile(filepath):
+            os.makedirs(self.mask_dir, exist_ok=True)
+            atomic_write(filepath, data)
+        self._shape = list(np.shape(mask))
+        super().put(digest, **kwargs)
+        return
+
+    def trigger(self) -> Status:
+        self._check_mask()
+        # the file is shared by the runs but the resource is of the run
+        resource_uid = new_uid()
+        resource = {
+            "spec": "NPY_SEQ",
+            "root": self.mask_dir,
+            "resource_path": self.get(),
+            "resource_kwargs": {},
+            "uid": resource_uid,
+            "path_semantics": {"posix": "posix", "nt": "windows"}[os.name]
+        }
+        datum_id = "{}/0".format(resource_uid)
+        datum = {"resource": resource_uid, "datum_kwargs": {"index": 0}, "datum_id": datum_id}
+        self._asset_docs.clear()
+        self._asset_docs.append(("resource", resource))
+        self._asset_docs.append(("datum", datum))
+        self._reading = {"value": datum_id, "timestamp": time.time()}
+        return super().trigger()
+
+    def read(self) -> dict:
+        self._check_mask()
+        if self._reading is None:
+            raise MaskPreprocessorError("'{}' was not triggered. Please trigger it before reading.".format(self.name))
+        return {self.name: dict(self._reading)}
+
+    def describe(self) -> dict:
+        self._check_mask()
+        return {
+            self.name: {"source": "file", "dtype": "array", "shape": self._shape, "external": "FILESTORE:"}
+        }
+
+    def collect_asset_docs(self) -> T.Iterator[T.Tuple[str, dict]]:
+        items = list(self._asset_docs)
+        self._asset_docs.clear()
+        yield from items
+
+
 class MaskPreprocessor:
     """Mutate the plan to push the mask data in the `mask` event stream right after the run open.
 
+    The mask is written once to a file named by the hash of its content and the event of the mask refers to
+    the file, see `MaskAsset`.
+
     Parameter
     ---------
     detector: Device
         The detector to use the mask for.
     stream_name: str
         The name of the event stream to push the mask, default "mask".
+    mask_dir: str
+        The directory of the mask files, e.g. the `MASK_DIR` in the `config_base` of the glbl.
     """
 
-    def __init__(self, detector: Device, stream_name: str = "mask") -> None:
-        self._mask = Signal(name="{}_mask".format(detector.name), value=None)
+    def __init__(self, detector: Device, stream_name: str = "mask", *, mask_dir: str) -> None:
+        self._mask = MaskAsset(name="{}_mask".format(detector.name), mask_dir=mask_dir)
         self._stream_name = stream_name
 
     def set_mask(self, mask: np.ndarray) -> None:
         if mask.ndim != 2:
-            raise MaskPreprocessor("Mask dimsenions must be 2. This is {}.".format(mask.ndim))
+            raise MaskPreprocessorError("Mask dimsenions must be 2. This is {}.".format(mask.ndim))
         self._mask.put(mask)
         return
 
@@ -68,16 +164,22 @@ class MaskPreprocessor:
         return
 
     def __call__(self, plan: Plan) -> Plan:
-        if self._mask is None:
+        if self._mask.get() is None:
             return plan
+        return bpp.plan_mutator(plan, self._mutate)
 
-        def _mutate(msg: Msg) -> T.Tuple[None, Plan]:
-            if msg.command == "open_run":
-                read_mask = bps.trigger_and_read(
-                    [self._mask],
-                    name=self._stream_name
-                )
-                return None, read_mask
-            return None, None
+    def add_hooks(self, pipeline) -> None:
+        """Add the hooks of the preprocessing to a `PreprocessorPipeline`."""
+        if self._mask.get() is None:
+            return
+        pipeline.add_hook("open_run", None, self._mutate)
+        return
 
-        return bpp.plan_mutator(plan, _mutate)
+    def _mutate(self, msg: Msg) -> T.Tuple[None, Plan]:
+        if msg.command == "open_run":
+            read_mask = bps.trigger_and_read(
+                [self._mask],
+                name=self._stream_name
+            )
+            return None, read_mask
+        return None, None
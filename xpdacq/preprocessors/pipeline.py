@@ -0,0 +1,182 @@
+import typing as T
+
+from bluesky import Msg
+from bluesky.utils import single_gen
+
+Plan = T.Generator[Msg, T.Any, T.Any]
+MsgProc = T.Callable[[Msg], T.Tuple[T.Optional[Plan], T.Optional[Plan]]]
+
+
+class _HookTable:
+    """The hooks of consecutive preprocessors run in one generator layer.
+
+    A stage is the hooks of one preprocessor. The messages inserted by a
+    stage go through the same stage and the later ones, like the messages
+    inserted by a ``plan_mutator`` go through the mutator itself and the
+    ones wrapped around it.
+    """
+
+    def __init__(self) -> None:
+        self._n_stages = 0
+        # (command, id(obj)) -> [(stage, func)], the objects are kept in _objs
+        self._by_obj = {}
+        # command -> [(stage, func)] of the hooks for any object
+        self._by_command = {}
+        self._objs = []
+        self._routes = {}
+
+    def new_stage(self) -> None:
+        self._n_stages += 1
+
+    def add_hook(self, command: str, obj: T.Any, func: MsgProc) -> None:
+        if not self._n_stages:
+            self.new_stage()
+        hook = (self._n_stages - 1, func)
+        if obj is None:
+            self._by_command.setdefault(command, []).append(hook)
+        else:
+            self._objs.append(obj)
+            self._by_obj.setdefault((command, id(obj)), []).append(hook)
+        self._routes.clear()
+
+    def _hooks_of(self, msg: Msg) -> T.Sequence[T.Tuple[int, MsgProc]]:
+        command = msg.command
+        key = (command, id(msg.obj))
+        by_obj = self._by_obj.get(key)
+        if by_obj is None:
+            return self._by_command.get(command, ())
+        route = self._routes.get(key)
+        if route is None:
+            # the objects in _by_obj are alive so that their ids are not reused
+            route = self._routes[key] = sorted(
+                by_obj + self._by_command.get(command, []),
+                key=lambda hook: hook[0]
+            )
+        return route
+
+    def __call__(self, plan: Plan) -> Plan:
+        # the messages seen by each stage, kept alive like in plan_mutator
+        seen = [dict() for _ in range(self._n_stages)]
+        ret = None
+        exc = None
+        while True:
+            try:
+                msg = plan.send(ret) if exc is None else plan.throw(exc)
+            except StopIteration as e:
+                return e.value
+            ret = exc = None
+            try:
+                if self._hooks_of(msg):
+                    ret = yield from self._process(msg, 0, seen)
+                else:
+                    ret = yield msg
+            except GeneratorExit:
+                plan.close()
+                raise
+            except Exception as e:
+                exc = e
+
+    def _process(self, msg: Msg, start: int, seen: T.List[dict]) -> Plan:
+        for stage, func in self._hooks_of(msg):
+            if stage < start or id(msg) in seen[stage]:
+                continue
+            seen[stage][id(msg)] = msg
+            head, tail = func(msg)
+            if head is None:
+                if tail is None:
+                    continue
+                head = single_gen(msg)
+            ret = yield from self._drive(head, stage, seen)
+            if tail is not None:
+                yield from self._drive(tail, stage, seen)
+            return ret
+        return (yield msg)
+
+    def _drive(self, plan: Plan, stage: int, seen: T.List[dict]) -> Plan:
+        ret = None
+        exc = None
+        while True:
+            try:
+                msg = plan.send(ret) if exc is None else plan.throw(exc)
+            except StopIteration as e:
+                return e.value
+            ret = exc = None
+            try:
+                if self._hooks_of(msg):
+                    ret = yield from self._process(msg, stage, seen)
+                else:
+                    ret = yield msg
+            except GeneratorExit:
+                plan.close()
+                raise
+            except Exception as e:
+                exc = e
+
+
+class PreprocessorPipeline:
+    """Run the preprocessors of a plan in a single pass over its messages.
+
+    Wrapping a plan in each preprocessor stacks one ``plan_mutator`` per
+    preprocessor and every message goes through all of them. Instead, the
+    preprocessors add hooks keyed by the command and the object of the
+    messages that they mutate. The pipeline looks up the hooks of each
+    message in a dict and calls them in the order of the preprocessors, so
+    that the plan is mutated in the same way as by the stacked wrappers.
+
+    A preprocessor without the `add_hooks` method is applied as a wrapper
+    in its turn.
+
+    Parameters
+    ----------
+    preprocessors : Iterable
+        The preprocessors in the order of the wrappers, the innermost first.
+
+    Examples
+    --------
+    >>> pipeline = PreprocessorPipeline([calib_pp, dark_pp, shutter_pp])
+    >>> plan = pipeline(bp.count([det]))
+    """
+
+    def __init__(self, preprocessors: T.Iterable[T.Callable[[Plan], Plan]] = ()) -> None:
+        self._layers = []
+        for pp in preprocessors:
+            self.add(pp)
+
+    def add(self, preprocessor: T.Callable[[Plan], Plan]) -> None:
+        """Add the preprocessor after the ones already in the pipeline."""
+        if not hasattr(preprocessor, "add_hooks"):
+            self._layers.append(preprocessor)
+            return
+        self._table().new_stage()
+        preprocessor.add_hooks(self)
+        return
+
+    def add_hook(self, command: str, obj: T.Any, func: MsgProc) -> None:
+        """Add a hook of the current preprocessor.
+
+        A message is passed to the first hook of a preprocessor that matches it.
+
+        Parameters
+        ----------
+        command : str
+            The command of the messages to mutate.
+        obj : Any
+            The object of the messages to mutate, compared by identity. If None, the messages of any object.
+        func : Callable
+            The function of the message returning a pair of plans, like the function of a ``plan_mutator``.
+        """
+        self._table().add_hook(command, obj, func)
+        return
+
+    def _table(self) -> _HookTable:
+        if not (self._layers and isinstance(self._layers[-1], _HookTable)):
+            self._layers.append(_HookTable())
+        return self._layers[-1]
+
+    def __call__(self, plan: Plan) -> Plan:
+        for layer in self._layers:
+            plan = layer(plan)
+        return plan
+
+    def __repr__(self) -> str:
+        return "<{} of {} layers>".format(self.__class__.__name__, len(self._layers))
@@ -47,34 +47,42 @@ class ShutterPreprocessor:
     def __call__(self, plan: Plan) -> Plan:
         if self._disabled:
             return plan
-        shutter = self._shutter_config.shutter
-        open_state = self._shutter_config.open_state
-        close_state = self._shutter_config.close_state
-        delay = self._shutter_config.delay
-
-        def _open_shutter_before(msg: Msg) -> Plan:
-            yield from bps.mv(shutter, open_state)
-            if delay > 0.:
-                yield from bps.sleep(delay)
-            return (yield msg)
-
-        def _close_shutter() -> Plan:
-            yield from bps.mv(shutter, close_state)
+        return bpp.plan_mutator(plan, self._mutate)
+
+    def add_hooks(self, pipeline) -> None:
+        """Add the hooks of the shutter control to a `PreprocessorPipeline`."""
+        if self._disabled:
             return
+        pipeline.add_hook("trigger", self._detector, self._mutate)
+        pipeline.add_hook("wait", None, self._mutate)
+        return
+
+    def _open_shutter_before(self, msg: Msg) -> Plan:
+        yield from bps.mv(self._shutter_config.shutter, self._shutter_config.open_state)
+        if self._shutter_config.delay > 0.:
+            yield from bps.sleep(self._shutter_config.delay)
+        return (yield msg)
+
+    def _close_shutter(self) -> Plan:
+        yield from bps.mv(self._shutter_config.shutter, self._shutter_config.close_state)
+        return
 
-        def _mutate(msg: Msg):
-            # open the shutter before a non dark trigger
-            group = msg.kwargs.get("group")
-            not_dark = (group is not None) and (not group.startswith(self._dark_group_prefix))
-            if (msg.command == "trigger") and (msg.obj is self._detector) and not_dark:
-                # remember the group
-                self._group = group
-                return _open_shutter_before(msg), None
-            if (msg.command == "wait") and (msg.kwargs.get("group") == self._group):
-                return None, _close_shutter()
-            return None, None
-
-        return bpp.plan_mutator(plan, _mutate)
+    def _mutate(self, msg: Msg):
+        # open the shutter before a non dark trigger
+        group = msg.kwargs.get("group")
+        not_dark = (group is not None) and (not group.startswith(self._dark_group_prefix))
+        if (msg.command == "trigger") and (msg.obj is self._detector) and not_dark:
+            # remember the group
+            self._group = group
+            return self._open_shutter_before(msg), None
+        if (msg.command == "wait") and (msg.kwargs.get("group") == self._group):
+            return None, self._close_shutter()
+        return None, None
+
+    @property
+    def disabled(self) -> bool:
+        """Whether the shutter control is disabled."""
+        return self._disabled
 
     def disable(self) -> None:
         """Enable the shutter control.
@@ -0,0 +1,119 @@
+import functools
+import threading
+import typing as T
+
+import bluesky.plan_stubs as bps
+from bluesky import Msg
+from frozendict import frozendict
+from ophyd import Signal
+
+Plan = T.Generator[Msg, T.Any, T.Any]
+SignalList = T.Sequence[Signal]
+State = T.Mapping[str, T.Hashable]
+
+
+class StateCache:
+    """The values of the locked signals of the preprocessors kept up to date by subscriptions.
+
+    A signal is subscribed the first time that it is in a state. A subscribed signal is read by `bps.rd`
+    until it reports a value, once if it does not report its current value when subscribed. The state of
+    the signals is then kept until one of them reports a new value, so that it is read without any message.
+    The signals that do not support subscriptions are read every time.
+
+    The subscriptions are callbacks run in the threads of the control layer, so the values are guarded by a
+    lock. A cache is owned by a run engine, e.g. the `state_cache` of the `CustomizedRunEngine`, and it is
+    given to the preprocessors of the run engine. `clear` unsubscribes the signals when the run engine is
+    not used anymore.
+
+    Examples
+    --------
+    >>> cache = StateCache()
+    >>> state = yield from cache.read_state([det_z, det.cam.acquire_time])
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # id(signal) -> (signal, token), the token is None if the subscription failed
+        self._subscriptions = {}
+        # id(signal) -> the last value reported
+        self._values = {}
+        # bumped by each new value, the states older than it are computed again
+        self._version = 0
+        # tuple of the ids of the signals -> (version, state)
+        self._states = {}
+
+    def watch(self, signals: SignalList) -> None:
+        """Subscribe the signals that are not subscribed yet."""
+        for signal in signals:
+            key = id(signal)
+            with self._lock:
+                if key in self._subscriptions:
+                    continue
+                # reserved before the subscription, which may run the callback at once
+                self._subscriptions[key] = (signal, None)
+            try:
+                token = signal.subscribe(functools.partial(self._update, key), run=True)
+            except Exception:
+                # polled
+                token = None
+            with self._lock:
+                self._subscriptions[key] = (signal, token)
+        return
+
+    def _update(self, key: int, *args, value: T.Any = None, **kwargs) -> None:
+        with self._lock:
+            self._values[key] = value
+            self._version += 1
+        return
+
+    def read_state(self, signals: SignalList) -> Plan:
+        """Return the frozen mapping from the names of the signals to their values.
+
+        Only the signals without a value from a subscription are read by the plan.
+        """
+        key = tuple(map(id, signals))
+        with self._lock:
+            version = self._version
+            cached = self._states.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        self.watch(signals)
+        items = []
+        polled = False
+        for signal in signals:
+            with self._lock:
+                found = id(signal) in self._values
+                value = self._values.get(id(signal))
+            if found:
+                items.append((signal.name, value))
+                continue
+            # the lock is not held by a plan
+            value = (yield from bps.rd(signal))
+            with self._lock:
+                if self._subscriptions[id(signal)][1] is None:
+                    polled = True
+                else:
+                    # the values reported since the read are newer
+                    value = self._values.setdefault(id(signal), value)
+            items.append((signal.name, value))
+        state = frozendict(items)
+        if not polled:
+            with self._lock:
+                self._states[key] = (version, state)
+        return state
+
+    def clear(self) -> None:
+        """Unsubscribe all the signals and forget their values."""
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+            self._subscriptions.clear()
+            self._values.clear()
+            self._states.clear()
+            self._version += 1
+        for signal, token in subscriptions:
+            if token is not None:
+                signal.unsubscribe(token)
+        return
+
+    def __repr__(self) -> str:
+        return "<{} of {} signals>".format(self.__class__.__name__, len(self._subscriptions))
@@ -0,0 +1,118 @@
+"""The queue of the samples and plans drained by CustomizedRunEngine."""
+import os
+import typing as T
+
+from . import serializer
+from .yamllist import JournaledYamlList
+
+# the name of the file of the queue in glbl['config_base']
+QUEUE_FILE = ".xrun_queue.yml"
+# the status of an item before it is finished
+PENDING = "pending"
+RUNNING = "running"
+PAUSED = "paused"
+# the status of a finished item, the exit status of a run
+SUCCESS = "success"
+FAIL = "fail"
+ABORT = "abort"
+_UNFINISHED = frozenset((PENDING, RUNNING, PAUSED))
+
+
+class RunQueue:
+    """A queue of the samples and plans journaled on the disk.
+
+    Each item is a dict of the `sample` and the `plan`, as the name or the
+    dict of the sample and the name of the ScanPlan, the `md` of the run,
+    the `status` and the `uids` of the runs started for it. The changes of
+    the items are appended to the journal of a `JournaledYamlList`, so that
+    the queue is the same after a crash and the items left 'running' are
+    run again.
+
+    Parameters
+    ----------
+    fname : str
+        The path to the file of the queue. It is created if it does not exist.
+    """
+
+    def __init__(self, fname: str) -> None:
+        self.fname = fname
+        codec = serializer.get_machine_codec()
+        items = None if os.path.isfile(fname) else []
+        self._items = JournaledYamlList(fname, items, codec=codec)
+
+    def put(self, sample: T.Union[str, dict], plan: str, md: T.Optional[dict] = None) -> int:
+        """Add an item at the end of the queue and return its index."""
+        self._items.append(
+            {"sample": sample, "plan": plan, "md": dict(md or {}), "status": PENDING, "uids": []}
+        )
+        return len(self._items) - 1
+
+    def next_index(self) -> T.Optional[int]:
+        """Return the index of the first unfinished item, None if all the items are finished."""
+        for index, item in enumerate(self._items):
+            if item["status"] in _UNFINISHED:
+                return index
+        return None
+
+    def _update(self, index: int, **fields) -> None:
+        # the item is replaced so that the change is journaled
+        self._items[index] = dict(self._items[index], **fields)
+        return
+
+    def set_status(self, index: int, status: str, reason: str = None) -> None:
+        """Set the status of an item and the reason of a failure."""
+        if reason is None:
+            self._update(index, status=status)
+        else:
+            self._update(index, status=status, reason=reason)
+        return
+
+    def add_uid(self, index: int, uid: str) -> None:
+        """Record the uid of a run started for an item."""
+        self._update(index, uids=self._items[index]["uids"] + [uid])
+        return
+
+    def retry(self, index: int) -> None:
+        """Run a finished item again when the queue is drained, keeping the uids of its runs."""
+        item = dict(self._items[index], status=PENDING)
+        item.pop("reason", None)
+        self._items[index] = item
+        return
+
+    def clear(self) -> None:
+        """Remove all the items."""
+        self._items.clear()
+        return
+
+    def __getitem__(self, index: int) -> dict:
+        return dict(self._items[index])
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> T.Iterator[dict]:
+        return (dict(item) for item in self._items)
+
+    def __str__(self) -> str:
+        lines = []
+        for index, item in enumerate(self._items):
+            sample = item["sample"]
+            if isinstance(sample, dict):
+                sample = sample.get("sample_name", "")
+            lines.append("{} {:<8} {} {} {}".format(index, item["status"], sample, item["plan"], item["uids"]))
+        return "\n".join(lines)
+
+
+class QueueRecorder:
+    """The callback recording the runs of an item of a `RunQueue`."""
+
+    def __init__(self, queue: RunQueue, index: int) -> None:
+        self.queue = queue
+        self.index = index
+
+    def __call__(self, name: str, doc: dict) -> None:
+        if name == "start":
+            self.queue.add_uid(self.index, doc["uid"])
+        elif name == "stop" and doc.get("exit_status", SUCCESS) != SUCCESS:
+            self.queue.set_status(self.index, doc["exit_status"], doc.get("reason"))
+        return
@@ -0,0 +1,138 @@
+"""Serialization of the YAML-backed objects and the files of xpdacq.
+
+The yaml goes through the libyaml bindings (CLoader and CDumper) when
+PyYAML is built with them and through the pure python classes otherwise.
+The files only read by xpdacq, like the order files and the glbl cache,
+can be encoded in json or msgpack instead, see `set_machine_codec`.
+The json and msgpack are preceded by a marker, see `MARKERS`, so that
+`load` tells them apart from the yaml without guessing from the data.
+"""
+import json
+import typing as T
+
+import yaml
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+Loader = getattr(yaml, "CUnsafeLoader", yaml.UnsafeLoader)
+Dumper = getattr(yaml, "CDumper", yaml.Dumper)
+# whether the libyaml bindings are used
+LIBYAML = Loader is not yaml.UnsafeLoader
+
+CODECS = ("yaml", "json", "msgpack")
+# the json marker is a yaml comment and the msgpack one is never used by
+# msgpack nor the first byte of a utf-8 text
+MARKERS = {"json": "#json\n", "msgpack": b"\xc1"}
+_machine_codec = {"codec": "yaml"}
+
+
+def dump(data, stream=None, **kwargs):
+    """Same as yaml.dump with the fastest Dumper."""
+    return yaml.dump(data, stream, Dumper=Dumper, **kwargs)
+
+
+def load(stream):
+    """Load the data from a string, bytes or a file encoded by `dump` or `encode`.
+
+    The data is yaml unless it starts with one of the `MARKERS`.
+    """
+    if hasattr(stream, "read"):
+        stream = stream.read()
+    if isinstance(stream, bytes):
+        if stream.startswith(MARKERS["msgpack"]):
+            return decode(stream, "msgpack")
+        stream = stream.decode("utf-8")
+    if stream.startswith(MARKERS["json"]):
+        return decode(stream, "json")
+    return yaml.load(stream, Loader=Loader)
+
+
+def load_file(filepath: str):
+    """Load the data in a file encoded by `dump` or `encode`."""
+    with open(filepath, "rb") as f:
+        return load(f)
+
+
+def _check_codec(codec: str) -> None:
+    if codec not in CODECS:
+        raise ValueError(
+            "Unknown codec '{}'. Please choose from {}.".format(codec, CODECS)
+        )
+    if codec == "msgpack" and msgpack is None:
+        raise ValueError("msgpack is not installed.")
+
+
+def encode_as(data, codec: str = "yaml", **kwargs) -> T.Tuple[str, T.Union[str, bytes]]:
+    """Encode the data and return the codec used with the encoded data.
+
+    json and msgpack are only used when they give back the same data, e.g.
+    a tuple or a dict with int keys is encoded in yaml. They are preceded
+    by their marker in `MARKERS`.
+
+    Parameters
+    ----------
+    data :
+        data to encode.
+    codec : str, optional
+        one of 'yaml', 'json' and 'msgpack'. Default to 'yaml'.
+    kwargs :
+        keyword arguments of `dump` for the yaml.
+    """
+    _check_codec(codec)
+    if codec == "json":
+        try:
+            encoded = json.dumps(data)
+            if json.loads(encoded) == data:
+                return "json", MARKERS["json"] + encoded
+        except (TypeError, ValueError):
+            pass
+    elif codec == "msgpack":
+        try:
+            encoded = msgpack.packb(data, use_bin_type=True)
+            if msgpack.unpackb(encoded, raw=False, strict_map_key=False) == data:
+                return "msgpack", MARKERS["msgpack"] + encoded
+        except (TypeError, ValueError):
+            pass
+    return "yaml", dump(data, **kwargs)
+
+
+def encode(data, codec: str = "yaml", **kwargs) -> T.Union[str, bytes]:
+    """Encode the data, see `encode_as`."""
+    return encode_as(data, codec, **kwargs)[1]
+
+
+def decode(encoded: T.Union[str, bytes], codec: str = "yaml"):
+    """Decode the data encoded in the codec returned by `encode_as`."""
+    _check_codec(codec)
+    if codec != "yaml" and encoded.startswith(MARKERS[codec]):
+        encoded = encoded[len(MARKERS[codec]):]
+    if codec == "json":
+        return json.loads(encoded)
+    if codec == "msgpack":
+        return msgpack.unpackb(encoded, raw=False, strict_map_key=False)
+    return yaml.load(encoded, Loader=Loader)
+
+
+def set_machine_codec(codec: str) -> None:
+    """Set the codec of the files only read by xpdacq.
+
+    Parameters
+    ----------
+    codec : str
+        one of 'yaml', 'json' and 'msgpack'.
+    """
+    _check_codec(codec)
+    _machine_codec["codec"] = codec
+
+
+def get_machine_codec() -> str:
+    """Return the codec of the files only read by xpdacq."""
+    return _machine_codec["codec"]
+
+
+def encode_machine(data) -> T.Union[str, bytes]:
+    """Encode the data of a file only read by xpdacq."""
+    return encode(data, _machine_codec["codec"], default_flow_style=False)
@@ -0,0 +1,331 @@
+"""A SQLite file replacing the yaml files of a Beamtime, its Samples and ScanPlans."""
+import contextlib
+import os
+import sqlite3
+import typing as T
+
+from . import serializer
+from .beamtime import Beamtime, Sample, ScanPlan, _link_map
+from .tools import atomic_write
+from .xpdacq_conf import glbl_dict
+from .yamldict import suspend_flush
+from .yamllist import JournaledYamlList
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS beamtime (
+    uid TEXT PRIMARY KEY,
+    format TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sample (
+    uid TEXT PRIMARY KEY,
+    bt_uid TEXT NOT NULL,
+    name TEXT,
+    position INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sample_name ON sample (bt_uid, name);
+CREATE INDEX IF NOT EXISTS sample_position ON sample (bt_uid, position);
+CREATE TABLE IF NOT EXISTS scanplan (
+    uid TEXT PRIMARY KEY,
+    bt_uid TEXT NOT NULL,
+    name TEXT,
+    position INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scanplan_name ON scanplan (bt_uid, name);
+CREATE INDEX IF NOT EXISTS scanplan_position ON scanplan (bt_uid, position);
+"""
+
+
+def _encode(data) -> T.Tuple[str, str]:
+    """Return the format and the encoded data, json if it gives back the same data, otherwise yaml."""
+    return serializer.encode_as(data, "json", default_flow_style=False)
+
+
+def _decode(fmt: str, encoded: str):
+    return serializer.decode(encoded, fmt)
+
+
+def _linked_data(obj) -> list:
+    return [dict(obj.maps[0]), _link_map(obj.maps[1]["bt_uid"])]
+
+
+class SqliteStore:
+    """Keep a Beamtime, its Samples and ScanPlans in a single SQLite file.
+
+    Each object is stored as the data that it would write to its own file,
+    encoded in json when possible for a fast loading, otherwise in yaml.
+    The Samples and ScanPlans are indexed by uid, name and the order of
+    registration, which replaces the '.sample_order.yml' and
+    '.scanplan_order.yml' files. The database is in the WAL mode.
+
+    Parameters
+    ----------
+    filepath : str
+        path to the SQLite file. It is created if it does not exist.
+
+    Examples
+    --------
+    Move the current beamtime from the yaml files to the store.
+    >>> store = SqliteStore("beamtime.sqlite")
+    >>> bt = store.import_yaml()
+
+    Load it in a new session.
+    >>> bt = SqliteStore("beamtime.sqlite").load_beamtime()
+
+    Group many changes into one transaction.
+    >>> with bt.store.batch():
+    ...     for sample_md in sample_mds:
+    ...         Sample(bt, sample_md)
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._conn = sqlite3.connect(filepath, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta VALUES ('schema_version', ?)",
+            (str(SCHEMA_VERSION),)
+        )
+        self._batch_depth = 0
+
+    def close(self) -> None:
+        """Close the connection to the database."""
+        self._conn.close()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Group the writes inside the block into one transaction.
+
+        The transaction is rolled back if an exception is raised in the
+        block. The blocks can be nested, only the outermost one commits.
+        """
+        if self._batch_depth:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+            return
+        self._batch_depth += 1
+        self._conn.execute("BEGIN")
+        try:
+            yield self
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        else:
+            self._conn.execute("COMMIT")
+        finally:
+            self._batch_depth -= 1
+
+    def save_beamtime(self, bt: Beamtime) -> None:
+        """Write the Beamtime to the store."""
+        if "bt_uid" not in bt:
+            # still in __init__
+            return
+        fmt, encoded = _encode(dict(bt))
+        self._conn.execute(
+            "INSERT OR REPLACE INTO beamtime (uid, format, data) VALUES (?, ?, ?)",
+            (bt["bt_uid"], fmt, encoded)
+        )
+
+    def save_sample(self, sample: Sample) -> None:
+        """Write the Sample to the store. It replaces a Sample with the same name."""
+        if "sa_uid" not in sample:
+            # still in __init__
+            return
+        fmt, encoded = _encode(_linked_data(sample))
+        self._save("sample", sample["sa_uid"], sample["bt_uid"], sample.get("sample_name"), fmt, encoded)
+
+    def save_scanplan(self, scanplan: ScanPlan) -> None:
+        """Write the ScanPlan to the store. It replaces a ScanPlan with the same name."""
+        if "sp_uid" not in scanplan:
+            # still in __init__
+            return
+        fmt, encoded = _encode(_linked_data(scanplan))
+        self._save("scanplan", scanplan["sp_uid"], scanplan["bt_uid"], scanplan.short_summary(), fmt, encoded)
+
+    def _save(self, table: str, uid: str, bt_uid: str, name: str, fmt: str, encoded: str) -> None:
+        with self.batch():
+            # same as the file of the same name being overwritten
+            row = self._conn.execute(
+                "SELECT MIN(position) FROM {} WHERE bt_uid = ? AND (uid = ? OR name = ?)".format(table),
+                (bt_uid, uid, name)
+            ).fetchone()
+            position = row[0]
+            if position is None:
+                position = self._conn.execute(
+                    "SELECT COALESCE(MAX(position) + 1, 0) FROM {} WHERE bt_uid = ?".format(table),
+                    (bt_uid,)
+                ).fetchone()[0]
+            self._conn.execute(
+                "DELETE FROM {} WHERE bt_uid = ? AND name = ? AND uid != ?".format(table),
+                (bt_uid, name, uid)
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO {} (uid, bt_uid, name, position, format, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)".format(table),
+                (uid, bt_uid, name, position, fmt, encoded)
+            )
+
+    def beamtime_uids(self) -> T.List[str]:
+        """The uids of the Beamtimes in the store, the most recent last."""
+        return [row[0] for row in self._conn.execute("SELECT uid FROM beamtime ORDER BY rowid")]
+
+    def get_sample(self, *, uid: str = None, name: str = None, position: int = None,
+                   bt_uid: str = None) -> T.Union[list, None]:
+        """Return the data of a Sample found by uid, name or position, or None.
+
+        The data is the same as in the yaml file of the Sample, its metadata
+        and the link map of its Beamtime.
+        """
+        return self._get("sample", uid, name, position, bt_uid)
+
+    def get_scanplan(self, *, uid: str = None, name: str = None, position: int = None,
+                     bt_uid: str = None) -> T.Union[list, None]:
+        """Return the data of a ScanPlan found by uid, name or position, or None.
+
+        The data is the same as in the yaml file of the ScanPlan, its
+        arguments and the link map of its Beamtime.
+        """
+        return self._get("scanplan", uid, name, position, bt_uid)
+
+    def _get(self, table: str, uid: str, name: str, position: int, bt_uid: str) -> T.Union[list, None]:
+        if uid is not None:
+            row = self._conn.execute("SELECT format, data FROM {} WHERE uid = ?".format(table), (uid,)).fetchone()
+        else:
+            bt_uid = self._default_bt_uid(bt_uid)
+            if name is not None:
+                row = self._conn.execute(
+                    "SELECT format, data FROM {} WHERE bt_uid = ? AND name = ?".format(table), (bt_uid, name)
+                ).fetchone()
+            elif position is not None:
+                row = self._conn.execute(
+                    "SELECT format, data FROM {} WHERE bt_uid = ? ORDER BY position LIMIT 1 OFFSET ?".format(table),
+                    (bt_uid, position)
+                ).fetchone()
+            else:
+                raise ValueError("Please give the uid, name or position.")
+        if row is None:
+            return None
+        return _decode(*row)
+
+    def _default_bt_uid(self, bt_uid: str = None) -> str:
+        if bt_uid is not None:
+            return bt_uid
+        uids = self.beamtime_uids()
+        if not uids:
+            raise ValueError("There is no Beamtime in {}.".format(self.filepath))
+        return uids[-1]
+
+    def _beamtime_data(self, bt_uid: str) -> dict:
+        row = self._conn.execute("SELECT format, data FROM beamtime WHERE uid = ?", (bt_uid,)).fetchone()
+        if row is None:
+            raise ValueError("There is no Beamtime with bt_uid={} in {}.".format(bt_uid, self.filepath))
+        return _decode(*row)
+
+    def _rows(self, table: str, bt_uid: str) -> T.Iterator[T.Tuple[str, list]]:
+        """Yield the name and the data of the Samples or ScanPlans in order."""
+        rows = self._conn.execute(
+            "SELECT name, format, data FROM {} WHERE bt_uid = ? ORDER BY position".format(table), (bt_uid,)
+        ).fetchall()
+        for name, fmt, encoded in rows:
+            yield name, _decode(fmt, encoded)
+
+    def load_beamtime(self, bt_uid: str = None) -> Beamtime:
+        """Rebuild a Beamtime with its Samples and ScanPlans from the store.
+
+        Parameters
+        ----------
+        bt_uid : str, optional
+            uid of the Beamtime. Default to the most recent one.
+
+        Returns
+        -------
+        bt : Beamtime
+            the Beamtime. Its changes and the changes of its Samples and
+            ScanPlans are written to the store.
+        """
+        bt_uid = self._default_bt_uid(bt_uid)
+        bt_data = self._beamtime_data(bt_uid)
+        # the objects are in sync with the store
+        with suspend_flush():
+            bt = Beamtime.from_dict(bt_data)
+            bt.store = self
+            for _, (map1, map2) in self._rows("scanplan", bt_uid):
+                ScanPlan.from_dicts(map1, map2, beamtime=bt)
+            for _, (map1, map2) in self._rows("sample", bt_uid):
+                Sample.from_dicts(map1, map2, beamtime=bt)
+        return bt
+
+    def attach(self, bt: Beamtime) -> Beamtime:
+        """Write the Beamtime, its Samples and ScanPlans to the store and keep them there."""
+        with self.batch():
+            bt.store = self
+            self.save_beamtime(bt)
+            for scanplan in bt.scanplans.values():
+                self.save_scanplan(scanplan)
+            for sample in bt.samples.values():
+                self.save_sample(sample)
+        return bt
+
+    def import_yaml(self, directory: str = None) -> Beamtime:
+        """Load the Beamtime in the yaml directory and attach it to the store.
+
+        Parameters
+        ----------
+        directory : str, optional
+            directory of the yaml files. Default to glbl['yaml_dir'].
+
+        Returns
+        -------
+        bt : Beamtime
+            the Beamtime attached to the store.
+        """
+        from .beamtimeSetup import load_beamtime
+
+        return self.attach(load_beamtime(directory))
+
+    def export_yaml(self, directory: str = None, bt_uid: str = None) -> None:
+        """Write the Beamtime of the store to the yaml files read by `load_beamtime`.
+
+        Parameters
+        ----------
+        directory : str, optional
+            directory of the yaml files. Default to glbl['yaml_dir']. The
+            order files are written to glbl['config_base'].
+        bt_uid : str, optional
+            uid of the Beamtime. Default to the most recent one.
+        """
+        if directory is None:
+            directory = glbl_dict["yaml_dir"]
+        bt_uid = self._default_bt_uid(bt_uid)
+        os.makedirs(directory, exist_ok=True)
+        atomic_write(
+            os.path.join(directory, "bt_bt.yml"),
+            serializer.dump(self._beamtime_data(bt_uid), default_flow_style=False)
+        )
+        for table in ("scanplan", "sample"):
+            sub_dir = os.path.join(directory, table + "s")
+            os.makedirs(sub_dir, exist_ok=True)
+            order = []
+            for name, data in self._rows(table, bt_uid):
+                atomic_write(
+                    os.path.join(sub_dir, "{}.yml".format(name)),
+                    serializer.dump(data, default_flow_style=False)
+                )
+                order.append(name + ".yml")
+            JournaledYamlList(
+                os.path.join(glbl_dict["config_base"], ".{}_order.yml".format(table)),
+                order,
+                codec=serializer.get_machine_codec()
+            ).close()
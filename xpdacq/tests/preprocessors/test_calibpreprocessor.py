@@ -1,3 +1,5 @@
+import shutil
+
 import bluesky.plan_stubs as bps
 import bluesky.plans as bp
 import bluesky.preprocessors as bpp
@@ -6,8 +8,14 @@ from databroker.v2 import temp
 from frozendict import frozendict
 from ophyd.sim import hw
 from pkg_resources import resource_filename
+import pytest
 from xarray import Dataset
-from xpdacq.preprocessors.calibpreprocessor import CalibInfo, CalibPreprocessor
+from xpdacq.ipysetup import CALIB_CACHE_FILE, _add_a_calib_preprocessor, _set_calib_preprocessor
+from xpdacq.preprocessors import PreprocessorPipeline
+from xpdacq.preprocessors.calibpreprocessor import (CalibInfo,
+                                                    CalibPreprocessor,
+                                                    CalibPreprocessorError)
+from xpdacq.xpdacq import CustomizedRunEngine
 
 PONI_FILE = str(resource_filename("xpdacq", "tests/Ni_poni_file.poni"))
 
@@ -112,3 +120,144 @@ def test_repr():
     det = devices.det
     cp = CalibPreprocessor(det)
     assert cp.__repr__() == "<CalibPreprocessor of det with 0 cache>"
+
+
+def test_on_change():
+    devices = hw()
+    det = devices.det
+    det_z = devices.motor
+    calib_result1 = (1.0, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0, "Perkin detector")
+    calib_result2 = (1.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, "Perkin detector")
+    db = temp()
+    RE = RunEngine()
+    RE.subscribe(db.v1.insert)
+
+    @bpp.run_decorator()
+    def plan():
+        for pos in (1.0, 1.0, 2.0, 2.0):
+            yield from bps.mv(det_z, pos)
+            for _ in range(3):
+                yield from bps.trigger_and_read([det])
+
+    for wrap in ("call", "pipeline"):
+        cp = CalibPreprocessor(det, locked_signals=[det_z], on_change=True)
+        cp.add_calib_result({det_z.name: 1.0}, calib_result1)
+        cp.add_calib_result({det_z.name: 2.0}, calib_result2)
+        pp = cp if wrap == "call" else PreprocessorPipeline([cp])
+        # a new event in each run
+        for _ in range(2):
+            RE(pp(plan()))
+            assert len(db[-1].primary.read()["time"]) == 12
+            calib_data = db[-1].calib.read()
+            assert list(calib_data["{}_dist".format(det.name)].values) == [1.0, 2.0]
+    # the triggers are not mutated while the calibration is the same
+    cp = CalibPreprocessor(det, on_change=True)
+    cp.add_calib_result(dict(), calib_result1)
+    n_steps = [len(list(cp(bps.trigger_and_read([det])))) for _ in range(2)]
+    assert n_steps[1] == len(list(bps.trigger_and_read([det])))
+    assert n_steps[0] > n_steps[1]
+
+
+def test_tolerances_and_interpolate():
+    devices = hw()
+    det = devices.det
+    det_z = devices.motor
+    calib_result1 = (1.0, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0, "Perkin detector")
+    calib_result2 = (1.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, "Perkin detector")
+    db = temp()
+    RE = RunEngine()
+    RE.subscribe(db.v1.insert)
+    with pytest.raises(CalibPreprocessorError):
+        CalibPreprocessor(det, locked_signals=[det_z], interpolate=True)
+    cp = CalibPreprocessor(det, locked_signals=[det_z], tolerances={det_z.name: 0.01}, interpolate=True)
+    cp.add_calib_result({det_z.name: 1.0}, calib_result1)
+    cp.add_calib_result({det_z.name: 2.0}, calib_result2)
+    RE(cp(bp.scan([det], det_z, 0.5, 2.0, 4)))
+    calib_data = db[-1].calib.read()
+    # the first one is out of the range and the latest is used
+    assert list(calib_data["{}_dist".format(det.name)].values) == pytest.approx([2.0, 1.0, 1.5, 2.0])
+    # the index is updated with the cache
+    cp.add_calib_result({det_z.name: 1.5}, calib_result1)
+    RE(cp(bp.scan([det], det_z, 1.0, 2.0, 3)))
+    calib_data = db[-1].calib.read()
+    assert list(calib_data["{}_dist".format(det.name)].values) == pytest.approx([1.0, 1.0, 2.0])
+
+
+def test_cache_file_and_max_size(tmp_path):
+    devices = hw()
+    det = devices.det
+    det_z = devices.motor
+    cache_file = tmp_path.joinpath("calib_cache.yml")
+    calib_results = [(1.0, float(i), 0.0, 0.0, 0.0, 0.0, 0.0, "Perkin detector") for i in range(4)]
+    cp = CalibPreprocessor(det, locked_signals=[det_z], cache_file=cache_file, max_size=3)
+    for i in range(3):
+        cp.add_calib_result({det_z.name: float(i)}, calib_results[i])
+    # the least recently used is the second one
+    assert cp._get_calib(frozendict({det_z.name: 0.0})) == calib_results[0]
+    cp.add_calib_result({det_z.name: 3.0}, calib_results[3])
+    assert list(cp._cache.values()) == [calib_results[2], calib_results[0], calib_results[3]]
+    # loaded in a new session when used
+    cp2 = CalibPreprocessor(det, locked_signals=[det_z], cache_file=cache_file, max_size=2)
+    assert not cp2._cache
+    assert repr(cp2) == "<CalibPreprocessor of det with 2 cache>"
+    assert cp2._cache == {frozendict({det_z.name: 0.0}): calib_results[0],
+                          frozendict({det_z.name: 3.0}): calib_results[3]}
+    # the latest one is the most recently used
+    assert cp2._get_calib(frozendict({det_z.name: 5.0})) == calib_results[3]
+    cp2.clear()
+    assert repr(CalibPreprocessor(det, cache_file=cache_file)) == "<CalibPreprocessor of det with 0 cache>"
+
+
+def test_ipysetup_tolerance(tmp_path):
+    devices = hw()
+    det = devices.det
+    det_z = devices.motor
+    calib_results = [(1.0, float(i), 0.0, 0.0, 0.0, 0.0, 0.0, "Perkin detector") for i in range(2)]
+    xrun = CustomizedRunEngine(None)
+    _add_a_calib_preprocessor(xrun, det, det_z, str(tmp_path), 32, 0.01)
+    cp = xrun.calib_preprocessors[0]
+    cp.add_calib_result({det_z.name: 100.0}, calib_results[0])
+    cp.add_calib_result({det_z.name: 200.0}, calib_results[1])
+    assert tmp_path.joinpath(CALIB_CACHE_FILE.format(det.name)).is_file()
+    # the cache of the last session is loaded with the tolerance of the glbl
+    xrun2 = CustomizedRunEngine(None)
+    _add_a_calib_preprocessor(xrun2, det, det_z, str(tmp_path), 32, 0.01)
+    cp2 = xrun2.calib_preprocessors[0]
+    # out of the tolerance, the latest one
+    assert cp2._get_calib(frozendict({det_z.name: 100.5})) == calib_results[1]
+    assert cp2._get_calib(frozendict({det_z.name: 100.005})) == calib_results[0]
+
+
+def test_ipysetup_does_not_touch_cache_file(tmp_path):
+    devices = hw()
+    det = devices.det
+    det_z = devices.motor
+    calib_results = [(1.0, float(i), 0.0, 0.0, 0.0, 0.0, 0.0, "Perkin detector") for i in range(3)]
+    xrun = CustomizedRunEngine(None)
+    _add_a_calib_preprocessor(xrun, det, det_z, str(tmp_path), 2)
+    cp = xrun.calib_preprocessors[0]
+    for i in range(2):
+        cp.add_calib_result({det_z.name: float(i + 10)}, calib_results[i])
+    cache_file = tmp_path.joinpath(CALIB_CACHE_FILE.format(det.name))
+    stat = cache_file.stat()
+    content = cache_file.read_bytes()
+    # the setup of a new session with the poni file of the calibration at the current position
+    glbl = {"config_base": str(tmp_path), "calib_config_name": "Ni_poni_file.poni"}
+    shutil.copy(PONI_FILE, str(tmp_path))
+    xrun2 = CustomizedRunEngine(None)
+    _add_a_calib_preprocessor(xrun2, det, det_z, str(tmp_path), 2)
+    cp2 = xrun2.calib_preprocessors[0]
+    _set_calib_preprocessor(cp2, glbl, det_z)
+    PreprocessorPipeline([cp2])(bp.count([det]))
+    assert cache_file.stat().st_mtime_ns == stat.st_mtime_ns
+    assert cache_file.read_bytes() == content
+    # the poni is used at its position and as the latest, the file is loaded at the first lookup
+    poni_result = cp2.read(PONI_FILE)
+    assert cp2._get_calib(frozendict({det_z.name: det_z.get()})) == poni_result
+    assert cp2._get_calib(frozendict({det_z.name: 5.0})) == poni_result
+    assert cp2._get_calib(frozendict({det_z.name: 10.0})) == calib_results[0]
+    # the poni does not evict the calibrations of the last sessions
+    assert len(cp2._cache) == 2
+    cp2.add_calib_result({det_z.name: 12.0}, calib_results[2])
+    assert cp2._get_calib(frozendict({det_z.name: 5.0})) == calib_results[2]
+    assert cp2._get_calib(frozendict({det_z.name: det_z.get()})) == poni_result
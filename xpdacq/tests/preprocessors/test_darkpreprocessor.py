@@ -1,9 +1,11 @@
+import bluesky.plan_stubs as bps
 import bluesky.plans as bp
 import numpy as np
 from bluesky import RunEngine
+from bluesky_darkframes import DarkFramePreprocessor
 from bluesky_darkframes.sim import DiffractionDetector, Shutter
 from databroker.v2 import temp
-from xpdacq.preprocessors import DarkPreprocessor, ShutterConfig
+from xpdacq.preprocessors import DarkPreprocessor, ShutterConfig, StateCache
 
 
 def test_in_a_run():
@@ -25,3 +27,48 @@ def test_in_a_run():
     light_image = light_data["detector_image"].data[0]
     dark_image = dark_data["detector_image"].data[0]
     assert np.sum(light_image - dark_image) > 0.0
+
+
+def _locked_signal_plan(detector):
+    for exposure, num in [(1, 1), (1, 1), (2, 2), (1, 1)]:
+        yield from bps.mv(detector.exposure_time, exposure)
+        yield from bp.count([detector], num)
+
+
+def test_same_as_bluesky_darkframes():
+    # the dark frames are inserted like the plan mutator of the installed bluesky-darkframes
+    shutter = Shutter(name="shutter", value="open")
+    results = []
+    for use_upstream in (False, True):
+        detector = DiffractionDetector(name="detector")
+        dp = DarkPreprocessor(
+            detector=detector,
+            max_age=100.,
+            locked_signals=[detector.exposure_time],
+            shutter_config=ShutterConfig(shutter, "open", "closed"),
+            state_cache=StateCache()
+        )
+        if use_upstream:
+            dp = DarkFramePreprocessor(
+                dark_plan=dp._take_dark_frame.func,
+                detector=detector,
+                max_age=100.,
+                locked_signals=[detector.exposure_time]
+            )
+        RE = RunEngine()
+        msgs = []
+        RE.msg_hook = msgs.append
+        descriptors = {}
+        RE.subscribe(lambda name, doc: descriptors.update({doc["uid"]: doc["name"]}), "descriptor")
+        dark_events = []
+        RE.subscribe(lambda name, doc: dark_events.append(descriptors[doc["descriptor"]]), "event")
+        RE(dp(_locked_signal_plan(detector)))
+        # the reads of the locked signals are done by the StateCache only if needed
+        commands = [
+            (msg.command, getattr(msg.obj, "name", None)) for msg in msgs
+            if not (msg.command == "read" and msg.obj is detector.exposure_time)
+        ]
+        results.append((commands, dark_events.count("dark"), len(dp.cache)))
+    assert results[0] == results[1]
+    # a dark event per run and a dark frame per exposure time
+    assert results[0][1:] == (4, 2)
@@ -0,0 +1,44 @@
+import pytest
+from frozendict import frozendict
+from xpdacq.preprocessors import GeometryIndex
+
+CALIB1 = (1.0, 100.0, 10.0, 20.0, 0.1, 0.2, 0.3, "Perkin detector")
+CALIB2 = (1.0, 200.0, 30.0, 40.0, 0.4, 0.5, 0.6, "Perkin detector")
+CALIB3 = (1.0, 150.0, 20.0, 30.0, 0.7, 0.8, 0.9, "Perkin detector")
+
+
+def test_nearest():
+    index = GeometryIndex({"det_z": 0.01, "det_x": 0.5})
+    index.update(
+        {
+            frozendict(det_z=100., det_x=0., filter="A"): CALIB1,
+            frozendict(det_z=200., det_x=0., filter="A"): CALIB2,
+            frozendict(det_z=100., det_x=0., filter="B"): CALIB3,
+        }
+    )
+    assert index.lookup({"det_z": 100.0001, "det_x": 0.4, "filter": "A"}) == CALIB1
+    assert index.lookup({"det_z": 99.995, "det_x": -0.1, "filter": "B"}) == CALIB3
+    assert index.lookup({"det_z": 199.99, "det_x": 0., "filter": "A"}) == CALIB2
+    # out of the tolerances
+    assert index.lookup({"det_z": 100.02, "det_x": 0., "filter": "A"}) is None
+    assert index.lookup({"det_z": 100., "det_x": 0.6, "filter": "A"}) is None
+    # the signals without tolerances are matched exactly
+    assert index.lookup({"det_z": 100., "det_x": 0., "filter": "C"}) is None
+    assert index.lookup({"det_z": 100., "det_x": 0.}) is None
+    assert index.lookup({"det_z": 150., "det_x": 0., "filter": "A"}) is None
+    with pytest.raises(ValueError):
+        GeometryIndex({"det_z": 0.})
+
+
+def test_interpolate():
+    index = GeometryIndex({"det_z": 0.01, "det_x": 0.5}, interpolate=True)
+    index.update({frozendict(det_z=100., det_x=0.): CALIB1, frozendict(det_z=200., det_x=0.): CALIB2})
+    calib_result = index.lookup({"det_z": 125., "det_x": 0.2})
+    assert calib_result[1:4] == pytest.approx((125., 15., 25.))
+    # the other fields of the nearest
+    assert calib_result[4:] == CALIB1[4:]
+    assert index.lookup({"det_z": 175., "det_x": 0.})[4:] == CALIB2[4:]
+    assert index.lookup({"det_z": 100.001, "det_x": 0.}) == CALIB1
+    # no extrapolation
+    assert index.lookup({"det_z": 250., "det_x": 0.}) is None
+    assert index.lookup({"det_z": 150., "det_x": 1.}) is None
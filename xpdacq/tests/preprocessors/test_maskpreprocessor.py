@@ -0,0 +1,59 @@
+import bluesky.plans as bp
+import numpy as np
+from bluesky import RunEngine
+from databroker.v2 import temp
+import pytest
+from ophyd.sim import hw
+from xpdacq.preprocessors import MaskAsset, MaskPreprocessor
+from xpdacq.preprocessors.maskpreprocessor import MaskPreprocessorError
+
+
+def test_mask_files(tmp_path):
+    det = hw().det
+    db = temp()
+    RE = RunEngine()
+    RE.subscribe(db.v1.insert)
+    docs = []
+    RE.subscribe(lambda name, doc: docs.append((name, doc)))
+    mpp = MaskPreprocessor(det, mask_dir=str(tmp_path))
+    # no mask, no stream
+    RE(mpp(bp.count([det])))
+    assert "mask" not in list(db[-1])
+    mask = np.arange(12).reshape(3, 4)
+    mpp.set_mask(mask)
+    del docs[:]
+    for _ in range(2):
+        RE(mpp(bp.count([det])))
+        assert np.array_equal(db[-1].mask.read()["det_mask"].data[0], mask)
+    # one file and a resource in each run
+    assert len(list(tmp_path.iterdir())) == 1
+    resources = [doc for name, doc in docs if name == "resource"]
+    assert len(resources) == 2
+    assert resources[0]["resource_path"] == resources[1]["resource_path"]
+    assert resources[0]["uid"] != resources[1]["uid"]
+    events = [doc for name, doc in docs if name == "event" and "det_mask" in doc["data"]]
+    assert [event["data"]["det_mask"] for event in events] == [
+        "{}/0".format(resource["uid"]) for resource in resources
+    ]
+    # the same content is the same file
+    mpp2 = MaskPreprocessor(det, mask_dir=str(tmp_path))
+    mpp2.set_mask(mask.copy())
+    assert mpp2._mask.get() == mpp._mask.get()
+    mpp2.set_mask(mask + 1)
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_mask_asset_before_put(tmp_path):
+    asset = MaskAsset(name="det_mask", mask_dir=str(tmp_path))
+    with pytest.raises(MaskPreprocessorError, match="No mask"):
+        asset.describe()
+    with pytest.raises(MaskPreprocessorError, match="No mask"):
+        asset.read()
+    with pytest.raises(MaskPreprocessorError, match="No mask"):
+        asset.trigger()
+    asset.put(np.zeros((3, 4)))
+    assert asset.describe()["det_mask"]["shape"] == [3, 4]
+    with pytest.raises(MaskPreprocessorError, match="not triggered"):
+        asset.read()
+    asset.trigger()
+    assert asset.read()["det_mask"]["value"].endswith("/0")
@@ -0,0 +1,111 @@
+import bluesky.plan_stubs as bps
+import bluesky.plans as bp
+import bluesky.preprocessors as bpp
+import numpy as np
+import ophyd
+import pytest
+from bluesky import RunEngine
+from bluesky_darkframes.sim import DiffractionDetector, Shutter
+from databroker.v2 import temp
+from xpdacq.preprocessors import (CalibPreprocessor, DarkPreprocessor,
+                                  MaskPreprocessor, PreprocessorPipeline,
+                                  ShutterConfig, ShutterPreprocessor)
+
+CALIB_RESULT = (1.0, 200.0, 1000.0, 1500.0, 0.1, 0.2, 0.3, "Perkin detector")
+
+
+@pytest.fixture
+def devices():
+    detectors = [DiffractionDetector(name="det{}".format(i)) for i in range(3)]
+    shutter = Shutter(name="shutter", value="open")
+    return detectors, shutter
+
+
+def _make_pps(detectors, shutter, mask_dir):
+    """the preprocessors in the order of CustomizedRunEngine.gen_plan"""
+    config = ShutterConfig(shutter, "open", "closed")
+    pps = []
+    for det in detectors:
+        cpp = CalibPreprocessor(det)
+        cpp.add_calib_result({}, CALIB_RESULT)
+        pps.append(cpp)
+    pps.extend(DarkPreprocessor(detector=det, shutter_config=config) for det in detectors)
+    pps.extend(ShutterPreprocessor(detector=det, shutter_config=config) for det in detectors)
+    for det in detectors:
+        mpp = MaskPreprocessor(det, mask_dir=str(mask_dir))
+        mpp.set_mask(np.ones((4, 4)))
+        pps.append(mpp)
+    return pps
+
+
+def _stack(pps, plan):
+    for pp in pps:
+        plan = pp(plan)
+    return plan
+
+
+def _run(plan):
+    """run the plan without a RunEngine and return the messages with the objects named and groups numbered"""
+    msgs = []
+    groups = {}
+    ret = None
+    try:
+        while True:
+            msg = plan.send(ret)
+            kwargs = dict(msg.kwargs)
+            if kwargs.get("group") is not None:
+                kwargs["group"] = groups.setdefault(kwargs["group"], len(groups))
+            msgs.append((msg.command, getattr(msg.obj, "name", msg.obj), msg.args, kwargs))
+            ret = msg.obj.read() if msg.command == "read" and isinstance(msg.obj, ophyd.Device) else None
+    except StopIteration:
+        return msgs
+
+
+def _two_runs(detectors):
+    yield from bp.count(detectors, 2)
+    yield from bps.wait()
+    yield from bp.count(detectors[:1], 3)
+
+
+def test_same_messages_as_stacked_preprocessors(devices, tmp_path):
+    detectors, shutter = devices
+    expected = _run(_stack(_make_pps(detectors, shutter, tmp_path), _two_runs(detectors)))
+    real = _run(PreprocessorPipeline(_make_pps(detectors, shutter, tmp_path))(_two_runs(detectors)))
+    assert real == expected
+    commands = [msg[0] for msg in real]
+    assert commands.count("open_run") == 2
+    assert len(real) > 100
+
+
+def test_disabled_and_plain_preprocessors(devices, tmp_path):
+    detectors, shutter = devices
+    pps = _make_pps(detectors, shutter, tmp_path)
+    pps[0].disable()
+    pps[4].disable()
+    # a plain preprocessor between the ones with hooks keeps its place
+
+    def _no_pause(plan):
+        return bpp.msg_mutator(plan, lambda msg: None if msg.command == "checkpoint" else msg)
+
+    pps.insert(5, _no_pause)
+    expected = _run(_stack(pps, _two_runs(detectors)))
+    pipeline = PreprocessorPipeline(pps)
+    assert repr(pipeline) == "<PreprocessorPipeline of 3 layers>"
+    real = _run(pipeline(_two_runs(detectors)))
+    assert real == expected
+
+
+def test_in_a_run(devices, tmp_path):
+    detectors, shutter = devices
+    db = temp()
+    RE = RunEngine()
+    RE.subscribe(db.v1.insert)
+    # one detector, the streams of the preprocessors are not named after the detectors
+    RE(PreprocessorPipeline(_make_pps(detectors[:1], shutter, tmp_path))(bp.count(detectors[:1], 3)))
+    run = db[-1]
+    assert len(run.primary.read()["time"]) == 3
+    # a new dark frame for each trigger at max_age=0
+    assert len(run.dark.read()["time"]) == 3
+    assert len(run.calib.read()["time"]) == 3
+    assert len(run.mask.read()["time"]) == 1
+    assert shutter.get() == "closed"
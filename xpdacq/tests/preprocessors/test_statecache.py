@@ -0,0 +1,107 @@
+import bluesky.plan_stubs as bps
+import bluesky.plans as bp
+from bluesky import RunEngine
+from ophyd import Component, Device, Signal
+from ophyd.sim import hw
+from xpdacq.ipysetup import _add_a_calib_preprocessor, _clear_last_xrun
+from xpdacq.preprocessors import DarkPreprocessor, ShutterConfig, StateCache
+from xpdacq.xpdacq import CustomizedRunEngine
+from xpdacq.xpdacq_conf import xpd_configuration
+from bluesky_darkframes.sim import DiffractionDetector, Shutter
+
+
+class NoSubscription(Device):
+    value = Component(Signal, value=3.)
+
+
+def _read(plan):
+    """run the plan without a RunEngine, return the messages and the return value"""
+    msgs = []
+    ret = None
+    try:
+        while True:
+            msg = plan.send(ret)
+            msgs.append(msg)
+            ret = msg.obj.read() if msg.command == "read" else None
+    except StopIteration as e:
+        return msgs, e.value
+
+
+def test_read_state():
+    devices = hw()
+    motor = devices.motor
+    det = NoSubscription(name="det")
+    signal = Signal(name="signal", value=4.)
+    cache = StateCache()
+    # the motor reports its value after a move and the detector does not support subscriptions
+    cache.watch([motor, det])
+    RE = RunEngine()
+    RE(bps.mv(motor, 1.))
+    for _ in range(2):
+        msgs, state = _read(cache.read_state([motor, det]))
+        assert state == {"motor": 1., "det": 3.}
+        assert [msg.obj for msg in msgs] == [det]
+    # the signal does not report its value until it changes
+    msgs, state = _read(cache.read_state([signal]))
+    assert [msg.obj for msg in msgs] == [signal]
+    assert state == {"signal": 4.}
+    msgs, state = _read(cache.read_state([signal]))
+    assert not msgs
+    signal.put(5.)
+    assert _read(cache.read_state([signal])) == ([], {"signal": 5.})
+    msgs, state = _read(cache.read_state([motor]))
+    assert not msgs
+    assert state == {"motor": 1.}
+    RE(bps.mv(motor, 2.))
+    msgs, state = _read(cache.read_state([motor]))
+    assert not msgs
+    assert state == {"motor": 2.}
+    assert repr(cache) == "<StateCache of 3 signals>"
+    cache.clear()
+    assert repr(cache) == "<StateCache of 0 signals>"
+
+
+def test_no_read_in_dark_preprocessor():
+    detector = DiffractionDetector(name="detector")
+    detector.exposure_time.put(0.01)
+    shutter = Shutter(name="shutter", value="open")
+    dp = DarkPreprocessor(
+        detector=detector,
+        max_age=100.,
+        locked_signals=[detector.exposure_time],
+        shutter_config=ShutterConfig(shutter, "open", "closed"),
+        state_cache=StateCache()
+    )
+    RE = RunEngine()
+    msgs = []
+    RE.msg_hook = msgs.append
+    RE(dp(bp.count([detector], 3)))
+    assert not [msg for msg in msgs if msg.obj is detector.exposure_time]
+    assert len(dp._cache) == 1
+    # a new dark frame for a new exposure time
+    RE(bps.mv(detector.exposure_time, 0.02))
+    RE(dp(bp.count([detector], 3)))
+    assert len(dp._cache) == 2
+
+
+def test_two_xruns_in_sequence(monkeypatch):
+    motor = hw().motor
+    detector = DiffractionDetector(name="detector")
+    monkeypatch.setitem(xpd_configuration, "xrun", None)
+    RE = RunEngine()
+    caches = []
+    for _ in range(2):
+        # like the ipysetup
+        _clear_last_xrun()
+        xrun = CustomizedRunEngine(None)
+        xpd_configuration["xrun"] = xrun
+        _add_a_calib_preprocessor(xrun, detector, motor)
+        assert xrun.calib_preprocessors[0]._state_cache is xrun.state_cache
+        RE(bps.mv(motor, len(caches)))
+        assert _read(xrun.state_cache.read_state([motor]))[1] == {"motor": len(caches)}
+        caches.append(xrun.state_cache)
+    # the cache of the first xrun is not subscribed anymore
+    assert caches[0] is not caches[1]
+    assert repr(caches[0]) == "<StateCache of 0 signals>"
+    RE(bps.mv(motor, 5.))
+    assert _read(caches[1].read_state([motor])) == ([], {"motor": 5.})
@@ -1,15 +1,24 @@
+import copy
 import os
 import shutil
 import unittest
 
+import numpy as np
+import pytest
 import yaml
 from pkg_resources import resource_filename as rs_fn
-from xpdacq.beamtime import Beamtime, Sample, ScanPlan, ct
-from xpdacq.beamtimeSetup import _start_beamtime, load_beamtime
+from xpdacq import serializer
+from xpdacq.beamtime import Beamtime, MDOrderedDict, Sample, ScanPlan, Tramp, ct
+from xpdacq.beamtimeSetup import (
+    _start_beamtime,
+    load_beamtime,
+    migrate_yaml_dir,
+)
 from xpdacq.glbl import glbl
 from xpdacq.simulation import cs700, db, fb, pe1c, shctl1
-from xpdacq.xpdacq import CustomizedRunEngine
-from xpdacq.xpdacq_conf import configure_device
+from xpdacq.xpdacq import CustomizedRunEngine, translate_to_sample
+from xpdacq.xpdacq_conf import configure_device, xpd_configuration
+from xpdacq.yamllist import read_journaled_list
 
 # print messages for debugging
 # xrun.msg_hook = print
@@ -217,6 +226,31 @@ class BeamtimeObjTest(unittest.TestCase):
                 reloaded_sa = el.from_yaml(f)
             self.assertTrue("new_bt_field" in reloaded_sa)
 
+    def test_batch(self):
+        bt = Beamtime("Simon", 123, [], wavelength=0.1828)
+        sa = Sample(bt, {"sample_name": "Ni", "sample_composition": {"Ni": 1}})
+        with bt.batch():
+            bt.wavelength = 0.1832
+            bt["new_bt_field"] = "test"
+            # files are only updated on exit
+            with open(bt.filepath, "r") as f:
+                self.assertNotIn("new_bt_field", yaml.unsafe_load(f))
+        with open(bt.filepath, "r") as f:
+            reloaded_bt = bt.from_yaml(f)
+        self.assertEqual(reloaded_bt["bt_wavelength"], 0.1832)
+        self.assertEqual(reloaded_bt["new_bt_field"], "test")
+        with open(sa.filepath, "r") as f:
+            reloaded_sa = sa.from_yaml(f, beamtime=reloaded_bt)
+        self.assertEqual(reloaded_sa["new_bt_field"], "test")
+        # roll back on error
+        with self.assertRaises(RuntimeError):
+            with bt.batch():
+                bt.wavelength = 0.2
+                sa["sample_name"] = "Ni_2"
+                raise RuntimeError
+        self.assertEqual(bt.wavelength, 0.1832)
+        self.assertEqual(sa["sample_name"], "Ni")
+
     @staticmethod
     def test_chaining():
         """All contents of Beamtime and Experiment should propagate into
@@ -236,6 +270,109 @@ class BeamtimeObjTest(unittest.TestCase):
         self.assertEqual(bt2, bt)
         self.assertEqual(list(bt2.samples.values())[0], sa)
 
+    def test_load_beamtime_order(self):
+        bt = self.bt
+        Sample(bt, {"sample_name": "Ni", "sample_composition": {"Ni": 1}})
+        Sample(bt, {"sample_name": "Al", "sample_composition": {"Al": 1}})
+        sa = Sample(bt, {"sample_name": "Cu", "sample_composition": {"Cu": 1}})
+        names = list(bt.samples.keys())
+        # a file missing in the order file goes last
+        order_fn = os.path.join(glbl["config_base"], ".sample_order.yml")
+        order = read_journaled_list(order_fn)
+        order.remove("Ni.yml")
+        # the journal of the previous snapshot is ignored
+        with open(order_fn, "w") as f:
+            yaml.dump(order, f)
+        # a temporary file left by a killed write is ignored
+        tmp_fn = os.path.join(os.path.dirname(sa.filepath), ".Ni.yml.x.tmp")
+        with open(tmp_fn, "w") as f:
+            f.write("- {sample_na")
+        mtime = os.stat(sa.filepath).st_mtime_ns
+        bt2 = load_beamtime(max_workers=2)
+        os.remove(tmp_fn)
+        names.remove("Ni")
+        self.assertEqual(list(bt2.samples.keys()), names + ["Ni"])
+        # loading does not write
+        self.assertEqual(os.stat(sa.filepath).st_mtime_ns, mtime)
+        for sample in bt2.samples.values():
+            self.assertEqual(sample.flush_stats["performed"], 0)
+        sa2 = bt2.samples["Cu"]
+        self.assertEqual(sa2.filepath, sa.filepath)
+        sa2["sample_phase"] = "fcc"
+        with open(sa.filepath, "r") as f:
+            self.assertEqual(yaml.unsafe_load(f)[0]["sample_phase"], "fcc")
+
+    def test_load_beamtime_machine_codec(self):
+        codecs = ["json"]
+        if serializer.msgpack is not None:
+            codecs.append("msgpack")
+        for codec in codecs:
+            serializer.set_machine_codec(codec)
+            try:
+                sa = Sample(
+                    self.bt,
+                    {"sample_name": codec, "sample_composition": {"Ni": 1}},
+                )
+            finally:
+                serializer.set_machine_codec("yaml")
+            order_fn = os.path.join(glbl["config_base"], ".sample_order.yml")
+            self.assertEqual(
+                read_journaled_list(order_fn),
+                [name + ".yml" for name in self.bt.samples],
+            )
+            # the snapshot is written in the codec
+            if codec == "json":
+                with open(order_fn, "r") as f:
+                    self.assertTrue(f.read().startswith("#json\n["))
+            bt2 = load_beamtime()
+            self.assertEqual(list(bt2.samples.keys()), list(self.bt.samples))
+            self.assertEqual(bt2.samples[codec], sa)
+
+    def test_normalized_layout(self):
+        bt = self.bt
+        sa = Sample(bt, {"sample_name": "Ni", "sample_composition": {"Ni": 1}})
+        sp = ScanPlan(bt, ct, 1)
+        n_sa = sa.flush_stats["performed"]
+        n_sp = sp.flush_stats["performed"]
+        # the Beamtime change only touches the Beamtime file
+        bt.wavelength = 0.1832
+        self.assertEqual(sa.flush_stats["performed"], n_sa)
+        self.assertEqual(sp.flush_stats["performed"], n_sp)
+        for obj in (sa, sp):
+            with open(obj.filepath, "r") as f:
+                own, link = yaml.unsafe_load(f)
+            self.assertEqual(own, dict(obj.maps[0]))
+            self.assertEqual(link, {"bt_uid": bt["bt_uid"], "storage_version": 2})
+            # the Beamtime is required to load the file
+            with open(obj.filepath, "r") as f:
+                self.assertRaises(ValueError, lambda: obj.from_yaml(f))
+        # re-linked by uid
+        bt2 = load_beamtime()
+        sa2 = list(bt2.samples.values())[0]
+        self.assertIs(sa2.maps[1], bt2)
+        self.assertEqual(sa2["bt_wavelength"], 0.1832)
+        self.assertEqual(bt2.scanplans[sp.short_summary()], sp)
+
+    def test_migrate_yaml_dir(self):
+        bt = self.bt
+        sa = Sample(bt, {"sample_name": "Ni", "sample_composition": {"Ni": 1}})
+        sp = ScanPlan(bt, ct, 1)
+        # files of the old layout repeat the Beamtime
+        for obj in (sa, sp):
+            with open(obj.filepath, "w") as f:
+                obj.to_yaml(f)
+        migrated = migrate_yaml_dir()
+        self.assertEqual(sorted(migrated), sorted([sa.filepath, sp.filepath]))
+        with open(sa.filepath, "r") as f:
+            own, link = yaml.unsafe_load(f)
+        self.assertEqual(link, {"bt_uid": bt["bt_uid"], "storage_version": 2})
+        self.assertNotIn("bt_piLast", own)
+        # migrating again does nothing
+        self.assertEqual(migrate_yaml_dir(), [])
+        bt2 = load_beamtime()
+        self.assertEqual(list(bt2.samples.values())[0], sa)
+        self.assertEqual(bt2.scanplans[sp.short_summary()], sp)
+
     @staticmethod
     def test_list_bkg_smoke():
         bt = Beamtime("Simon", 123, [], wavelength=0.1828, custom1="A")
@@ -259,3 +396,116 @@ class BeamtimeObjTest(unittest.TestCase):
         glbl["frame_acq_time"] = 0.5
         self.assertRaises(ValueError, lambda: xrun({}, ScanPlan(bt, ct, 0.2)))
         glbl["frame_acq_time"] = 0.1  # reset after test
+
+
+def test_md_ordered_dict_sel():
+    d = MDOrderedDict((k, i) for i, k in enumerate("abcde"))
+    assert [d.sel(i) for i in range(5)] == [0, 1, 2, 3, 4]
+    assert d.sel(-1) == 4
+    # re-registration keeps the position
+    d["b"] = 10
+    assert d.sel(1) == 10
+    assert d.position("b") == 1
+    d["f"] = 5
+    assert d.position("f") == 5
+    del d["c"]
+    d.move_to_end("a")
+    d.update(g=6)
+    assert d.popitem(last=False) == ("b", 10)
+    assert d.setdefault("h", 7) == 7
+    assert [d.sel(i) for i in range(len(d))] == list(d.values())
+    assert {k: d.position(k) for k in d} == {k: i for i, k in enumerate(d)}
+    copied = copy.deepcopy(d)
+    copied["i"] = 8
+    assert copied.sel(-1) == 8
+    assert d.sel(-1) == 7
+    with pytest.raises(IndexError):
+        d.sel(len(d))
+    d.clear()
+    d["a"] = 1
+    assert d.sel(0) == 1
+
+
+def test_register_samples_and_rename(bt):
+    order_fn = os.path.join(glbl["config_base"], ".sample_order.yml")
+    n_samples = len(bt.samples)
+    samples = bt.register_samples(
+        {"sample_name": "bulk_{}".format(i), "sample_composition": {"Ni": 1}}
+        for i in range(3)
+    )
+    assert [sa["sample_name"] for sa in samples] == ["bulk_0", "bulk_1", "bulk_2"]
+    assert list(bt.samples)[n_samples:] == ["bulk_0", "bulk_1", "bulk_2"]
+    assert read_journaled_list(order_fn) == [name + ".yml" for name in bt.samples]
+    # an overwrite keeps the place
+    Sample(bt, {"sample_name": "bulk_0", "sample_composition": {"Cu": 1}})
+    assert bt.samples.position("bulk_0") == n_samples
+    old_fp = samples[1].filepath
+    bt.rename_sample("bulk_1", "renamed")
+    assert list(bt.samples)[n_samples:] == ["bulk_0", "renamed", "bulk_2"]
+    assert read_journaled_list(order_fn) == [name + ".yml" for name in bt.samples]
+    assert not os.path.isfile(old_fp)
+    with open(samples[1].filepath) as f:
+        assert yaml.unsafe_load(f)[0]["sample_name"] == "renamed"
+    with pytest.raises(ValueError):
+        bt.rename_sample("renamed", "bulk_2")
+    bt2 = load_beamtime()
+    assert list(bt2.samples) == list(bt.samples)
+
+
+def test_sample_flat_md(bt):
+    sa = bt.samples.sel(0)
+    md = sa.flat_md
+    assert md == dict(sa)
+    # cached until a change
+    assert sa.flat_md is md
+    with pytest.raises(TypeError):
+        md["sample_phase"] = "fcc"
+    sa["sample_phase"] = "fcc"
+    assert sa.flat_md["sample_phase"] == "fcc"
+    md = sa.flat_md
+    bt.wavelength = 0.2
+    assert sa.flat_md is not md
+    assert sa.flat_md["bt_wavelength"] == 0.2
+    with pytest.raises(RuntimeError):
+        with bt.batch():
+            sa["sample_phase"] = "bcc"
+            assert sa.flat_md["sample_phase"] == "bcc"
+            raise RuntimeError
+    assert sa.flat_md["sample_phase"] == "fcc"
+    # a copy that can be changed
+    md = translate_to_sample(bt, 0)
+    assert md == sa.flat_md
+    md["robot_identifier"] = 1
+    assert "robot_identifier" not in sa.flat_md
+    assert translate_to_sample(bt, sa["sample_name"]) == sa.flat_md
+
+
+def test_scanplan_cache(bt, set_xpd_configuration, monkeypatch):
+    sp = ScanPlan(bt, Tramp, 5, 300, 305, 1)
+    summary = str(sp)
+    assert summary.count("Read") == 6
+    md = sp.md
+    assert md["sp_plan_name"] == "Tramp"
+    assert md["sp_num_frames"] == int(np.ceil(5 / glbl["frame_acq_time"]))
+    # the plan is not run again
+    monkeypatch.setattr(ScanPlan, "factory", None)
+    assert str(sp) == summary
+    assert sp.md == md
+    sp.md["sp_plan_name"] = "changed"
+    assert sp.md == md
+    monkeypatch.undo()
+    # a change of the arguments or of the devices
+    sp["sp_args"] = (5, 300, 310, 1)
+    assert str(sp).count("Read") == 11
+    assert sp.bound_arguments == {"exposure": 5, "Tstart": 300, "Tstop": 310, "Tstep": 1}
+    summary = str(sp)
+    temp_controller = xpd_configuration["temp_controller"]
+    monkeypatch.setitem(xpd_configuration, "temp_controller", copy.copy(temp_controller))
+    assert str(sp) is not summary
+    assert str(sp) == summary
+    # the glbl values are compared by value
+    summary = str(sp)
+    monkeypatch.setitem(glbl, "frame_acq_time", float(str(glbl["frame_acq_time"])))
+    assert str(sp) is summary
+    monkeypatch.setitem(glbl, "frame_acq_time", glbl["frame_acq_time"] / 2)
+    assert str(sp) is not summary
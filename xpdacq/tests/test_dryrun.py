@@ -0,0 +1,57 @@
+import pytest
+from xpdacq.beamtime import ScanPlan, Tramp, ct
+from xpdacq.dryrun import CostModel
+from xpdacq.glbl import glbl
+from xpdacq.preprocessors import (DarkPreprocessor, ShutterConfig,
+                                  ShutterPreprocessor)
+from xpdacq.xpdacq_conf import xpd_configuration
+
+
+@pytest.fixture(scope="function")
+def xrun(fresh_xrun):
+    det = xpd_configuration["area_det"]
+    sc = ShutterConfig.from_xpdacq()
+    fresh_xrun.dark_preprocessors.append(DarkPreprocessor(detector=det, max_age=60., shutter_config=sc))
+    fresh_xrun.shutter_preprocessors.append(ShutterPreprocessor(detector=det, shutter_config=sc))
+    return fresh_xrun
+
+
+def test_simulate_ct(bt, xrun):
+    sp = ScanPlan(bt, ct, 5)
+    est = xrun.simulate(0, sp)
+    shutter_time = glbl["shutter_sleep"]
+    # close the shutter, take the dark, open the shutter, take the light and close the shutter
+    assert est.duration == pytest.approx(10. + 3 * shutter_time)
+    assert (est.n_darks, est.n_shutter_cycles) == (1, 1)
+    assert est.plans[0].n_runs == 1
+    assert est.plans[0].plan == sp.short_summary()
+    assert not est.unmodeled
+    assert "total" in str(est)
+    # the run engine and the preprocessors are not used
+    assert not xrun.dark_preprocessors[0].cache
+    assert xrun.state == "idle"
+
+
+def test_simulate_queue(bt, xrun):
+    sp = ScanPlan(bt, ct, 5)
+    est = xrun.simulate([0, 1, 0], sp)
+    # the dark frame is taken once within the max age
+    assert est.n_darks == 1
+    assert est.n_shutter_cycles == 3
+    by_sample = est.by_sample()
+    assert list(by_sample) == [est.plans[0].sample, est.plans[1].sample]
+    assert by_sample[est.plans[0].sample].n_runs == 2
+    est = xrun.simulate([0, 1, 0], sp, model=CostModel(frame_acq_time=0.1, shutter_time=0., max_ages={}))
+    assert est.n_darks == 3
+    assert est.duration == pytest.approx(30.)
+
+
+def test_simulate_ramp(bt, xrun):
+    sp = ScanPlan(bt, Tramp, 5, 300, 310, 5)
+    name = xpd_configuration["temp_controller"].name
+    est = xrun.simulate(0, sp)
+    assert est.unmodeled == {name}
+    est_ramp = xrun.simulate(0, sp, ramp_rates={name: 0.5}, positions={name: 290.})
+    # 20 K at 0.5 K/s
+    assert est_ramp.duration == pytest.approx(est.duration + 40.)
+    assert not est_ramp.unmodeled
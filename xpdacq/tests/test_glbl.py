@@ -12,6 +12,7 @@ from xpdacq.xpdacq_conf import (
     _set_glbl,
     configure_device,
 )
+from xpdacq.tools import get_durability, set_durability, wait_flushed
 
 
 class glblTest(unittest.TestCase):
@@ -70,3 +71,63 @@ class glblTest(unittest.TestCase):
             assert glbl2 is not self._glbl
             assert glbl2["dk_window"] == 20
         assert self._glbl["dk_window"] == 20
+
+    def test_glbl_batch(self):
+        self._glbl["dk_window"] = 20
+        with self._glbl.batch():
+            self._glbl["dk_window"] = 30
+            self._glbl["auto_dark"] = False
+            with open(self._glbl.filepath, "r") as f:
+                assert GlblYamlDict.from_yaml(f)["dk_window"] == 20
+        with open(self._glbl.filepath, "r") as f:
+            reloaded = GlblYamlDict.from_yaml(f)
+        assert reloaded["dk_window"] == 30
+        assert reloaded["auto_dark"] is False
+        with self.assertRaises(RuntimeError):
+            with self._glbl.batch():
+                self._glbl["dk_window"] = 40
+                raise RuntimeError
+        assert self._glbl["dk_window"] == 30
+
+    def test_glbl_yaml_durability(self):
+        try:
+            self._glbl["yaml_durability"] = "fsync-file"
+            assert get_durability() == "fsync-file"
+            with open(self._glbl.filepath, "r") as f:
+                reloaded = GlblYamlDict.from_yaml(f)
+            assert reloaded["yaml_durability"] == "fsync-file"
+            with self.assertRaises(ValueError):
+                self._glbl["yaml_durability"] = "always"
+            assert self._glbl["yaml_durability"] == "fsync-file"
+        finally:
+            set_durability("none")
+
+    def test_glbl_machine_codec(self):
+        try:
+            self._glbl["machine_codec"] = "json"
+            with open(self._glbl.filepath, "r") as f:
+                assert f.read().startswith("#json\n{")
+            reload_glbl_dict = _reload_glbl()
+            for k, v in self._glbl.items():
+                assert reload_glbl_dict[k] == v
+            with self.assertRaises(ValueError):
+                self._glbl["machine_codec"] = "xml"
+        finally:
+            self._glbl["machine_codec"] = "yaml"
+
+    def test_glbl_async_flush(self):
+        self._glbl["async_flush"] = True
+        try:
+            n_performed = self._glbl.flush_stats["performed"]
+            for i in range(10):
+                self._glbl["dk_window"] = i
+            assert self._glbl.flush_stats["performed"] == n_performed + 10
+            wait_flushed()
+            with open(self._glbl.filepath, "r") as f:
+                reloaded = GlblYamlDict.from_yaml(f)
+            assert reloaded["dk_window"] == 9
+            assert reloaded["async_flush"] is True
+        finally:
+            self._glbl["async_flush"] = False
+        with open(self._glbl.filepath, "r") as f:
+            assert GlblYamlDict.from_yaml(f)["async_flush"] is False
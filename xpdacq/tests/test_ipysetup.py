@@ -42,12 +42,10 @@ def test__set_calib_preprocessor(tmp_path: Path):
     # case 1
     cpp1 = CalibPreprocessor(det)
     _set_calib_preprocessor(cpp1, dct, None)
-    assert cpp1._cache
-    first = next(iter(cpp1._cache.keys()))
-    assert dict(first) == dict()
+    assert cpp1._seed
+    assert dict(cpp1._seed[0]) == dict()
     # case 2
     cpp2 = CalibPreprocessor(det)
     _set_calib_preprocessor(cpp2, dct, det_z)
-    assert cpp2._cache
-    first = next(iter(cpp2._cache.keys()))
-    assert dict(first) == {det_z.name: det_z.get()}
+    assert cpp2._seed
+    assert dict(cpp2._seed[0]) == {det_z.name: det_z.get()}
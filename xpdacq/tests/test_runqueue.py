@@ -0,0 +1,145 @@
+import os
+
+import bluesky.plan_stubs as bps
+import bluesky.plans as bp
+import bluesky.preprocessors as bpp
+import pytest
+from bluesky.utils import RunEngineInterrupted
+from xpdacq.beamtime import ScanPlan, ct
+from xpdacq.glbl import glbl
+from xpdacq.runqueue import ABORT, PAUSED, QUEUE_FILE, SUCCESS, RunQueue
+from xpdacq.xpdacq import CustomizedRunEngine
+from xpdacq.xpdacq_conf import xpd_configuration
+
+
+def failing(dets, exposure):
+    @bpp.run_decorator()
+    def inner():
+        yield from bps.null()
+        raise RuntimeError("failed")
+
+    yield from inner()
+
+
+def pausing(dets, exposure):
+    @bpp.run_decorator()
+    def inner():
+        yield from bps.checkpoint()
+        yield from bps.pause()
+        yield from bps.null()
+
+    yield from inner()
+
+
+def test_run_queue(tmp_path):
+    fname = str(tmp_path.joinpath("queue.yml"))
+    queue = RunQueue(fname)
+    assert queue.next_index() is None
+    queue.put("Ni", "ct_5")
+    queue.put({"sample_name": "TiO2"}, "ct_5", {"note": "test"})
+    queue.set_status(0, "running")
+    queue.add_uid(0, "uid0")
+    # the changes are in the journal
+    loaded = RunQueue(fname)
+    assert list(loaded) == list(queue)
+    assert loaded[0]["uids"] == ["uid0"]
+    assert loaded[1]["md"] == {"note": "test"}
+    assert loaded.next_index() == 0
+    loaded.set_status(0, "fail", "error")
+    assert loaded.next_index() == 1
+    loaded.retry(0)
+    assert loaded[0]["status"] == "pending"
+    assert "reason" not in loaded[0]
+    loaded.clear()
+    assert len(RunQueue(fname)) == 0
+
+
+def test_enqueue_and_drain(bt, fresh_xrun, db):
+    xrun = fresh_xrun
+    xrun.queue.clear()
+    sp = ScanPlan(bt, ct, 1)
+    xrun.enqueue([0, 1], sp, note="queued")
+    with pytest.raises(TypeError):
+        xrun.enqueue(0, sp.factory())
+    assert len(xrun.queue) == 2
+    uids = xrun.drain()
+    assert len(uids) == 2
+    queue = RunQueue(os.path.join(glbl["config_base"], QUEUE_FILE))
+    assert [item["status"] for item in queue] == ["success", "success"]
+    assert [item["uids"] for item in queue] == [[uid] for uid in uids]
+    assert db[uids[1]].metadata["start"]["note"] == "queued"
+    assert db[uids[1]].metadata["start"]["sample_name"] == queue[1]["sample"]
+    # nothing left
+    assert xrun.drain() == ()
+
+
+def test_drain_after_failure_and_restart(bt, fresh_xrun, db):
+    xrun = fresh_xrun
+    xrun.queue.clear()
+    sp = ScanPlan(bt, ct, 1)
+    failing_sp = ScanPlan(bt, failing, 1)
+    xrun.enqueue(0, [sp, failing_sp, sp])
+    with pytest.raises(RuntimeError):
+        xrun.drain()
+    item = xrun.queue[1]
+    assert item["status"] == "fail"
+    assert len(item["uids"]) == 1
+    # a crash while the last item is running
+    xrun.queue.set_status(2, "running")
+    xrun.queue.add_uid(2, "lost")
+    restarted = CustomizedRunEngine(None)
+    restarted.beamtime = bt
+    restarted.subscribe(db.v1.insert)
+    assert restarted.queue.next_index() == 2
+    uids = restarted.drain()
+    assert len(uids) == 1
+    item = restarted.queue[2]
+    assert item["status"] == "success"
+    assert item["uids"] == ["lost", uids[0]]
+
+
+def test_drain_paused_and_aborted(bt, fresh_xrun, db):
+    xrun = fresh_xrun
+    xrun.queue.clear()
+    sp = ScanPlan(bt, ct, 1)
+    xrun.enqueue(0, [ScanPlan(bt, pausing, 1), sp])
+    with pytest.raises(RunEngineInterrupted):
+        xrun.drain()
+    assert xrun.queue[0]["status"] == PAUSED
+    xrun.abort()
+    item = xrun.queue[0]
+    assert item["status"] == ABORT
+    # the other runs are not recorded in the item
+    xrun({}, bp.count([xpd_configuration["area_det"]]))
+    assert xrun.queue[0]["uids"] == item["uids"]
+    assert len(item["uids"]) == 1
+    # the aborted item is not run again
+    assert len(xrun.drain()) == 1
+    assert xrun.queue[0]["status"] == ABORT
+    assert xrun.queue[1]["status"] == SUCCESS
+
+
+def test_drain_after_resume(bt, fresh_xrun, db):
+    xrun = fresh_xrun
+    xrun.queue.clear()
+    sp = ScanPlan(bt, ct, 1)
+    xrun.enqueue(0, [ScanPlan(bt, pausing, 1), sp])
+    with pytest.raises(RunEngineInterrupted):
+        xrun.drain()
+    xrun.resume()
+    assert xrun.queue[0]["status"] == SUCCESS
+    assert xrun.state_hook is None
+    # only the next item is run
+    uids = xrun.drain()
+    assert len(uids) == 1
+    assert [item["uids"] for item in xrun.queue][1] == list(uids)
+    assert len(xrun.queue[0]["uids"]) == 1
+
+
+def test_drain_kwargs_and_md(bt, fresh_xrun, db):
+    xrun = fresh_xrun
+    xrun.queue.clear()
+    xrun.enqueue(0, ScanPlan(bt, ct, 1), note="item")
+    uids = xrun.drain(note="drain", other="drain")
+    start = db[uids[0]].metadata["start"]
+    assert (start["note"], start["other"]) == ("item", "drain")
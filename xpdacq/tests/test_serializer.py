@@ -0,0 +1,63 @@
+import pytest
+
+from xpdacq import serializer
+
+DATA = {
+    "sample_name": "Ni",
+    "sample_composition": {"Ni": 1},
+    "tags": ["powder", "calibrant"],
+    "bt_wavelength": 0.1828,
+}
+
+
+@pytest.fixture
+def machine_codec():
+    old = serializer.get_machine_codec()
+    yield
+    serializer.set_machine_codec(old)
+
+
+def test_dump_load():
+    data = dict(DATA, sp_args=(1, 2))
+    text = serializer.dump(data, default_flow_style=False)
+    assert serializer.load(text) == data
+    assert serializer.load(text.encode("utf-8")) == data
+
+
+@pytest.mark.parametrize("codec", ["yaml", "json", "msgpack"])
+def test_encode(codec):
+    if codec == "msgpack":
+        pytest.importorskip("msgpack")
+    used, encoded = serializer.encode_as(DATA, codec)
+    assert used == codec
+    assert serializer.load(encoded) == DATA
+    assert serializer.decode(encoded, used) == DATA
+    # the codecs that can not give back the data fall back to yaml
+    data = {0: "a.yml", 1: ("b", "c")}
+    used, encoded = serializer.encode_as(data, codec)
+    assert used == "yaml"
+    assert serializer.load(encoded) == data
+
+
+def test_load_yaml_flow():
+    # yaml in the flow style is not taken for json
+    assert serializer.load("{a: 1, b: [x, y]}") == {"a": 1, "b": ["x", "y"]}
+    assert serializer.load("[1, 2] ") == [1, 2]
+    assert serializer.load("[1, {a: 1.0e+3}]") == [1, {"a": 1000.0}]
+    assert serializer.load('{"a": 1}'.encode("utf-8")) == {"a": 1}
+
+
+def test_load_file(tmp_path):
+    fp = str(tmp_path / "order.yml")
+    with open(fp, "w") as f:
+        f.write(serializer.encode({"a": [1, 2]}, "json"))
+    assert serializer.load_file(fp) == {"a": [1, 2]}
+
+
+def test_set_machine_codec(machine_codec):
+    serializer.set_machine_codec("json")
+    assert serializer.get_machine_codec() == "json"
+    assert serializer.encode_machine(DATA).startswith("#json\n{")
+    with pytest.raises(ValueError):
+        serializer.set_machine_codec("xml")
+    assert serializer.get_machine_codec() == "json"
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+import yaml
+
+from xpdacq import serializer
+from xpdacq.beamtime import Sample, _link_map
+from xpdacq.beamtimeSetup import load_beamtime
+from xpdacq.sqlitestore import SqliteStore
+
+
+@pytest.fixture
+def store(bt, tmp_path):
+    store = SqliteStore(str(tmp_path / "bt.sqlite"))
+    store.import_yaml()
+    yield store
+    store.close()
+
+
+def test_load_beamtime(bt, store):
+    bt2 = store.load_beamtime()
+    assert bt2 == bt
+    assert bt2.store is store
+    assert list(bt2.samples.keys()) == list(bt.samples.keys())
+    assert list(bt2.scanplans.keys()) == list(bt.scanplans.keys())
+    for name, sample in bt.samples.items():
+        assert bt2.samples[name] == sample
+        assert bt2.samples[name].maps[1] is bt2
+        # loading does not write
+        assert bt2.samples[name].flush_stats["performed"] == 0
+    for name, scanplan in bt.scanplans.items():
+        assert bt2.scanplans[name] == scanplan
+
+
+def test_lookup(bt, store):
+    names = list(bt.samples.keys())
+    sample = bt.samples[names[1]]
+    # the same as the yaml file
+    data = serializer.load_file(sample.filepath)
+    assert store.get_sample(name=names[1]) == data
+    assert store.get_sample(uid=sample["sa_uid"]) == data
+    assert store.get_sample(position=1) == [dict(sample.maps[0]), _link_map(bt["bt_uid"])]
+    assert store.get_sample(name="not a sample") is None
+    scanplan = list(bt.scanplans.values())[0]
+    assert store.get_scanplan(position=0) == serializer.load_file(scanplan.filepath)
+    with pytest.raises(ValueError):
+        store.get_sample()
+
+
+def test_write_through(bt, store):
+    bt2 = store.load_beamtime()
+    names = list(bt2.samples.keys())
+    bt2.samples[names[0]]["sample_phase"] = "new phase"
+    assert store.get_sample(name=names[0])[0]["sample_phase"] == "new phase"
+    # a new sample goes to the end, a sample of the same name keeps the place
+    Sample(bt2, {"sample_name": "new_sample", "sample_composition": {"Ni": 1}})
+    assert store.get_sample(position=len(names))[0]["sample_name"] == "new_sample"
+    replaced = Sample(bt2, {"sample_name": names[0], "sample_composition": {"Ni": 1}})
+    assert store.get_sample(position=0)[0]["sa_uid"] == replaced["sa_uid"]
+    bt2.wavelength = 0.2
+    bt3 = store.load_beamtime()
+    assert bt3.wavelength == 0.2
+    assert list(bt3.samples.keys()) == list(bt2.samples.keys())
+    # nothing is written to the yaml files
+    assert not os.path.isfile(bt2.samples["new_sample"].filepath)
+    assert load_beamtime().wavelength == bt.wavelength
+
+
+def test_batch(store):
+    bt2 = store.load_beamtime()
+    with pytest.raises(RuntimeError):
+        with store.batch():
+            Sample(bt2, {"sample_name": "rolled_back", "sample_composition": {"Ni": 1}})
+            assert store.get_sample(name="rolled_back") is not None
+            raise RuntimeError
+    assert store.get_sample(name="rolled_back") is None
+
+
+def test_export_yaml(bt, store, tmp_path):
+    directory = str(tmp_path / "yml")
+    store.export_yaml(directory)
+    bt2 = load_beamtime(directory)
+    assert bt2 == bt
+    assert list(bt2.samples.keys()) == list(bt.samples.keys())
+    for name, sample in bt.samples.items():
+        assert bt2.samples[name] == sample
+    with open(os.path.join(directory, "bt_bt.yml"), "r") as f:
+        assert yaml.unsafe_load(f) == dict(bt)
@@ -1,6 +1,16 @@
+import os
+import threading
+
 import pytest
 
-from xpdacq.tools import regularize_dict_key, validate_dict_key
+from xpdacq.tools import (
+    BackgroundWriter,
+    atomic_write,
+    get_durability,
+    regularize_dict_key,
+    set_durability,
+    validate_dict_key,
+)
 
 
 @pytest.mark.parametrize(
@@ -41,3 +51,83 @@ def test_validate_dict_key_raise(input_dict):
     # fail cases
     with pytest.raises(RuntimeError):
         validate_dict_key(input_dict, ".", ",")
+
+
+@pytest.mark.parametrize("durability", ["none", "fsync-file", "fsync-dir"])
+def test_atomic_write(tmp_path, durability):
+    fp = str(tmp_path / "a.yml")
+    atomic_write(fp, "a: 1\n", durability=durability)
+    atomic_write(fp, "a: 2\n", durability=durability)
+    with open(fp) as f:
+        assert f.read() == "a: 2\n"
+    # no temporary file is left behind
+    assert os.listdir(str(tmp_path)) == ["a.yml"]
+
+
+def test_atomic_write_keeps_old_file_on_failure(tmp_path):
+    fp = str(tmp_path / "a.yml")
+    atomic_write(fp, "a: 1\n")
+    os.chmod(fp, 0o640)
+    with pytest.raises(TypeError):
+        atomic_write(fp, 1)
+    with open(fp) as f:
+        assert f.read() == "a: 1\n"
+    assert os.listdir(str(tmp_path)) == ["a.yml"]
+    atomic_write(fp, b"a: 3\n")
+    assert os.stat(fp).st_mode & 0o777 == 0o640
+
+
+
+def test_atomic_write_new_file_mode(tmp_path):
+    # the same mode as a file created by open, without changing the umask
+    fp = str(tmp_path / "a.yml")
+    atomic_write(fp, "a: 1\n")
+    ref = str(tmp_path / "b.yml")
+    with open(ref, "w") as f:
+        f.write("a: 1\n")
+    assert os.stat(fp).st_mode & 0o777 == os.stat(ref).st_mode & 0o777
+
+
+def test_set_durability():
+    old = get_durability()
+    try:
+        set_durability("fsync-dir")
+        assert get_durability() == "fsync-dir"
+        with pytest.raises(ValueError):
+            set_durability("always")
+        assert get_durability() == "fsync-dir"
+    finally:
+        set_durability(old)
+
+
+def test_background_writer(tmp_path):
+    fp = str(tmp_path / "a.yml")
+    writer = BackgroundWriter()
+    started, release = threading.Event(), threading.Event()
+    produced = []
+
+    def blocked():
+        started.set()
+        release.wait()
+        return "a: 0\n"
+
+    def produce(i):
+        produced.append(i)
+        return "a: {}\n".format(i)
+
+    writer.submit(fp, blocked)
+    started.wait()
+    # the writes waiting for the thread are coalesced
+    for i in range(1, 4):
+        writer.submit(fp, lambda i=i: produce(i))
+    assert not writer.wait_flushed(timeout=0.01)
+    release.set()
+    assert writer.wait_flushed()
+    assert produced == [3]
+    with open(fp) as f:
+        assert f.read() == "a: 3\n"
+    # the errors are raised by wait_flushed
+    writer.submit(str(tmp_path / "missing" / "b.yml"), lambda: "b: 1\n")
+    with pytest.raises(OSError):
+        writer.wait_flushed()
+    assert writer.wait_flushed()
@@ -0,0 +1,62 @@
+from collections import ChainMap
+
+import pytest
+
+from xpdacq.validated_dict import ValidatedDictLike, ValidationError
+
+
+class _Checked:
+    """reject the value 'bad' and record the keys passed to validate"""
+
+    def validate(self, keys=None):
+        self.validated = keys
+        if "bad" in self.values():
+            raise ValidationError
+
+
+class CheckedDict(_Checked, ValidatedDictLike, dict):
+    pass
+
+
+class CheckedChainMap(_Checked, ValidatedDictLike, ChainMap):
+    pass
+
+
+def test_changed_keys_are_validated():
+    d = CheckedDict(a=1, b=2)
+    assert d.validated is None
+    d["a"] = 3
+    assert d.validated == ["a"]
+    d.update({"c": 4}, d=5)
+    assert d.validated == ["c", "d"]
+    assert d.setdefault("a", 0) == 3
+    assert d.validated == ["a"]
+    del d["d"]
+    assert d.validated == ["d"]
+    d.clear()
+    assert sorted(d.validated) == ["a", "b", "c"]
+
+
+def test_rollback():
+    d = CheckedDict(a=1, b=2)
+    with pytest.raises(ValueError):
+        d["a"] = "bad"
+    assert d == {"a": 1, "b": 2}
+    with pytest.raises(ValidationError):
+        d.update(a=3, c="bad")
+    assert d == {"a": 1, "b": 2}
+    with pytest.raises(ValidationError):
+        d.setdefault("c", "bad")
+    assert d == {"a": 1, "b": 2}
+
+
+def test_rollback_keeps_parent_map():
+    parent = {"p": 1}
+    d = CheckedChainMap({"a": 1}, parent)
+    with pytest.raises(ValueError):
+        d["b"] = "bad"
+    # the parent keys are not copied into the own map
+    assert d.maps == [{"a": 1}, {"p": 1}]
+    with pytest.raises(ValueError):
+        d["p"] = "bad"
+    assert d.maps == [{"a": 1}, {"p": 1}]
@@ -1,5 +1,8 @@
 import bluesky.plans as bp
+import pytest
+from bluesky.utils import Msg
 
+from xpdacq.xpdacq import MsgDispatcher
 from xpdacq.xpdacq_conf import xpd_configuration
 
 
@@ -16,3 +19,94 @@ def test_sample_md_injection(fresh_xrun):
 
     xrun.subscribe(assert_sample_md, "start")
     xrun(sample_md, bp.count([det]))
+
+
+def test_msg_dispatcher():
+    dispatcher = MsgDispatcher()
+    calls = []
+
+    def tag(msg):
+        calls.append(msg.command)
+        msg.kwargs["tag"] = len(calls)
+        return msg
+
+    def insert(msg):
+        yield Msg("null")
+        msg.kwargs["inserted"] = True
+
+    dispatcher.add_msg_handler("open_run", tag)
+    dispatcher.add_plan_handler("open_run", insert)
+
+    def plan():
+        ret = yield Msg("open_run")
+        assert ret == "uid"
+        try:
+            yield Msg("checkpoint")
+        except ValueError:
+            yield Msg("close_run")
+        return "done"
+
+    gen = dispatcher(plan())
+    msgs = [next(gen), next(gen), gen.send("uid")]
+    assert [msg.command for msg in msgs] == ["null", "open_run", "checkpoint"]
+    assert msgs[1].kwargs == {"tag": 1, "inserted": True}
+    # the exceptions go to the plan
+    assert gen.throw(ValueError()).command == "close_run"
+    with pytest.raises(StopIteration) as info:
+        next(gen)
+    assert info.value.value == "done"
+    assert calls == ["open_run"]
+    # the other exceptions are not given to the plan, like in the plan_mutator
+    plan_exc = []
+
+    def plan2():
+        try:
+            yield Msg("checkpoint")
+        except BaseException as e:
+            plan_exc.append(e)
+            raise
+
+    gen = dispatcher(plan2())
+    next(gen)
+    with pytest.raises(KeyboardInterrupt):
+        gen.throw(KeyboardInterrupt())
+    # the plan is only closed
+    assert not [e for e in plan_exc if not isinstance(e, GeneratorExit)]
+
+
+def test_sample_md_injection_many(fresh_xrun):
+    """Test if each run of a queue gets the metadata of its sample."""
+    xrun = fresh_xrun
+    det = xpd_configuration["area_det"]
+    samples = [{"sample_name": name} for name in ("Ni", "Al", "Cu")]
+    names = []
+    xrun.subscribe(lambda name, doc: names.append(doc.get("sample_name")), "start")
+    xrun(samples, [bp.count([det]) for _ in samples])
+    assert names == ["Ni", "Al", "Cu"]
+
+
+def test_robot_md_in_start(fresh_xrun, bt):
+    """Test if the robot information of the sample is in the start."""
+    xrun = fresh_xrun
+    det = xpd_configuration["area_det"]
+    sa_uid = bt.samples.sel(0)["sa_uid"]
+    bt.robot_info[sa_uid] = {"robot_identifier": 3, "robot_geometry": "capillary"}
+    xpd_configuration["robot"] = det
+    commands = []
+
+    async def record(msg):
+        commands.append(msg.command)
+
+    xrun.register_command("load_sample", record)
+    xrun.register_command("unload_sample", record)
+    starts = []
+    xrun.subscribe(lambda name, doc: starts.append(doc), "start")
+    try:
+        xrun(0, bp.count([det]), robot=True)
+    finally:
+        del bt.robot_info[sa_uid]
+        del xpd_configuration["robot"]
+    assert commands == ["load_sample", "unload_sample"]
+    assert starts[-1]["robot_identifier"] == 3
+    assert starts[-1]["robot_geometry"] == "capillary"
+    assert "robot_identifier" not in bt.samples.sel(0).flat_md
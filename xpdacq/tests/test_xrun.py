@@ -23,8 +23,11 @@ from xpdacq.xpdacq import (
     CustomizedRunEngine,
     _auto_load_calibration_file,
     _validate_dark,
+    resolve_plan,
     set_beamdump_suspender,
+    xpdacq_composer,
 )
+from xpdacq.tools import xpdAcqError
 from xpdacq.xpdacq_conf import XPDACQ_MD_VERSION, configure_device, xpd_configuration
 from xpdsim import dexela
 
@@ -467,6 +470,43 @@ class xrunTest(unittest.TestCase):
             assert s == starts[0]
 
 
+def test_lazy_xrun(fresh_xrun, monkeypatch):
+    xrun = fresh_xrun
+    starts = []
+    xrun.subscribe(lambda name, doc: starts.append(doc), "start")
+    xrun([0, 1, 2], 0)
+    eager = [(s["sample_name"], s.get("sp_plan_name")) for s in starts]
+    starts.clear()
+    xrun([0, 1, 2], 0, lazy=True)
+    assert [(s["sample_name"], s.get("sp_plan_name")) for s in starts] == eager
+    # the plans are made one by one
+    made = []
+    factory = ScanPlan.factory
+    monkeypatch.setattr(
+        ScanPlan, "factory", lambda self: made.append(self) or factory(self)
+    )
+    plan = xpdacq_composer(xrun.beamtime, [0, 1, 2], 0, lazy=True)
+    assert not made
+    next(plan)
+    assert len(made) == 1
+    plan.close()
+    # the later samples and plans are looked up after the earlier runs
+    looked_up = []
+    monkeypatch.setattr(
+        "xpdacq.xpdacq.resolve_plan", lambda bt, p: looked_up.append(p) or resolve_plan(bt, p)
+    )
+    plan = xpdacq_composer(xrun.beamtime, [0, 1], [0, 1000], lazy=True)
+    assert not looked_up
+    plan.close()
+    looked_up_at_start = []
+    xrun.subscribe(lambda name, doc: looked_up_at_start.append(list(looked_up)), "start")
+    with pytest.raises(xpdAcqError):
+        xrun([0, 1], [0, 1000], lazy=True)
+    # the first run is started before the unknown scanplan is looked up
+    assert looked_up_at_start[0] == [0]
+    assert looked_up == [0, 1000]
+
+
 def test_dexela(fresh_xrun):
     xpd_configuration["area_det"] = dexela
     xrun = fresh_xrun
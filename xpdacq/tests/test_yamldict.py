@@ -0,0 +1,141 @@
+import os
+
+import pytest
+import yaml
+
+from xpdacq.yamldict import FLUSH_STATS, YamlChainMap, YamlDict, reset_flush_stats
+
+
+def _load(fp):
+    with open(fp) as f:
+        return yaml.unsafe_load(f)
+
+
+@pytest.fixture
+def parent_child(tmp_path):
+    parent = YamlDict(a=1)
+    parent.filepath = str(tmp_path / "parent.yml")
+    child = YamlChainMap({"b": 2}, parent)
+    child.filepath = str(tmp_path / "child.yml")
+    parent._referenced_by.append(child)
+    return parent, child
+
+
+def _writes(obj):
+    return obj.flush_stats["performed"]
+
+
+def test_batch_coalesces_writes(parent_child):
+    parent, child = parent_child
+    n_parent, n_child = _writes(parent), _writes(child)
+    with parent.batch():
+        parent["a"] = 10
+        parent.update(c=3, d=4)
+        parent.setdefault("e", 5)
+        parent.pop("d")
+        child["b"] = 20
+        # nothing is written inside the block
+        assert _writes(parent) == n_parent
+        assert _writes(child) == n_child
+        assert _load(parent.filepath) == {"a": 1}
+    assert _writes(parent) == n_parent + 1
+    assert _writes(child) == n_child + 1
+    assert _load(parent.filepath) == {"a": 10, "c": 3, "e": 5}
+    assert _load(child.filepath) == [{"b": 20}, {"a": 10, "c": 3, "e": 5}]
+
+
+def test_batch_without_mutation_does_not_write(parent_child):
+    parent, child = parent_child
+    n_parent, n_child = _writes(parent), _writes(child)
+    with parent.batch():
+        pass
+    assert _writes(parent) == n_parent
+    assert _writes(child) == n_child
+
+
+def test_batch_rollback(parent_child):
+    parent, child = parent_child
+    n_parent, n_child = _writes(parent), _writes(child)
+    with pytest.raises(RuntimeError):
+        with parent.batch():
+            parent["a"] = 10
+            parent["new"] = "value"
+            child["b"] = 20
+            raise RuntimeError("abort")
+    assert dict(parent) == {"a": 1}
+    assert dict(child) == {"a": 1, "b": 2}
+    assert _writes(parent) == n_parent
+    assert _writes(child) == n_child
+    # the object is usable again and writes immediately
+    parent["a"] = 2
+    assert _load(parent.filepath) == {"a": 2}
+
+
+def test_nested_batch(parent_child):
+    parent, _ = parent_child
+    n_parent = _writes(parent)
+    with parent.batch():
+        parent["a"] = 10
+        with pytest.raises(KeyError):
+            with parent.batch():
+                parent["a"] = 100
+                raise KeyError("inner")
+        assert parent["a"] == 10
+        with parent.batch():
+            parent["f"] = 6
+        assert _writes(parent) == n_parent
+    assert _writes(parent) == n_parent + 1
+    assert _load(parent.filepath) == {"a": 10, "f": 6}
+
+
+def test_unchanged_contents_are_not_written(parent_child):
+    parent, child = parent_child
+    n_parent, n_child = _writes(parent), _writes(child)
+    skipped = parent.flush_stats["skipped"]
+    # same value, same yaml
+    parent["a"] = 1
+    assert _writes(parent) == n_parent
+    assert parent.flush_stats["skipped"] == skipped + 1
+    # serialized again, the same yaml is not written
+    parent.flush()
+    assert _writes(parent) == n_parent
+    assert parent.flush_stats["skipped"] == skipped + 2
+    # the children are only flushed when the parent file changes
+    assert _writes(child) == n_child
+    parent["a"] = 2
+    assert _writes(parent) == n_parent + 1
+    assert _writes(child) == n_child + 1
+    assert _load(child.filepath) == [{"b": 2}, {"a": 2}]
+
+
+def test_flush_after_nested_edit(tmp_path):
+    d = YamlDict(a=[1])
+    d.filepath = str(tmp_path / "d.yml")
+    n_writes = _writes(d)
+    d["a"].append(2)
+    d.flush()
+    assert _load(d.filepath) == {"a": [1, 2]}
+    assert _writes(d) == n_writes + 1
+    # written even if the yaml is the same
+    d.flush(force=True)
+    assert _writes(d) == n_writes + 2
+
+
+def test_deleted_file_is_written_again(tmp_path):
+    d = YamlDict(a=1)
+    d.filepath = str(tmp_path / "d.yml")
+    os.remove(d.filepath)
+    d["a"] = 1
+    assert _load(d.filepath) == {"a": 1}
+
+
+def test_flush_stats(tmp_path):
+    reset_flush_stats()
+    d = YamlDict(a=1)
+    d.filepath = str(tmp_path / "d.yml")
+    d["a"] = 1
+    d["a"] = 2
+    stats = d.flush_stats
+    assert stats["requested"] == stats["performed"] + stats["skipped"]
+    assert stats["skipped"] == 1
+    assert FLUSH_STATS["requested"] == stats["requested"]
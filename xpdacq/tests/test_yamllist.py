@@ -0,0 +1,72 @@
+import os
+
+import pytest
+import yaml
+
+from xpdacq.yamllist import JournaledYamlList, read_journaled_list
+
+
+def _load(fp):
+    with open(fp) as f:
+        return yaml.unsafe_load(f)
+
+
+@pytest.fixture
+def fname(tmp_path):
+    return str(tmp_path / "lst.yml")
+
+
+def test_mutations_are_replayed(fname):
+    lst = JournaledYamlList(fname, [1, 2])
+    lst.append(3)
+    lst.extend([4, (5, 6)])
+    lst.insert(0, 0)
+    lst[1] = "one"
+    del lst[2]
+    assert lst.pop() == (5, 6)
+    lst.remove(3)
+    # only the journal is written
+    assert _load(fname) == [1, 2]
+    assert read_journaled_list(fname) == [0, "one", 4]
+    assert JournaledYamlList(fname) == [0, "one", 4]
+
+
+def test_compaction(fname):
+    lst = JournaledYamlList(fname, [], compact_min=3)
+    for i in range(4):
+        lst.append(i)
+    # compacted after the fourth record
+    assert _load(fname) == [0, 1, 2, 3]
+    lst.append(4)
+    lst.sort(reverse=True)
+    assert _load(fname) == [4, 3, 2, 1, 0]
+    lst.append(5)
+    with lst:
+        pass
+    assert _load(fname) == [4, 3, 2, 1, 0, 5]
+    assert read_journaled_list(fname) == lst
+
+
+def test_torn_and_stale_journal(fname):
+    lst = JournaledYamlList(fname, ["a"])
+    lst.append("b")
+    with open(lst.journal_fname, "a") as f:
+        f.write('["append", "[\\"c')
+    assert read_journaled_list(fname) == ["a", "b"]
+    # the snapshot is replaced by another writer
+    with open(fname, "w") as f:
+        yaml.dump(["x"], f)
+    assert read_journaled_list(fname) == ["x"]
+    # the list is written in full instead of being appended
+    lst.append("c")
+    assert _load(fname) == ["a", "b", "c"]
+    assert read_journaled_list(fname) == ["a", "b", "c"]
+
+
+def test_codec(fname):
+    lst = JournaledYamlList(fname, [1], codec="json")
+    lst.append(2)
+    lst.flush()
+    with open(fname) as f:
+        assert f.read() == "#json\n[1, 2]"
+    assert os.path.isfile(lst.journal_fname)
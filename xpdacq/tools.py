@@ -14,12 +14,25 @@
 #
 ##############################################################################
 
+import atexit
+import contextlib
 import copy
 import datetime
+import os
 import sys
+import tempfile
+import threading
+from collections import OrderedDict
 
 from IPython import get_ipython
 
+# how hard `atomic_write` tries to get the data on the disk
+#   none: atomic rename only, survives a killed process
+#   fsync-file: also fsync the file, survives a power loss of the data
+#   fsync-dir: also fsync the directory, survives a power loss of the rename
+DURABILITY_LEVELS = ("none", "fsync-file", "fsync-dir")
+_durability = {"level": "none"}
+
 
 def regularize_dict_key(input_dict: dict, target_chr: str, replace_chr: str) -> dict:
     """recursively replace target character in keys with desired one. Return a new dictionary.
@@ -47,6 +60,206 @@ def regularize_dict_key(input_dict: dict, target_chr: str, replace_chr: str) ->
     return dct
 
 
+def set_durability(level: str) -> None:
+    """set the default durability level of `atomic_write`
+
+    Parameters
+    ----------
+    level : str
+        one of 'none', 'fsync-file' and 'fsync-dir'
+    """
+    if level not in DURABILITY_LEVELS:
+        raise ValueError(
+            "Unknown durability level '{}'. Please choose from {}.".format(
+                level, DURABILITY_LEVELS
+            )
+        )
+    _durability["level"] = level
+
+
+def get_durability() -> str:
+    """return the default durability level of `atomic_write`"""
+    return _durability["level"]
+
+
+def _read_umask() -> int:
+    """read the umask of the process, without changing it if the system tells it"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    # os.umask can only read it by setting it, done once at import
+    with _umask_lock:
+        umask = os.umask(0o077)
+        os.umask(umask)
+    return umask
+
+
+_umask_lock = threading.Lock()
+_umask = _read_umask()
+
+
+def _get_umask() -> int:
+    return _umask
+
+
+def atomic_write(filepath: str, data, durability: str = None) -> None:
+    """write the data to a file so that readers see either the old or the new contents
+
+    The data is written to a temporary file in the same directory which
+    then replaces the target file by a rename. A process killed in the middle
+    of the write leaves the old file untouched.
+
+    Parameters
+    ----------
+    filepath : str
+        path to the file to write
+    data : str or bytes
+        contents of the file
+    durability : str, optional
+        one of 'none', 'fsync-file' and 'fsync-dir'. default is the level
+        set by `set_durability`
+    """
+    if durability is None:
+        durability = _durability["level"]
+    elif durability not in DURABILITY_LEVELS:
+        raise ValueError("Unknown durability level '{}'.".format(durability))
+    filepath = os.path.abspath(filepath)
+    dirname, basename = os.path.split(filepath)
+    mode = "wb" if isinstance(data, bytes) else "w"
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".{}.".format(basename), suffix=".tmp", dir=dirname
+    )
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+            if durability != "none":
+                f.flush()
+                os.fsync(f.fileno())
+        # mkstemp creates the file readable by the owner only
+        if os.path.isfile(filepath):
+            os.chmod(tmp_path, os.stat(filepath).st_mode & 0o7777)
+        else:
+            os.chmod(tmp_path, 0o666 & ~_get_umask())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    if durability == "fsync-dir" and hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(dirname, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class BackgroundWriter:
+    """a single thread writing files with `atomic_write`
+
+    Each file is written with the data of its last submission, the older
+    submissions that are still waiting are dropped. The data is produced
+    by a callable in the thread, so that the serialization is not done by
+    the caller either.
+    """
+
+    def __init__(self):
+        self._pending = OrderedDict()
+        self._busy = 0
+        self._errors = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, filepath: str, produce) -> None:
+        """write the data returned by `produce()` to the file in the thread
+
+        Parameters
+        ----------
+        filepath : str
+            path to the file to write
+        produce : callable
+            return the str or bytes to write
+        """
+        with self._cond:
+            self._pending[os.path.abspath(filepath)] = produce
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="xpdacq-writer", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                filepath, produce = self._pending.popitem(last=False)
+                self._busy += 1
+            try:
+                atomic_write(filepath, produce())
+            except Exception as err:
+                sys.stderr.write(
+                    "WHOOPS: fail to write {}: {}\n".format(filepath, err)
+                )
+                with self._cond:
+                    self._errors.append(err)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+                    self._cond.notify_all()
+
+    def wait_flushed(self, timeout: float = None) -> bool:
+        """block until all the submitted files are written
+
+        Parameters
+        ----------
+        timeout : float, optional
+            maximum time to wait in seconds. default is no limit
+
+        Returns
+        -------
+        flushed : bool
+            False if the timeout is reached
+
+        Raises
+        ------
+        Exception
+            the first error of the writes since the last call
+        """
+        with self._cond:
+            flushed = self._cond.wait_for(
+                lambda: not self._pending and not self._busy, timeout
+            )
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+        return flushed
+
+
+_writer = BackgroundWriter()
+
+
+def write_in_background(filepath: str, produce) -> None:
+    """write a file in the background thread, see `BackgroundWriter.submit`"""
+    _writer.submit(filepath, produce)
+
+
+def wait_flushed(timeout: float = None) -> bool:
+    """block until the background writes are done, see `BackgroundWriter.wait_flushed`"""
+    return _writer.wait_flushed(timeout)
+
+
+@atexit.register
+def _flush_on_exit():
+    # the errors are already reported by the thread
+    with contextlib.suppress(Exception):
+        _writer.wait_flushed()
+
+
 def validate_dict_key(input_dict, invalid_chr, suggested_chr):
     """
     recursively go through a nested dict and collect keys
@@ -23,7 +23,7 @@ from time import strftime
 import pandas as pd
 from IPython import get_ipython
 
-from .beamtime import Beamtime, Sample
+from .beamtime import Beamtime
 from .glbl import glbl
 from .tools import _check_obj, _graceful_exit, validate_dict_key
 
@@ -351,7 +351,7 @@ class ExceltoYaml:
             sample_name = d.get("sample_name")
             if bkgd_name not in sample_name_set:
                 no_bkgd_sample_name_list.append(sample_name)
-            Sample(bt, d)
+        bt.register_samples(self.parsed_sa_md_list)
         if no_bkgd_sample_name_list:
             print(
                 "INFO: If you want to associate a background sample,"
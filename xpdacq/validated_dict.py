@@ -1,3 +1,9 @@
+from collections import ChainMap
+
+# marks a key that was not in the mapping before a mutation
+_MISSING = object()
+
+
 class ValidatedDictLike:
     """
     This a dict with a `validate` method that may raise any exception.
@@ -6,6 +12,10 @@ class ValidatedDictLike:
     are changed. If a change is illegal, it is reverted an the exception
     from `validate` is raised. Thus, it is impossible to put the dict
     into an invalid state.
+
+    A change only records the previous values of the keys it touches and
+    passes these keys to `validate`, so that a validation that only depends
+    on the changed keys does not go through the whole mapping.
     """
 
     def __init__(self, *args, **kwargs):
@@ -15,19 +25,37 @@ class ValidatedDictLike:
         except ValidationError:
             raise ValidationError("Validation failed. Unable to create ValidatedDictLike.")
 
+    def _own_map(self):
+        """The mapping changed by the mutations, the first map of a ChainMap."""
+        return self.maps[0] if isinstance(self, ChainMap) else self
+
+    def _undo_log(self, keys):
+        """Return the previous values of the keys, see `_undo`."""
+        own = self._own_map()
+        return [(key, own[key] if key in own else _MISSING) for key in keys]
+
+    def _undo(self, log):
+        """Put back the values recorded by `_undo_log`."""
+        own = self._own_map()
+        for key, val in reversed(log):
+            if val is not _MISSING:
+                super().__setitem__(key, val)
+            elif key in own:
+                super().__delitem__(key)
+
     def clear(self):
-        original = dict(self)
+        log = self._undo_log(list(self._own_map()))
         super().clear()
         try:
-            self.validate()
+            self.validate(keys=[key for key, _ in log])
         except ValidationError:
-            super().update(original)
+            self._undo(log)
             raise ValidationError("Validation failed. Unable to clear.")
 
     def pop(self, key):
         val = super().pop(key)
         try:
-            self.validate()
+            self.validate(keys=[key])
         except ValidationError:
             super().__setitem__(key, val)
             raise ValidationError("Validation failed. Unable to pop {}".format(key))
@@ -35,48 +63,59 @@ class ValidatedDictLike:
     def popitem(self):
         key, val = super().popitem()
         try:
-            self.validate()
+            self.validate(keys=[key])
         except ValidationError:
             super().__setitem__(key, val)
             raise ValidationError("Validation failed. Unable to popitem {}".format(key))
 
-    def setdefault(self, *args, **kwargs):
-        original = dict(self)
-        super().setdefault(*args, **kwargs)
+    def setdefault(self, key, default=None):
+        log = self._undo_log([key])
+        res = super().setdefault(key, default)
         try:
-            self.validate()
+            self.validate(keys=[key])
         except ValidationError:
-            super().update(original)
+            self._undo(log)
             raise ValidationError("Validation failed. Unable to setdefault.")
+        return res
 
     def update(self, *args, **kwargs):
-        original = dict(self)
-        super().update(*args, **kwargs)
+        other = dict(*args, **kwargs)
+        log = self._undo_log(other)
+        super().update(other)
         try:
-            self.validate()
+            self.validate(keys=list(other))
         except ValidationError:
-            super().clear()
-            super().update(original)
+            self._undo(log)
             raise ValidationError("Validation failed. Unable to update.")
 
     def __setitem__(self, key, val):
+        log = self._undo_log([key])
         super().__setitem__(key, val)
         try:
-            self.validate()
+            self.validate(keys=[key])
         except ValidationError:
-            super().__delitem__(key)
+            self._undo(log)
             raise ValueError("Validation failed. Unable to set {}: {}".format(key, val))
 
     def __delitem__(self, key):
         val = self[key]
         super().__delitem__(key)
         try:
-            self.validate()
+            self.validate(keys=[key])
         except ValidationError:
             super().__setitem__(key, val)
             raise ValueError("Validation failed. Unable to delete {}".format(key))
 
-    def validate(self):
+    def validate(self, keys=None):
+        """
+        Raise an exception if the contents are not valid.
+
+        Parameters
+        ----------
+        keys : iterable, optional
+            the keys changed since the contents were last validated. If
+            None, the whole mapping is validated.
+        """
         pass
 
 
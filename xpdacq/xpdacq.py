@@ -13,12 +13,13 @@
 # See LICENSE.txt for license information.
 #
 ##############################################################################
+import itertools
 import os
 import time
 import typing
 import uuid
 import warnings
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from itertools import groupby
 from pprint import pprint
 from textwrap import indent
@@ -27,20 +28,27 @@ from typing import Generator
 import bluesky.plan_stubs as bps
 import bluesky.plans as bp
 import bluesky.preprocessors as bpp
-import yaml
 from bluesky import RunEngine
 from bluesky.callbacks.best_effort import BestEffortCallback
 from bluesky.callbacks.broker import verify_files_saved
 from bluesky.preprocessors import pchain
 from bluesky.suspenders import SuspendFloor
-from bluesky.utils import Msg, normalize_subs_input, single_gen
+from bluesky.utils import (Msg, RunEngineControlException,
+                           RunEngineInterrupted, normalize_subs_input,
+                           single_gen)
 from ophyd import Device
 
+from xpdacq import serializer
 from xpdacq.beamtime import (Beamtime, ScanPlan, close_shutter_stub,
                              open_shutter_stub)
+from xpdacq.dryrun import CostModel, QueueEstimate, estimate_queue
 from xpdacq.glbl import glbl
 from xpdacq.preprocessors import (CalibPreprocessor, DarkPreprocessor,
-                                  MaskPreprocessor, ShutterPreprocessor)
+                                  MaskPreprocessor, PreprocessorPipeline,
+                                  ShutterPreprocessor, StateCache)
+from xpdacq.preprocessors.maskpreprocessor import MASK_DIR
+from xpdacq.runqueue import (FAIL, PAUSED, QUEUE_FILE, RUNNING, SUCCESS,
+                             QueueRecorder, RunQueue)
 from xpdacq.tools import xpdAcqError, xpdAcqException
 from xpdacq.xpdacq_conf import XPDACQ_MD_VERSION, xpd_configuration
 
@@ -123,6 +131,8 @@ class CustomizedRunEngine(RunEngine):
     ----------
     beamtime
         beamtime object currently associated with this RunEngine instance.
+    state_cache
+        The values of the locked signals of the preprocessors of this RunEngine instance.
 
     Examples
     --------
@@ -151,6 +161,11 @@ class CustomizedRunEngine(RunEngine):
         self.dark_preprocessors: typing.List[DarkPreprocessor] = []
         self.calib_preprocessors: typing.List[CalibPreprocessor] = []
         self.shutter_preprocessors: typing.List[ShutterPreprocessor] = []
+        self.state_cache = StateCache()
+        self._queue: typing.Optional[RunQueue] = None
+        self._queue_tokens: typing.List[int] = []
+        # the state_hook replaced while an item of the queue is paused and the hook replacing it
+        self._paused_item_hook: typing.Optional[tuple] = None
         bec = BestEffortCallback()
         bec.noplot_streams.extend(["calib", "dark"])
         bec.disable_baseline()
@@ -184,7 +199,7 @@ class CustomizedRunEngine(RunEngine):
     def _make_cpps(self, poni_file: PoniFile):
         cpps = []
         for det, poni in poni_file:
-            cpp = CalibPreprocessor(det)
+            cpp = CalibPreprocessor(det, state_cache=self.state_cache)
             cpp.load_calib_result({}, poni)
             cpps.append(cpp)
         return cpps
@@ -192,7 +207,7 @@ class CustomizedRunEngine(RunEngine):
     def _make_mpps(self, mask_files: MaskFiles):
         mpps = []
         for det, masks in mask_files:
-            mpp = MaskPreprocessor(det)
+            mpp = MaskPreprocessor(det, mask_dir=os.path.join(glbl["config_base"], MASK_DIR))
             mpp.load_masks(masks)
             mpps.append(mpp)
         return mpps
@@ -203,7 +218,8 @@ class CustomizedRunEngine(RunEngine):
         plan: typing.Union[int, str, typing.Generator, ScanPlan, list, tuple],
         robot: bool,
         poni_file: typing.Optional[PoniFile],
-        mask_files: typing.Optional[MaskFiles]
+        mask_files: typing.Optional[MaskFiles],
+        lazy: bool = False
     ) -> Plan:
         """_summary_
 
@@ -215,6 +231,8 @@ class CustomizedRunEngine(RunEngine):
             _description_
         robot : bool
             _description_
+        lazy : bool, optional
+            If True, the plan of each sample is made only when the previous one is finished.
 
         Returns
         -------
@@ -229,21 +247,18 @@ class CustomizedRunEngine(RunEngine):
             robot=robot,
             shutter_control=None,
             dark_strategy=None,
-            auto_load_calib=False
+            auto_load_calib=False,
+            lazy=lazy
         )
         # create one time use cpp if poni_file is given
         cpps = self._make_cpps(poni_file) if poni_file is not None else self.calib_preprocessors
         # create one time use mask preprocessor if mask_files are given
         mpps = self._make_mpps(mask_files) if mask_files is not None else list()
-        for cpp in cpps:
-            plan = cpp(plan)
-        for dpp in self.dark_preprocessors:
-            plan = dpp(plan)
-        for spp in self.shutter_preprocessors:
-            plan = spp(plan)
-        for mpp in mpps:
-            plan = mpp(plan)
-        return plan
+        # mutate the plan in one pass, in the order of calib, dark, shutter and mask
+        pipeline = PreprocessorPipeline(
+            itertools.chain(cpps, self.dark_preprocessors, self.shutter_preprocessors, mpps)
+        )
+        return pipeline(plan)
 
     def __call__(
         self,
@@ -257,6 +272,7 @@ class CustomizedRunEngine(RunEngine):
         dark_strategy: typing.Callable = None,
         robot: bool = False,
         ask_before_run: bool = False,
+        lazy: bool = False,
         **metadata_kw
     ):
         """
@@ -316,6 +332,11 @@ class CustomizedRunEngine(RunEngine):
 
             If true run the scan as a robot scan, defaults to False
 
+        lazy: bool, optional
+
+            If true, the plan of each sample is made only when the previous one is finished, so that a long
+            queue starts at once and does not hold the plans of all the samples. Defaults to False.
+
         metadata_kw:
 
             Extra keyword arguments for specifying metadata in the run time. If the extra metdata has the same
@@ -335,7 +356,7 @@ class CustomizedRunEngine(RunEngine):
                 "global metadata"
             )
         # compose the plan
-        final_plan = self.gen_plan(sample, plan, robot, poni_file, mask_files)
+        final_plan = self.gen_plan(sample, plan, robot, poni_file, mask_files, lazy=lazy)
         # normalize the subs
         _subs = normalize_subs_input(subs) if subs else {}
         # verify writing files
@@ -349,6 +370,192 @@ class CustomizedRunEngine(RunEngine):
                 return
         return super(CustomizedRunEngine, self).__call__(final_plan, _subs, **metadata_kw)
 
+    @property
+    def queue(self) -> RunQueue:
+        """The queue of the samples and plans in glbl['config_base'], see `enqueue` and `drain`."""
+        fname = os.path.join(glbl["config_base"], QUEUE_FILE)
+        if self._queue is None or self._queue.fname != fname:
+            self._queue = RunQueue(fname)
+        return self._queue
+
+    def enqueue(
+        self,
+        sample: typing.Union[int, str, dict, list, tuple],
+        plan: typing.Union[int, str, ScanPlan, list, tuple],
+        **metadata_kw
+    ) -> None:
+        """Add the samples and plans at the end of the queue, to be run by `drain`.
+
+        The samples and the plans are the same as in ``xrun(sample, plan)``. They are saved by the name of the
+        registered Sample and ScanPlan, or the dict of the sample, so the plans must be registered ScanPlans.
+
+        Parameters
+        ----------
+        sample : int or str or dict-like or list of them
+            The samples like in ``xrun(sample, plan)``.
+        plan : int or str or ScanPlan or list of them
+            The ScanPlans registered in the beamtime.
+        metadata_kw :
+            The metadata of the runs of these items.
+
+        Examples
+        --------
+        >>> xrun.enqueue([0, 1, 2], 3)
+        >>> xrun.drain()
+        """
+        lst_sample, lst_plan = _normalize_sample_plan(sample, plan)
+        # fail before adding any item
+        items = [
+            (_queued_sample(self.beamtime, s), _queued_plan(self.beamtime, p)) for s, p in zip(lst_sample, lst_plan)
+        ]
+        queue = self.queue
+        for s, p in items:
+            queue.put(s, p, metadata_kw)
+        return
+
+    def _record_queue_item(self, index: typing.Optional[int]) -> None:
+        """Subscribe the recorder of the runs of an item of the queue, or only unsubscribe the last one."""
+        for token in self._queue_tokens:
+            self.unsubscribe(token)
+        self._queue_tokens = []
+        if index is not None:
+            recorder = QueueRecorder(self.queue, index)
+            self._queue_tokens = [self.subscribe(recorder, "start"), self.subscribe(recorder, "stop")]
+        return
+
+    def _watch_paused_item(self, index: int) -> None:
+        """Finish the paused item of the queue when the run engine is resumed, stopped or aborted without `drain`.
+
+        The recorder of the item is unsubscribed when the run engine is idle again, so that it does not record
+        the other runs. The item is a success unless its stop document says otherwise.
+        """
+        previous = self.state_hook
+
+        def finish_paused_item(new_state, old_state):
+            if previous is not None:
+                previous(new_state, old_state)
+            if new_state != "idle":
+                return
+            self._unwatch_paused_item()
+            self._record_queue_item(None)
+            if self.queue[index]["status"] == PAUSED:
+                self.queue.set_status(index, SUCCESS)
+            return
+
+        self._paused_item_hook = (previous, finish_paused_item)
+        self.state_hook = finish_paused_item
+        return
+
+    def _unwatch_paused_item(self) -> None:
+        """Put back the state_hook replaced by `_watch_paused_item`."""
+        if self._paused_item_hook is None:
+            return
+        previous, hook = self._paused_item_hook
+        if self.state_hook is hook:
+            self.state_hook = previous
+        self._paused_item_hook = None
+        return
+
+    def drain(self, **kwargs) -> tuple:
+        """Run the items of the queue from the first unfinished one.
+
+        The uids of the runs and the status of each item are saved in the queue while it runs, so that a
+        crashed session drains the queue again from the item it was running. If the run engine is paused,
+        `drain` resumes it and goes on with the queue. If it is resumed, stopped or aborted by
+        ``xrun.resume()``, ``xrun.stop()`` or ``xrun.abort()`` instead, the paused item is finished by the
+        stop document of its run and `drain` goes on from the next one. The queue stops at an item that fails
+        or is aborted, they are not run again unless `xrun.queue.retry(index)`.
+
+        Parameters
+        ----------
+        kwargs :
+            The keyword arguments of ``xrun(sample, plan)`` for all the items, like `robot` or `poni_file`.
+            The metadata saved with an item take precedence over the keyword arguments of the same names.
+
+        Returns
+        -------
+        uids : tuple
+            The uids of the runs started by this call.
+        """
+        queue = self.queue
+        uids = []
+        while True:
+            index = queue.next_index()
+            if index is None:
+                return tuple(uids)
+            item = queue[index]
+            resume = item["status"] == PAUSED and self.state == "paused"
+            # the item is finished here
+            self._unwatch_paused_item()
+            if not resume:
+                queue.set_status(index, RUNNING)
+                self._record_queue_item(index)
+            try:
+                if resume:
+                    # the recorder of the item is still subscribed
+                    ret = self.resume()
+                else:
+                    ret = self(item["sample"], item["plan"], **{**kwargs, **item["md"]})
+            except RunEngineInterrupted:
+                queue.set_status(index, PAUSED)
+                self._watch_paused_item(index)
+                raise
+            except BaseException as error:
+                self._record_queue_item(None)
+                if queue[index]["status"] == RUNNING:
+                    queue.set_status(index, FAIL, repr(error))
+                raise
+            self._record_queue_item(None)
+            if queue[index]["status"] == RUNNING:
+                queue.set_status(index, SUCCESS)
+            uids.extend(ret or ())
+            if queue[index]["status"] != SUCCESS:
+                return tuple(uids)
+
+    def simulate(
+        self,
+        sample: typing.Union[int, str, dict, list, tuple],
+        plan: typing.Union[int, str, typing.Generator, ScanPlan, list, tuple],
+        model: CostModel = None,
+        **kwargs
+    ) -> QueueEstimate:
+        """Estimate the duration of the plans of the samples without touching the hardware.
+
+        The plans are walked through the dark and the shutter preprocessors of the run engine and the time of
+        their operations is estimated by a cost model. The exposure is the one configured by the plan, see
+        `configure_area_det`. The dark frames are taken like the DarkPreprocessors do, starting with none.
+
+        Parameters
+        ----------
+        sample : int or dict-like or list of int or dict-like Sample metadata
+            The samples like in ``xrun(sample, plan)``.
+        plan : int or generator or list of int or generator
+            The plans like in ``xrun(sample, plan)``. The generators are consumed.
+        model : CostModel, optional
+            The time taken by the operations of the beamline. By default, it is made from `glbl` and the
+            preprocessors, with the keyword arguments, like the `speeds` of the motors and the `ramp_rates`
+            of the temperature controllers in units per second.
+
+        Returns
+        -------
+        estimate : QueueEstimate
+            The estimated duration, number of dark frames and shutter cycles of each plan and of the queue.
+
+        Examples
+        --------
+        >>> estimate = xrun.simulate([0, 1, 2], 0, ramp_rates={"cs700": 0.2})
+        >>> print(estimate)
+        >>> estimate.duration
+        """
+        if model is None:
+            model = CostModel.from_xpdacq(self.dark_preprocessors, self.shutter_preprocessors, **kwargs)
+        lst_sample, lst_plan = _normalize_sample_plan(sample, plan)
+        lst_metadata = [translate_to_sample(self.beamtime, s) for s in lst_sample]
+        lst_resolved = [resolve_plan(self.beamtime, p) for p in lst_plan]
+        return estimate_queue(
+            lst_metadata, lst_resolved, model, self.dark_preprocessors, self.shutter_preprocessors
+        )
+
 
 def xpdacq_composer(
     beamtime: Beamtime,
@@ -358,7 +565,8 @@ def xpdacq_composer(
     robot: bool = False,
     shutter_control: typing.Tuple[Device, typing.Any] = None,
     dark_strategy: typing.Callable = None,
-    auto_load_calib: bool = False
+    auto_load_calib: bool = False,
+    lazy: bool = False
 ) -> typing.Generator:
     """Create a list of plans for an xpd experiment. Used in `~xpdacq.xpdacq.CumstomeizedRunEngine.__call__`.
 
@@ -390,6 +598,10 @@ def xpdacq_composer(
     auto_load_calib :
         If True, the calibration meta-data will be injected into the run. Else, do nothing.
 
+    lazy :
+        If True, the sample and the plan of each pair are looked up, made and wrapped only when the previous
+        one is finished, see ``lazy_pchain``. A wrong sample or plan is reported when its turn comes.
+
     Returns
     -------
     grand_plan :
@@ -399,30 +611,45 @@ def xpdacq_composer(
     warn_wavelength(beamtime)
     # noramlize the sample and plan to two lists with the same length
     lst_sample, lst_plan = _normalize_sample_plan(sample, plan)
-    # Turn ints into actual sample dictionary
-    lst_metadata = [translate_to_sample(beamtime, s) for s in lst_sample]
-    # Turn ints into bluesky generators
-    lst_bp_plan = [translate_to_plan(beamtime, p) for p in lst_plan]
-    # Make the complete plan by chaining the chained plans
-    if robot:
-        lst_bp_plan = gen_robot_plans(beamtime, lst_metadata, lst_bp_plan)
-    # Inject the sample metadata
-    lst_bp_plan = [inject_metadata(p, s) for p, s in zip(lst_bp_plan, lst_metadata)]
-    # chain the plans
-    grand_plan = pchain(*lst_bp_plan)
+    # the dark runs of the dark_strategy must not get the sample metadata
+    running = None if shutter_control and dark_strategy else RunningSample()
+    if lazy:
+        # the samples and plans are looked up one by one at run time
+        grand_plan = lazy_pchain(beamtime, lst_sample, lst_plan, robot=robot, running=running)
+    else:
+        # Turn ints into actual sample dictionary
+        lst_metadata = [translate_to_sample(beamtime, s) for s in lst_sample]
+        # Turn ints into bluesky generators
+        lst_bp_plan = [translate_to_plan(beamtime, p) for p in lst_plan]
+        # Make the complete plan by chaining the chained plans
+        if robot:
+            lst_bp_plan = gen_robot_plans(beamtime, lst_metadata, lst_bp_plan)
+        if running is None:
+            # Inject the sample metadata
+            lst_bp_plan = [inject_metadata(p, s) for p, s in zip(lst_bp_plan, lst_metadata)]
+            # chain the plans
+            grand_plan = pchain(*lst_bp_plan)
+        else:
+            grand_plan = running.chain(lst_metadata, lst_bp_plan)
+    # all the start document mutators run in one layer
+    dispatcher = MsgDispatcher()
+    if running is not None:
+        # Inject the sample metadata
+        dispatcher.add_msg_handler("open_run", running.inject)
     # shutter control and dark
     if shutter_control and dark_strategy:
         grand_plan = dark_strategy(grand_plan)
-        grand_plan = bpp.msg_mutator(grand_plan, _inject_qualified_dark_frame_uid)
+        dispatcher.add_msg_handler("open_run", _inject_qualified_dark_frame_uid)
     # Load calibration file
     if auto_load_calib:
-        grand_plan = bpp.msg_mutator(grand_plan, _inject_calibration_md)
+        dispatcher.add_msg_handler("open_run", _inject_calibration_md)
     # Insert xpdacq md version
-    grand_plan = bpp.msg_mutator(grand_plan, _inject_xpdacq_md_version)
+    dispatcher.add_msg_handler("open_run", _inject_xpdacq_md_version)
     # Insert analysis stage tag
-    grand_plan = bpp.msg_mutator(grand_plan, _inject_analysis_stage)
+    dispatcher.add_msg_handler("open_run", _inject_analysis_stage)
     # Insert filter metadata
-    grand_plan = bpp.plan_mutator(grand_plan, _inject_filter_positions)
+    dispatcher.add_plan_handler("open_run", _read_filter_positions)
+    grand_plan = dispatcher(grand_plan)
     # close shutter
     if shutter_control:
         shutter, close_state = shutter_control
@@ -577,7 +804,7 @@ def _auto_load_calibration_file(in_scan=True):
         return
     else:
         with open(calib_yaml_name) as f:
-            calib_dict = yaml.unsafe_load(f)
+            calib_dict = serializer.load(f)
         if in_scan:
             print(
                 "INFO: This scan will append calibration parameters "
@@ -599,7 +826,94 @@ def inject_metadata(plan: typing.Generator, metadata: dict) -> typing.Generator:
     return plan1
 
 
-def __inject_filter_positions(msg):
+class MsgDispatcher:
+    """Run the message mutators of each command in a single generator layer.
+
+    Each ``msg_mutator`` or ``plan_mutator`` adds a generator that every message of the plan goes through.
+    The dispatcher looks up the handlers of the command of a message in a dict and runs them in the
+    order they were added, so the messages of the other commands only cost a dict lookup.
+
+    Examples
+    --------
+    >>> dispatcher = MsgDispatcher()
+    >>> dispatcher.add_msg_handler("open_run", _inject_analysis_stage)
+    >>> plan = dispatcher(bp.count([pe1c]))
+    """
+
+    def __init__(self):
+        self._handlers = {}
+
+    def add_msg_handler(self, command: str, func: typing.Callable[[Msg], Msg]) -> None:
+        """Add a handler returning the message, like the function of a ``msg_mutator``."""
+        self._handlers.setdefault(command, []).append((func, False))
+
+    def add_plan_handler(self, command: str, func: typing.Callable[[Msg], Plan]) -> None:
+        """Add a handler returning a plan whose messages are inserted before the message.
+
+        The plan may also edit the message.
+        """
+        self._handlers.setdefault(command, []).append((func, True))
+
+    def __call__(self, plan: Plan) -> Plan:
+        return self._dispatch(plan)
+
+    def _dispatch(self, plan: Plan) -> Plan:
+        handlers = self._handlers
+        ret = None
+        exc = None
+        while True:
+            try:
+                msg = plan.send(ret) if exc is None else plan.throw(exc)
+            except StopIteration as e:
+                return e.value
+            ret = exc = None
+            try:
+                for func, inserts in handlers.get(msg.command, ()):
+                    if inserts:
+                        yield from func(msg)
+                    else:
+                        msg = func(msg)
+                ret = yield msg
+            except GeneratorExit:
+                plan.close()
+                raise
+            except Exception as e:
+                exc = e
+
+
+class RunningSample:
+    """The metadata of the sample whose plan is running, injected by a ``MsgDispatcher`` handler.
+
+    It replaces the ``inject_metadata`` layer around the plan of each sample.
+    """
+
+    def __init__(self):
+        self.md = None
+
+    def inject(self, msg: Msg) -> Msg:
+        """Inject the metadata in the start of the run."""
+        if self.md is not None:
+            msg.kwargs.update(**self.md)
+        return msg
+
+    def chain(self, metadata: typing.Iterable[typing.Mapping], plans: typing.List[Plan]) -> Plan:
+        """Same as ``pchain`` of the plans with their metadata."""
+        rets = deque()
+        try:
+            for s, p in zip(metadata, plans):
+                self.md = s
+                rets.append((yield from p))
+        except RunEngineControlException:
+            for p in plans:
+                p.close()
+            raise
+        finally:
+            self.md = None
+        return tuple(rets)
+
+
+def _read_filter_positions(msg):
+    """Read the filters and put their positions in the start."""
     filter_bank = xpd_configuration["filter_bank"]
     filter_status = dict()
     for name in filter_bank.read_attrs:
@@ -610,6 +924,10 @@ def __inject_filter_positions(msg):
     for name, status in filter_status.items():
         print("INFO: {} : {}".format(name, status))
     msg.kwargs["filter_positions"] = filter_status
+
+
+def __inject_filter_positions(msg):
+    yield from _read_filter_positions(msg)
     return (yield msg)
 
 
@@ -833,11 +1151,12 @@ def translate_to_sample(
     Returns
     -------
     sample_md :
-        The sample info loaded
+        The sample info loaded. It is a new dict copied from the cached
+        ``Sample.flat_md`` of a registered sample, so it can be changed.
     """
     if isinstance(sample, int):
         try:
-            return dict(beamtime.samples.sel(sample))
+            return dict(beamtime.samples.sel(sample).flat_md)
         except IndexError:
             raise xpdAcqError(
                 "ERROR: hmm, there is no sample with index `{}`"
@@ -847,7 +1166,7 @@ def translate_to_sample(
             )
     elif isinstance(sample, str):
         try:
-            return dict(beamtime.samples[sample])
+            return dict(beamtime.samples[sample].flat_md)
         except KeyError:
             raise xpdAcqError(
                 "ERROR: hmm, there is no sample with key `{}`"
@@ -863,31 +1182,85 @@ def translate_to_sample(
         raise TypeError(f"The type of sample is {type(sample)}. Expect int, str, dict.")
 
 
-def translate_to_plan(beamtime: Beamtime, plan: typing.Union[int, str, ScanPlan]) -> typing.Generator:
-    """Translate a plan input into a generator.
+def lazy_pchain(
+    beamtime: Beamtime,
+    samples: typing.Iterable[typing.Union[int, str, dict]],
+    plans: typing.Iterable[typing.Union[int, str, ScanPlan, typing.Generator]],
+    *,
+    robot: bool = False,
+    running: RunningSample = None
+) -> typing.Generator:
+    """Chain the plans of the samples, looking up and making each one only when the previous one is finished.
+
+    It is the same as ``pchain`` of the plans wrapped by ``xpdacq_composer``, but only one sample and plan
+    of the queue are looked up and made at a time.
+
+    Parameters
+    ----------
+    beamtime :
+        The BeamTime instance.
+
+    samples :
+        The samples, see ``translate_to_sample``.
+
+    plans :
+        The plans, see ``translate_to_plan``.
+
+    robot :
+        If True, each plan is wrapped in the robot load and unload messages.
+
+    running :
+        If given, it holds the metadata of the running plan for a ``MsgDispatcher``, instead of each plan
+        being wrapped by ``inject_metadata``.
+
+    Returns
+    -------
+    rets : tuple
+        The return values of the plans.
+    """
+    rets = deque()
+    for sample, plan in zip(samples, plans):
+        s = translate_to_sample(beamtime, sample)
+        bp_plan = translate_to_plan(beamtime, plan)
+        if robot:
+            bp_plan = gen_robot_plans(beamtime, [s], [bp_plan])[0]
+        if running is None:
+            bp_plan = inject_metadata(bp_plan, s)
+        else:
+            running.md = s
+        try:
+            rets.append((yield from bp_plan))
+        except RunEngineControlException:
+            bp_plan.close()
+            raise
+        finally:
+            if running is not None:
+                running.md = None
+    return tuple(rets)
+
+
+def resolve_plan(
+    beamtime: Beamtime,
+    plan: typing.Union[int, str, ScanPlan, typing.Generator]
+) -> typing.Union[ScanPlan, typing.Generator]:
+    """Find the ScanPlan of a plan input without making its generator.
 
     Parameters
     ----------
     beamtime : Beamtime
         The BeamTime instance.
 
-    plan : int, str, or dict-like
-        Scan plan. If a beamtime object is linked, an integer
-        will be interpreted as the index appears in the
-        ``bt.list()`` method, corresponding scan plan will be
-        A generator or that yields ``Msg`` objects (or an iterable
-        that returns such a generator) can also be passed.
+    plan : int, str, ScanPlan or generator
+        Scan plan, see ``translate_to_plan``.
 
     Returns
     -------
-    plan : generator
-        The generator of messages for the plan。
+    plan : ScanPlan or generator
+        The ScanPlan registered in the beamtime, or the generator given.
     """
-    # If a plan is given as a int, look in up in the global registry.
     if isinstance(plan, int):
         try:
-            scanplan = beamtime.scanplans.sel(plan)
-            return scanplan.factory()
+            return beamtime.scanplans.sel(plan)
         except IndexError:
             raise xpdAcqError(
                 "ERROR: hmm, there is no scanplan with index `{}`"
@@ -895,11 +1268,9 @@ def translate_to_plan(beamtime: Beamtime, plan: typing.Union[int, str, ScanPlan]
                     plan
                 )
             )
-    # If the plan is an xpdAcq 'ScanPlan', make the actual plan.
     elif isinstance(plan, str):
         try:
-            scanplan = beamtime.scanplans[plan]
-            return scanplan.factory()
+            return beamtime.scanplans[plan]
         except KeyError:
             raise xpdAcqError(
                 "ERROR: hmm, there is no scanplan with key `{}`"
@@ -907,14 +1278,60 @@ def translate_to_plan(beamtime: Beamtime, plan: typing.Union[int, str, ScanPlan]
                     plan
                 )
             )
-    elif isinstance(plan, ScanPlan):
-        return plan.factory()
-    elif isinstance(plan, Generator):
+    elif isinstance(plan, (ScanPlan, Generator)):
         return plan
     else:
         raise TypeError(f"The type of plan is {type(plan)}. Expect int, str, ScanPlan or generator.")
 
 
+def translate_to_plan(beamtime: Beamtime, plan: typing.Union[int, str, ScanPlan]) -> typing.Generator:
+    """Translate a plan input into a generator.
+
+    Parameters
+    ----------
+    beamtime : Beamtime
+        The BeamTime instance.
+
+    plan : int, str, or dict-like
+        Scan plan. If a beamtime object is linked, an integer
+        will be interpreted as the index appears in the
+        ``bt.list()`` method, corresponding scan plan will be
+        A generator or that yields ``Msg`` objects (or an iterable
+        that returns such a generator) can also be passed.
+
+    Returns
+    -------
+    plan : generator
+        The generator of messages for the plan。
+    """
+    # If the plan is an xpdAcq 'ScanPlan', make the actual plan.
+    scanplan = resolve_plan(beamtime, plan)
+    if isinstance(scanplan, ScanPlan):
+        return scanplan.factory()
+    return scanplan
+
+
+def _queued_sample(beamtime: Beamtime, sample: typing.Union[int, str, dict]) -> typing.Union[str, dict]:
+    """Return the name of a registered sample or the dict of a sample to save in the queue."""
+    md = translate_to_sample(beamtime, sample)
+    if isinstance(sample, (int, str)):
+        return md["sample_name"]
+    return dict(md)
+
+
+def _queued_plan(beamtime: Beamtime, plan: typing.Union[int, str, ScanPlan]) -> str:
+    """Return the name of a registered ScanPlan to save in the queue."""
+    scanplan = resolve_plan(beamtime, plan)
+    if not isinstance(scanplan, ScanPlan):
+        raise TypeError("A generator cannot be saved in the queue. Please use a registered ScanPlan.")
+    if isinstance(plan, str):
+        return plan
+    for key, value in beamtime.scanplans.items():
+        if value is scanplan:
+            return key
+    raise xpdAcqError("ERROR: the ScanPlan `{}` is not registered in the beamtime.".format(scanplan.short_summary()))
+
+
 def _normalize_sample_plan(sample, plan) -> typing.Tuple[list, list]:
     """Normalize samples and plans to list of samples and plans
 
@@ -971,7 +1388,7 @@ def print_plans(
             # Check if this is a registered scanplan
             if isinstance(pp, int):
                 print(
-                    indent("{}".format(list(beamtime.scanplans.values())[pp]), "\t")
+                    indent("{}".format(beamtime.scanplans.sel(pp)), "\t")
                 )
             else:
                 print(
@@ -23,13 +23,31 @@ import subprocess
 import time
 import warnings
 
-import yaml
 from xpdconf.conf import glbl_dict, GLBL_YAML_PATH
 
-from .tools import xpdAcqException
-from .yamldict import YamlDict
+from . import serializer
+from .tools import (
+    atomic_write,
+    set_durability,
+    wait_flushed,
+    write_in_background,
+    xpdAcqException,
+)
+from .yamldict import YamlDict, _count_flush, flush_suspended
 
 glbl_dict.pop("exp_db")
+# durability of the yaml files, see xpdacq.tools.atomic_write
+glbl_dict.setdefault("yaml_durability", "none")
+# codec of the files only read by xpdacq, see xpdacq.serializer
+glbl_dict.setdefault("machine_codec", "yaml")
+# write the glbl file in a background thread, see xpdacq.tools.wait_flushed
+glbl_dict.setdefault("async_flush", False)
+# the maximum number of the calibration results kept of each detector, see xpdacq.ipysetup
+glbl_dict.setdefault("calib_cache_size", 32)
+# the tolerance of the det_z position of the calibration results, 0 for the same position, see xpdacq.ipysetup
+glbl_dict.setdefault("calib_tolerance", 0.)
+# interpolate the calibration results between the det_z positions, see xpdacq.ipysetup
+glbl_dict.setdefault("calib_interpolate", False)
 XPDACQ_MD_VERSION = 0.1
 
 # special function and dict to store all necessary objects
@@ -81,7 +99,7 @@ def _set_first_max_age(val: float):
 def _verify_within_test(beamline_config_fp, verif):
     while verif != "y":
         with open(beamline_config_fp, "r") as f:
-            beamline_config = yaml.unsafe_load(f)
+            beamline_config = serializer.load(f)
         warnings.warn("Not verified")
         verif = "y"
     beamline_config["Verified by"] = "AUTO VERIFIED IN TEST"
@@ -89,8 +107,7 @@ def _verify_within_test(beamline_config_fp, verif):
     beamline_config["Verification time"] = timestamp.strftime(
         "%Y-%m-%d %H:%M:%S"
     )
-    with open(beamline_config_fp, "w") as f:
-        yaml.dump(beamline_config, f)
+    atomic_write(beamline_config_fp, serializer.dump(beamline_config))
     return beamline_config
 
 
@@ -111,7 +128,7 @@ def _load_beamline_config(beamline_config_fp, verif="", test=False):
     if not test:
         while verif.upper() != ("Y" or "YES"):
             with open(beamline_config_fp, "r") as f:
-                beamline_config = yaml.unsafe_load(f)
+                beamline_config = serializer.load(f)
             pp.pprint(beamline_config)
             verif = input("\nIs this configuration correct? y/n: ")
             if verif.upper() == ("N" or "NO"):
@@ -122,8 +139,7 @@ def _load_beamline_config(beamline_config_fp, verif="", test=False):
         beamline_config["Verification time"] = timestamp.strftime(
             "%Y-%m-%d %H:%M:%S"
         )
-        with open(beamline_config_fp, "w") as f:
-            yaml.dump(beamline_config, f)
+        atomic_write(beamline_config_fp, serializer.dump(beamline_config))
     return beamline_config
 
 
@@ -137,9 +153,11 @@ def _reload_glbl(glbl_yaml_path=None):
     """
     if glbl_yaml_path is None:
         glbl_yaml_path = glbl_dict["glbl_yaml_path"]
+    # the file may be in the queue of the background writer
+    wait_flushed()
     if os.path.isfile(glbl_yaml_path):
-        with open(glbl_dict["glbl_yaml_path"]) as f:
-            reload_dict = yaml.unsafe_load(f)
+        # the cache may be binary, see xpdacq.serializer.set_machine_codec
+        reload_dict = serializer.load_file(glbl_dict["glbl_yaml_path"])
         return reload_dict
     else:
         pass
@@ -178,7 +196,18 @@ class GlblYamlDict(YamlDict):
     """
 
     # required attributes for yaml
-    _VALID_ATTRS = ["_name", "_filepath", "filepath", "_referenced_by"]
+    _VALID_ATTRS = [
+        "_name",
+        "_filepath",
+        "filepath",
+        "_referenced_by",
+        "_batch_depth",
+        "_flush_pending",
+        "_dirty",
+        "_digest",
+        "_flush_stats",
+        "_version",
+    ]
 
     # keys for fields allowed to change
     _MUTABLE_FIELDS = [
@@ -192,13 +221,23 @@ class GlblYamlDict(YamlDict):
         "calib_config_dict",
         "image_field",
         "exp_hash_uid",
-        "_active_beamtime"
+        "_active_beamtime",
+        "yaml_durability",
+        "machine_codec",
+        "async_flush",
+        "calib_cache_size",
+        "calib_tolerance",
+        "calib_interpolate",
     ]
 
     def __init__(self, name, **kwargs):
         super().__init__(name=name, **kwargs)
         self._referenced_by = []
         self._name = name
+        if "yaml_durability" in self:
+            set_durability(self["yaml_durability"])
+        if "machine_codec" in self:
+            serializer.set_machine_codec(self["machine_codec"])
 
     @property
     def mutable_fields(self):
@@ -218,6 +257,10 @@ class GlblYamlDict(YamlDict):
                 configure_frame_acq_time(val)
             elif key == "dk_window":
                 _set_first_max_age(val)
+            elif key == "yaml_durability":
+                set_durability(val)
+            elif key == "machine_codec":
+                serializer.set_machine_codec(val)
             super().__setitem__(key, val)
 
     def __setattr__(self, key, val):
@@ -240,10 +283,56 @@ class GlblYamlDict(YamlDict):
                 _set_first_max_age(val)
             super().__setattr__(key, val)
 
+    def _restore(self, snapshot):
+        # fields with side effects on devices are set again to revert them
+        reapply = [
+            key
+            for key in (
+                "frame_acq_time", "dk_window", "yaml_durability", "machine_codec"
+            )
+            if key in snapshot and self.get(key) != snapshot[key]
+        ]
+        super()._restore(snapshot)
+        for key in reapply:
+            self[key] = snapshot[key]
+
+    def _storage_yaml(self):
+        # the glbl file is a cache only read by xpdacq
+        return serializer.encode_machine(dict(self))
+
+    def flush(self, force=False):
+        """
+        Ensure any mutable values are updated on disk.
+
+        If glbl['async_flush'] is True, the contents are serialized and
+        written by the background thread of `xpdacq.tools` and the call
+        returns at once. The last contents submitted are written, use
+        `xpdacq.tools.wait_flushed` to wait for the write.
+        """
+        if (
+            not self.get("async_flush")
+            or flush_suspended()
+            or self._batch_depth
+            or not (self._dirty or force)
+        ):
+            # an older write in the queue must not replace this one
+            wait_flushed()
+            return super().flush(force)
+        _count_flush(self, "requested")
+        self._dirty = False
+        # the nested values are replaced, not edited, by xpdacq
+        data = dict(self)
+        write_in_background(
+            self.filepath, lambda: serializer.encode_machine(data)
+        )
+        # the file is not known to hold the digest anymore
+        self._digest = None
+        _count_flush(self, "performed")
+
     @classmethod
     def from_yaml(cls, f):
         """method to reload object from local yaml"""
-        d = yaml.unsafe_load(f)
+        d = serializer.load(f)
         instance = cls.from_dict(d)
         if not isinstance(f, str):
             instance.filepath = os.path.abspath(f.name)
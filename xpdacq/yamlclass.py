@@ -16,7 +16,8 @@
 
 import os
 
-import yaml
+from . import serializer
+from .tools import atomic_write
 
 
 class YamlClass:
@@ -62,5 +63,7 @@ class YamlClass:
 
     def flush(self):
         """method to yamlize allowed attributes"""
-        with open(self._filepath, "w") as f:
-            yaml.dump(self._internal_dict, f, default_flow_style=False)
+        atomic_write(
+            self._filepath,
+            serializer.dump(self._internal_dict, default_flow_style=False),
+        )
@@ -13,11 +13,51 @@ from __future__ import (
 )
 
 import abc
+import contextlib
+import hashlib
 import os
 import tempfile
-from collections import ChainMap
+from collections import ChainMap, Counter
 
-import yaml
+from . import serializer
+from .tools import atomic_write
+
+# flush counters summed over all the YAML-backed objects, for monitoring
+FLUSH_STATS = Counter(requested=0, performed=0, skipped=0)
+
+
+def reset_flush_stats():
+    """Reset the module level flush counters to zero."""
+    for key in FLUSH_STATS:
+        FLUSH_STATS[key] = 0
+
+
+def _count_flush(obj, key):
+    obj._flush_stats[key] += 1
+    FLUSH_STATS[key] += 1
+
+
+_suspended = {"depth": 0}
+
+
+@contextlib.contextmanager
+def suspend_flush():
+    """
+    Do not write the objects created or modified inside the block.
+
+    It is used to rebuild objects from a storage they are already in sync
+    with, e.g. a `xpdacq.sqlitestore.SqliteStore`.
+    """
+    _suspended["depth"] += 1
+    try:
+        yield
+    finally:
+        _suspended["depth"] -= 1
+
+
+def flush_suspended():
+    """Whether the flushes are suspended by `suspend_flush`."""
+    return bool(_suspended["depth"])
 
 
 class _YamlDictLike:
@@ -25,12 +65,22 @@ class _YamlDictLike:
     A dict-like wrapper over a YAML file
 
     Supports the dict-like (MutableMapping) interface plus a `flush` method
-    to manually update the file to the state of the dict.
+    to manually update the file to the state of the dict. Use `batch` to
+    group several mutations into a single write.
+
+    The file is only rewritten when the serialized contents differ from
+    the last write. The counters are available in `flush_stats`.
     """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._referenced_by = []  # to be flushed whenever this is flushed
+        self._batch_depth = 0  # > 0 while inside `batch`
+        self._flush_pending = False  # a flush was deferred by `batch`
+        self._dirty = True  # contents may differ from the file
+        self._digest = None  # digest of the last written yaml
+        self._flush_stats = Counter(requested=0, performed=0, skipped=0)
+        self._version = 0  # bumped on each change of the contents
         self.filepath = self.default_yaml_path()
 
     def default_yaml_path(self):
@@ -43,6 +93,8 @@ class _YamlDictLike:
     @filepath.setter
     def filepath(self, fname):
         self._filepath = fname
+        self._digest = None
+        self._dirty = True
         # dont create dir if parent doesn't exist yet
         # os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
         if os.path.isdir(os.path.dirname(self.filepath)):
@@ -58,17 +110,17 @@ class _YamlDictLike:
 
     def __setitem__(self, key, val):
         res = super().__setitem__(key, val)
-        self.flush()
+        self._mutated()
         return res
 
     def __delitem__(self, key):
         res = super().__delitem__(key)
-        self.flush()
+        self._mutated()
         return res
 
     def clear(self):
         res = super().clear()
-        self.flush()
+        self._mutated()
         return res
 
     def copy(self):
@@ -76,41 +128,167 @@ class _YamlDictLike:
 
     def pop(self, key):
         res = super().pop(key)
-        self.flush()
+        self._mutated()
         return res
 
     def popitem(self):
         res = super().popitem()
-        self.flush()
+        self._mutated()
         return res
 
     def update(self, *args, **kwargs):
         res = super().update(*args, **kwargs)
-        self.flush()
+        self._mutated()
         return res
 
     def setdefault(self, key, val):
         res = super().setdefault(key, val)
-        self.flush()
+        self._mutated()
         return res
 
-    def flush(self):
+    def _storage_yaml(self):
+        """Return the yaml written to the file by `flush`."""
+        return self.to_yaml()
+
+    def _write(self, text):
+        """Write the yaml of `_storage_yaml` to the storage."""
+        atomic_write(self.filepath, text)
+
+    def _stored(self):
+        """Whether the storage holds a previous write."""
+        return os.path.isfile(self.filepath)
+
+    @property
+    def flush_stats(self):
+        """The number of flushes requested, performed and skipped."""
+        return dict(self._flush_stats)
+
+    def _mutated(self):
+        """Mark the contents as changed and write them to disk."""
+        self._dirty = True
+        self._version += 1
+        self.flush()
+
+    def flush(self, force=False):
         """
         Ensure any mutable values are updated on disk.
+
+        The object is always serialized, so that a nested value edited in
+        place is written, and the write is skipped if the yaml is the same
+        as the last one written. Inside a `batch` block the write is
+        deferred to the end of the block.
+
+        Parameters
+        ----------
+        force : bool, optional
+            Write the file even if the yaml is the same as the last one
+            written. Default to False.
         """
-        with open(self.filepath, "w") as f:
-            self.to_yaml(f)
+        _count_flush(self, "requested")
+        if _suspended["depth"]:
+            self._dirty = False
+            _count_flush(self, "skipped")
+            return
+        if force:
+            self._digest = None
+        if self._batch_depth:
+            self._flush_pending = True
+            return
+        self._flush_pending = False
+        self._dirty = False
+        text = self._storage_yaml()
+        raw = text.encode("utf-8") if isinstance(text, str) else text
+        digest = hashlib.sha1(raw).hexdigest()
+        if digest == self._digest and self._stored():
+            _count_flush(self, "skipped")
+            return
+        # a nested value may have been edited in place
+        self._version += 1
+        self._write(text)
+        self._digest = digest
+        _count_flush(self, "performed")
+        # the objects referencing this one embed its contents
         for ref in self._referenced_by:
+            ref._dirty = True
             ref.flush()
 
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Group mutations into one write per file.
+
+        Inside the block, mutations of this object and of the objects that
+        reference it (e.g. the Samples and ScanPlans of a Beamtime) only
+        change the memory. On exit, each touched file is written once. If an
+        exception is raised in the block, all of them are rolled back to
+        their state on entry and nothing is written.
+
+        Examples
+        --------
+        >>> with bt.batch():
+        ...     bt["bt_wavelength"] = 0.1832
+        ...     bt["bt_experimenters"] = ["Max", "Soham"]
+        """
+        members = self._batch_members()
+        snapshots = [obj._snapshot() for obj in members]
+        for obj in members:
+            obj._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            for obj, snapshot in zip(members, snapshots):
+                obj._restore(snapshot)
+                obj._version += 1
+            for obj in members:
+                obj._batch_depth -= 1
+                if not obj._batch_depth:
+                    obj._flush_pending = False
+            raise
+        for obj in members:
+            obj._batch_depth -= 1
+        # flushing self also flushes everything referencing it
+        if not self._batch_depth and self._flush_pending:
+            self.flush()
+        for obj in members:
+            if not obj._batch_depth and obj._flush_pending:
+                obj.flush()
+
+    def _batch_members(self):
+        """This object and all the objects flushed along with it."""
+        members = {}
+        stack = [self]
+        while stack:
+            obj = stack.pop()
+            if id(obj) not in members:
+                members[id(obj)] = obj
+                stack.extend(obj._referenced_by)
+        return list(members.values())
+
+    @abc.abstractmethod
+    def _snapshot(self):
+        """Return a copy of the own contents for `_restore`."""
+        pass
+
+    @abc.abstractmethod
+    def _restore(self, snapshot):
+        """Reset the own contents to a `_snapshot` without flushing."""
+        pass
+
 
 class YamlDict(_YamlDictLike, dict):
     def to_yaml(self, f=None):
-        return yaml.dump(dict(self), f, default_flow_style=False)
+        return serializer.dump(dict(self), f, default_flow_style=False)
+
+    def _snapshot(self):
+        return dict(self)
+
+    def _restore(self, snapshot):
+        dict.clear(self)
+        dict.update(self, snapshot)
 
     @classmethod
     def from_yaml(cls, f):
-        d = yaml.unsafe_load(f)
+        d = serializer.load(f)
         # If file is empty, make it an empty dict.
         if d is None:
             d = {}
@@ -126,13 +304,21 @@ class YamlDict(_YamlDictLike, dict):
 
 class YamlChainMap(_YamlDictLike, ChainMap):
     def to_yaml(self, f=None):
-        return yaml.dump(
+        return serializer.dump(
             list(map(dict, self.maps)), f, default_flow_style=False
         )
 
+    def _snapshot(self):
+        # the parent maps are restored by their owners
+        return dict(self.maps[0])
+
+    def _restore(self, snapshot):
+        self.maps[0].clear()
+        self.maps[0].update(snapshot)
+
     @classmethod
     def from_yaml(cls, f):
-        maps = yaml.unsafe_load(f)
+        maps = serializer.load(f)
         # If file is empty, make it an empty list.
         if maps is None:
             maps = []
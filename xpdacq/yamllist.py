@@ -12,7 +12,12 @@ from __future__ import (
     unicode_literals,
 )
 
-import yaml
+import hashlib
+import json
+import os
+
+from . import serializer
+from .tools import atomic_write, get_durability
 
 
 class YamlList(list):
@@ -27,7 +32,7 @@ class YamlList(list):
     def __init__(self, fname):
         self.fname = fname
         with open(fname, "r") as f:
-            lst = yaml.unsafe_load(f)
+            lst = serializer.load(f)
         # If file is empty, make it an empty list.
         if lst is None:
             lst = []
@@ -83,5 +88,200 @@ class YamlList(list):
         """
         Ensure any mutable values are updated on disk.
         """
-        with open(self.fname, "w") as f:
-            yaml.dump(list(self), f)
+        atomic_write(self.fname, serializer.dump(list(self)))
+
+
+def _load_list(fname):
+    """Return the raw contents of the file and the list in it."""
+    with open(fname, "rb") as f:
+        raw = f.read()
+    lst = serializer.load(raw)
+    # If file is empty, make it an empty list.
+    if lst is None:
+        lst = []
+    elif not isinstance(lst, list):
+        raise TypeError("yamllist only applies to YAML files with a list")
+    return raw, lst
+
+
+def _replay(lst, journal_fname, raw):
+    """Apply the mutations in the journal of the snapshot `raw` to the list."""
+    if not os.path.isfile(journal_fname):
+        return 0
+    with open(journal_fname, "r") as f:
+        lines = f.read().splitlines()
+    try:
+        header = json.loads(lines[0])
+    except (IndexError, ValueError):
+        return 0
+    # the journal of an older snapshot is already in the snapshot
+    if header.get("snapshot") != hashlib.sha1(raw).hexdigest():
+        return 0
+    n_records = 0
+    for line in lines[1:]:
+        try:
+            op, encoded = json.loads(line)
+            args = serializer.load(encoded)
+        except ValueError:
+            # the last record of a killed process
+            break
+        getattr(list, op)(lst, *args)
+        n_records += 1
+    return n_records
+
+
+def read_journaled_list(fname):
+    """Return the list of a `JournaledYamlList` file without writing it."""
+    raw, lst = _load_list(fname)
+    _replay(lst, fname + ".journal", raw)
+    return lst
+
+
+class JournaledYamlList(YamlList):
+    """
+    A YamlList writing its mutations to an append-only journal
+
+    The file holds a snapshot of the list and the file '<fname>.journal'
+    the mutations since the snapshot, one json line each. The journal is
+    replayed when the list is loaded. It is compacted into the snapshot
+    when it has more records than the snapshot has items, on `flush` and on
+    `close`, so a mutation costs O(1) amortized. If another writer has
+    replaced the file or the journal, the whole list is written again.
+
+    Parameters
+    ----------
+    fname : str
+        path to the snapshot file.
+    items : iterable, optional
+        initial contents. If given, the file is created or overwritten
+        with them. Otherwise, the file is loaded.
+    codec : str, optional
+        codec of the snapshot, see `xpdacq.serializer.encode`. Default to
+        'yaml'.
+    compact_min : int, optional
+        minimal number of records in the journal before a compaction.
+    """
+
+    def __init__(self, fname, items=None, *, codec="yaml", compact_min=1000):
+        self.fname = fname
+        self.codec = codec
+        self.compact_min = compact_min
+        self._n_records = 0
+        self._journal_stat = None
+        if items is None:
+            raw, lst = _load_list(fname)
+            list.__init__(self, lst)
+            _replay(self, self.journal_fname, raw)
+        else:
+            list.__init__(self, items)
+        self.compact()
+
+    @property
+    def journal_fname(self):
+        return self.fname + ".journal"
+
+    def __setitem__(self, index, val):
+        list.__setitem__(self, index, val)
+        if isinstance(index, slice):
+            self.compact()
+        else:
+            self._log("__setitem__", index, val)
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        if isinstance(index, slice):
+            self.compact()
+        else:
+            self._log("__delitem__", index)
+
+    def append(self, val):
+        list.append(self, val)
+        self._log("append", val)
+
+    def clear(self):
+        list.clear(self)
+        self.compact()
+
+    def extend(self, val):
+        val = list(val)
+        list.extend(self, val)
+        self._log("extend", val)
+
+    def insert(self, index, val):
+        list.insert(self, index, val)
+        self._log("insert", index, val)
+
+    def pop(self, index=-1):
+        val = list.pop(self, index)
+        self._log("pop", index)
+        return val
+
+    def remove(self, val):
+        list.remove(self, val)
+        self._log("remove", val)
+
+    def reverse(self):
+        list.reverse(self)
+        self.compact()
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self.compact()
+
+    def _log(self, op, *args):
+        """Append a mutation to the journal."""
+        try:
+            st = os.stat(self.journal_fname)
+        except FileNotFoundError:
+            st = None
+        if st is None or (st.st_ino, st.st_size) != self._journal_stat:
+            # the journal is not the one of our snapshot anymore
+            self.compact()
+            return
+        line = json.dumps([op, serializer.encode(list(args), "json")])
+        with open(self.journal_fname, "a") as f:
+            f.write(line + "\n")
+            f.flush()
+            if get_durability() != "none":
+                os.fsync(f.fileno())
+            st = os.fstat(f.fileno())
+        self._journal_stat = (st.st_ino, st.st_size)
+        self._n_records += 1
+        if self._n_records > max(self.compact_min, self._snapshot_len):
+            self.compact()
+
+    def compact(self):
+        """
+        Write the list to the snapshot and empty the journal.
+        """
+        raw = serializer.encode(list(self), self.codec, default_flow_style=False)
+        if isinstance(raw, str):
+            raw = raw.encode("utf-8")
+        atomic_write(self.fname, raw)
+        # a journal of a previous snapshot is ignored on a crash here
+        atomic_write(
+            self.journal_fname,
+            json.dumps({"snapshot": hashlib.sha1(raw).hexdigest()}) + "\n",
+        )
+        st = os.stat(self.journal_fname)
+        self._journal_stat = (st.st_ino, st.st_size)
+        self._n_records = 0
+        self._snapshot_len = len(self)
+
+    def flush(self):
+        """
+        Ensure any mutable values are updated on disk.
+        """
+        self.compact()
+
+    def close(self):
+        """
+        Compact the journal into the snapshot.
+        """
+        self.compact()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()